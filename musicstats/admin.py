@@ -18,6 +18,10 @@
 """
 
 from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 from rest_framework.authtoken.admin import TokenAdmin
 from musicstats.models import (
     Artist,
@@ -29,6 +33,7 @@ from musicstats.models import (
     MarketingLiner,
     WordpressPresenterDataSource,
     Presenter,
+    ProfileReport,
 )
 
 admin.site.register(Artist)
@@ -42,3 +47,92 @@ admin.site.register(WordpressPresenterDataSource)
 admin.site.register(Presenter)
 
 TokenAdmin.raw_id_fields = ["user"]
+
+
+class ProfileReportAdmin(admin.ModelAdmin):
+    """
+    Lists request profiles, with the cProfile data to download (for pstats,
+    snakeviz and the like).
+    """
+
+    list_display = [
+        "created",
+        "method",
+        "path",
+        "view",
+        "status_code",
+        "duration",
+        "query_count",
+        "query_time",
+        "requested_by",
+    ]
+    list_filter = ["view", "requested_by"]
+    search_fields = ["path"]
+    exclude = ["queries", "stats", "profile"]
+    readonly_fields = [
+        "created",
+        "requested_by",
+        "method",
+        "path",
+        "view",
+        "status_code",
+        "duration",
+        "query_count",
+        "query_time",
+        "download",
+        "slowest_queries",
+        "profile_stats",
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:report_id>/download/",
+                self.admin_site.admin_view(self.download_view),
+                name="musicstats_profilereport_download",
+            )
+        ] + super().get_urls()
+
+    def download_view(self, request, report_id):
+        """
+        Downloads the cProfile data for a report.
+        """
+
+        report = get_object_or_404(ProfileReport, pk=report_id)
+        response = HttpResponse(
+            bytes(report.profile), content_type="application/octet-stream"
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="profile_{report.id}.prof"'
+        return response
+
+    @admin.display(description="Profile")
+    def download(self, report):
+        return format_html(
+            '<a href="{}">Download</a>',
+            reverse("admin:musicstats_profilereport_download", args=[report.id]),
+        )
+
+    @admin.display(description="Slowest queries")
+    def slowest_queries(self, report):
+        queries = sorted(report.queries, key=lambda query: -query["time"])[:10]
+        return format_html(
+            "<pre>{}</pre>",
+            "\n\n".join(
+                f"{query['time'] * 1000:.1f}ms: {query['sql']}" for query in queries
+            ),
+        )
+
+    @admin.display(description="Stats")
+    def profile_stats(self, report):
+        return format_html("<pre>{}</pre>", report.stats)
+
+
+admin.site.register(ProfileReport, ProfileReportAdmin)
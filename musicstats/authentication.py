@@ -0,0 +1,169 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import hashlib
+import hmac
+import uuid
+from typing import FrozenSet, Optional
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.authentication import BasicAuthentication
+from musicstats.models import Station
+
+
+class AuthenticationCache:
+    """Remembers who's behind a set of credentials for a short while.
+
+    Only IDs are kept (credentials themselves only ever as a keyed hash).
+    The user is loaded again on every request, so deactivating them or
+    changing their password takes effect straight away whichever cache is
+    set up.
+
+    Only passwords are remembered. Tokens go through plain
+    TokenAuthentication and aren't cached: looking one up is a single
+    indexed query, which is all a cache hit would save once the user's
+    loaded again.
+
+    The stations each user may update are remembered too; saving or deleting
+    a station changes a version stamp (see signals.py) which invalidates
+    them. With a per-process cache (LocMem) other processes only see that
+    within INGEST_AUTH_CACHE_TTL seconds, so use a shared cache (e.g. Redis)
+    for it to be immediate.
+    """
+
+    STATIONS_VERSION_KEY = "musicstats_auth_stations_version"
+
+    def get(self, scheme: str, credentials: str) -> Optional[tuple]:
+        """Obtains the user who authenticated with some credentials.
+
+        Args:
+            scheme (str): The authentication scheme (e.g. Token).
+            credentials (str): The credentials supplied.
+
+        Returns:
+            tuple: The ID of the user and the stamp of their password at the
+                time (or None if we don't know).
+        """
+
+        return cache.get(self._key(scheme, credentials))
+
+    def remember(self, scheme: str, credentials: str, user_id: int, stamp: str = None):
+        """Remembers the user who authenticated with some credentials.
+
+        Args:
+            scheme (str): The authentication scheme (e.g. Token).
+            credentials (str): The credentials supplied.
+            user_id (int): The ID of the user.
+            stamp (str): A keyed hash of their password, if it was checked.
+        """
+
+        cache.set(
+            self._key(scheme, credentials),
+            (user_id, stamp),
+            settings.INGEST_AUTH_CACHE_TTL,
+        )
+
+    def stations(self, user_id: Optional[int]) -> FrozenSet[int]:
+        """Obtains the stations a user is allowed to update.
+
+        Args:
+            user_id (int): The ID of the user (or None if anonymous).
+
+        Returns:
+            FrozenSet[int]: The IDs of the stations.
+        """
+
+        if not user_id:
+            return frozenset()
+
+        key = f"musicstats_auth_stations_{user_id}"
+        entries = cache.get_many([key, self.STATIONS_VERSION_KEY])
+        version = entries.get(self.STATIONS_VERSION_KEY)
+        entry = entries.get(key)
+
+        if entry and version and entry[0] == version:
+            return entry[1]
+
+        if not version:
+            cache.add(self.STATIONS_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+            version = cache.get(self.STATIONS_VERSION_KEY)
+
+        station_ids = frozenset(
+            Station.objects.filter(update_account_id=user_id).values_list(
+                "id", flat=True
+            )
+        )
+        cache.set(key, (version, station_ids), settings.INGEST_AUTH_CACHE_TTL)
+        return station_ids
+
+    def forget_stations(self):
+        """
+        Forgets the stations every user is allowed to update.
+        """
+
+        cache.set(self.STATIONS_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+    def _key(self, scheme: str, credentials: str) -> str:
+        """
+        Obtains the cache key for a set of credentials.
+        """
+
+        return f"musicstats_auth_{keyed_hash(f'{scheme}:{credentials}')}"
+
+
+def keyed_hash(value: str) -> str:
+    """Hashes a value with the SECRET_KEY, so it's safe to keep in the cache.
+
+    Args:
+        value (str): The value to hash.
+
+    Returns:
+        str: The hex digest.
+    """
+
+    return hmac.new(
+        settings.SECRET_KEY.encode(), value.encode(), hashlib.sha256
+    ).hexdigest()
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic authentication that remembers passwords it's already checked,
+    saving hashing the password on every request.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        auth_cache = AuthenticationCache()
+        credentials = f"{userid}:{password}"
+        entry = auth_cache.get("Basic", credentials)
+
+        # Remembered against the stored password hash, so changing the
+        # password anywhere stops the old one working
+
+        if entry:
+            user = User.objects.filter(pk=entry[0], is_active=True).first()
+            if user and entry[1] == keyed_hash(user.password):
+                return (user, None)
+
+        result = super().authenticate_credentials(userid, password, request)
+        auth_cache.remember(
+            "Basic", credentials, result[0].id, keyed_hash(result[0].password)
+        )
+        return result
@@ -0,0 +1,109 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import os
+import time
+from typing import Callable, List
+from unittest import skipUnless
+
+# Benchmarks live alongside the tests but only run on request, e.g.
+# MUSICSTATS_BENCHMARK=1 python manage.py test
+
+BENCHMARKS_ENABLED = bool(os.getenv("MUSICSTATS_BENCHMARK"))
+
+benchmark = skipUnless(
+    BENCHMARKS_ENABLED, "Set MUSICSTATS_BENCHMARK=1 to run benchmarks."
+)
+
+
+class BenchmarkResult:
+    """Timings from a benchmark run."""
+
+    def __init__(self, name: str, timings: List[float], items: int):
+        self.name = name
+        self.timings = sorted(timings)
+        self.items = items
+
+    @property
+    def total(self) -> float:
+        """The total time taken across all iterations (seconds)."""
+        return sum(self.timings)
+
+    @property
+    def mean(self) -> float:
+        """The mean time per iteration (seconds)."""
+        return self.total / len(self.timings)
+
+    def percentile(self, percent: float) -> float:
+        """Obtains a percentile of the iteration timings.
+
+        Args:
+            percent (float): The percentile (0 - 100).
+
+        Returns:
+            float: The time at that percentile (seconds).
+        """
+
+        index = min(
+            len(self.timings) - 1, int(round(percent / 100 * (len(self.timings) - 1)))
+        )
+        return self.timings[index]
+
+    @property
+    def per_second(self) -> float:
+        """Items processed per second."""
+        return (self.items * len(self.timings)) / self.total if self.total else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.name}: {len(self.timings)} runs, mean {self.mean * 1000:.3f}ms, "
+            f"p50 {self.percentile(50) * 1000:.3f}ms, "
+            f"p99 {self.percentile(99) * 1000:.3f}ms, "
+            f"{self.per_second:.1f} items/sec"
+        )
+
+
+def measure(
+    name: str, func: Callable, iterations: int = 10, items: int = 1, warmup: int = 1
+) -> BenchmarkResult:
+    """Times repeated calls to a function and prints a summary.
+
+    Args:
+        name (str): The name of the benchmark.
+        func (Callable): The function to call. Receives the iteration number.
+        iterations (int): The number of timed calls.
+        items (int): The number of items each call processes.
+        warmup (int): The number of untimed calls made first.
+
+    Returns:
+        BenchmarkResult: The timings.
+    """
+
+    for iteration in range(warmup):
+        func(-1 - iteration)
+
+    timings = []
+    for iteration in range(iterations):
+        start = time.perf_counter()
+        func(iteration)
+        timings.append(time.perf_counter() - start)
+
+    result = BenchmarkResult(name, timings, items)
+    print(result)
+    return result
@@ -0,0 +1,312 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import List, Optional
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from musicstats import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def now_playing_group(station_id: int, shard: int = 0) -> str:
+    """Obtains the channel layer group listeners for a station join.
+
+    Args:
+        station_id (int): The ID of the station.
+        shard (int): The shard of the station's listeners.
+
+    Returns:
+        str: The group name.
+    """
+
+    if settings.NOW_PLAYING_GROUP_SHARDS <= 1:
+        return f"nowplaying_{station_id}"
+
+    return f"nowplaying_{station_id}_{shard}"
+
+
+def now_playing_groups(station_id: int) -> List[str]:
+    """Obtains every channel layer group listeners for a station join.
+
+    Args:
+        station_id (int): The ID of the station.
+
+    Returns:
+        List[str]: The group names.
+    """
+
+    return [
+        now_playing_group(station_id, shard)
+        for shard in range(max(settings.NOW_PLAYING_GROUP_SHARDS, 1))
+    ]
+
+
+def now_playing_shard(channel_name: str) -> int:
+    """Picks the shard a listener joins.
+
+    Args:
+        channel_name (str): The listener's channel name.
+
+    Returns:
+        int: The shard.
+    """
+
+    return zlib.crc32(channel_name.encode()) % max(settings.NOW_PLAYING_GROUP_SHARDS, 1)
+
+
+async def send_now_playing_async(
+    station_id: int, message: dict, play_id: Optional[int] = None
+):
+    """Informs websocket listeners of a new song play.
+
+    Every shard of the station's listeners is sent to at once.
+
+    Args:
+        station_id (int): The ID of the station the song was played on.
+        message (dict): The serialised song play.
+        play_id (int): The ID of the song play.
+    """
+
+    layer = get_channel_layer()
+    event = {
+        "type": "now_playing",
+        "message": message,
+        "id": play_id,
+        "station": station_id,
+    }
+
+    with metrics.broadcast_duration.time():
+        await asyncio.gather(
+            *[
+                layer.group_send(group, event)
+                for group in now_playing_groups(station_id)
+            ]
+        )
+
+
+def send_now_playing(station_id: int, message: dict, play_id: Optional[int] = None):
+    """Informs websocket listeners of a new song play (waiting until it's
+    sent).
+
+    Args:
+        station_id (int): The ID of the station the song was played on.
+        message (dict): The serialised song play.
+        play_id (int): The ID of the song play.
+    """
+
+    async_to_sync(send_now_playing_async)(station_id, message, play_id)
+
+
+@asynccontextmanager
+async def now_playing_subscription(station_id: int):
+    """Listens for new song plays on a station.
+
+    Used as an async context manager, giving a coroutine function that
+    waits for the next now playing event. Listening stops on exit.
+
+    Args:
+        station_id (int): The ID of the station.
+    """
+
+    layer = get_channel_layer()
+    channel = await layer.new_channel()
+    group = now_playing_group(station_id, now_playing_shard(channel))
+    await layer.group_add(group, channel)
+
+    async def receive() -> dict:
+        return await layer.receive(channel)
+
+    try:
+        yield receive
+    finally:
+        await layer.group_discard(group, channel)
+
+
+class CircuitBreaker:
+    """Stops us trying to broadcast for a while after repeated failures.
+
+    Once BROADCAST_BREAKER_THRESHOLD deliveries in a row have failed, we
+    give up on broadcasting for BROADCAST_BREAKER_RESET seconds. After that
+    a single delivery is let through to see if things have recovered.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        """Checks if we should try to broadcast.
+
+        Returns:
+            bool: True if we should try.
+        """
+
+        with self.lock:
+            if self.opened_at is None:
+                return True
+
+            if time.monotonic() - self.opened_at < settings.BROADCAST_BREAKER_RESET:
+                return False
+
+            # Let this one through to test the water
+
+            self.opened_at = time.monotonic()
+            return True
+
+    def succeeded(self):
+        """
+        Records a successful broadcast.
+        """
+
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failed(self):
+        """
+        Records a failed broadcast.
+        """
+
+        with self.lock:
+            self.failures += 1
+            if self.failures >= settings.BROADCAST_BREAKER_THRESHOLD:
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker()
+
+
+def deliver_now_playing(
+    station_id: int,
+    message: dict,
+    play_id: Optional[int] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+) -> bool:
+    """Sends a now playing update, retrying with a back off if it fails.
+
+    Args:
+        station_id (int): The ID of the station the song was played on.
+        message (dict): The serialised song play.
+        play_id (int): The ID of the song play.
+        circuit_breaker (CircuitBreaker): The breaker to use (defaults to the
+            shared one).
+
+    Returns:
+        bool: True if the update was sent.
+    """
+
+    circuit_breaker = circuit_breaker or breaker
+
+    for attempt in range(settings.BROADCAST_RETRIES + 1):
+        if not circuit_breaker.allow():
+            logger.warning(
+                "Not sending now playing for station %s as broadcasts are failing.",
+                station_id,
+            )
+            return False
+
+        try:
+            send_now_playing(station_id, message, play_id)
+            circuit_breaker.succeeded()
+            return True
+        except Exception:  # pylint: disable=broad-except
+            circuit_breaker.failed()
+            logger.warning(
+                "Failed to send now playing for station %s (attempt %s).",
+                station_id,
+                attempt + 1,
+                exc_info=True,
+            )
+
+        if attempt < settings.BROADCAST_RETRIES:
+            time.sleep(settings.BROADCAST_RETRY_DELAY * 2**attempt)
+
+    logger.error("Gave up sending now playing for station %s.", station_id)
+    return False
+
+
+# Broadcasts are sent from a small pool of threads so requests never wait
+# on the channel layer. Each station always uses the same thread, so its
+# updates (and any retries) go out in the order they were made. Past
+# BROADCAST_MAX_PENDING we drop updates rather than queue without limit.
+
+_executor_lock = threading.Lock()
+_executors = None
+_pending = None
+
+
+def broadcast_now_playing(
+    station_id: int, message: dict, play_id: Optional[int] = None
+):
+    """Informs websocket listeners of a new song play without waiting.
+
+    The update is sent once the current transaction commits (so listeners
+    never hear about a play that was rolled back), in the background.
+    Failures are logged but never raised.
+
+    Args:
+        station_id (int): The ID of the station the song was played on.
+        message (dict): The serialised song play.
+        play_id (int): The ID of the song play.
+    """
+
+    transaction.on_commit(partial(_submit, station_id, message, play_id))
+
+
+def _submit(station_id: int, message: dict, play_id: Optional[int]):
+    """
+    Hands a now playing update to the station's background thread.
+    """
+
+    global _executors, _pending  # pylint: disable=global-statement
+
+    if not settings.BROADCAST_WORKERS:
+        deliver_now_playing(station_id, message, play_id)
+        return
+
+    with _executor_lock:
+        if not _executors:
+            _executors = [
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcast")
+                for _ in range(settings.BROADCAST_WORKERS)
+            ]
+            _pending = threading.BoundedSemaphore(settings.BROADCAST_MAX_PENDING)
+
+    if not _pending.acquire(blocking=False):
+        logger.warning(
+            "Dropping now playing for station %s as too many are waiting.",
+            station_id,
+        )
+        return
+
+    executor = _executors[station_id % len(_executors)]
+    future = executor.submit(deliver_now_playing, station_id, message, play_id)
+    future.add_done_callback(lambda _: _pending.release())
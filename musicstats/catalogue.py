@@ -0,0 +1,229 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from typing import Callable, List
+from django.db import transaction
+from django.db.models import Count, Min
+from musicstats.models import Artist, Song, SongPlay
+from musicstats.normalise import artist_match_key, song_match_key
+
+
+class CatalogueNormaliser:
+    """Backfills match keys and merges duplicate songs and artists."""
+
+    # Fields we fill in on the survivor if it's missing them
+
+    ARTIST_DETAILS = ["musicbrainz_id", "wiki_content", "thumbnail", "image"]
+    SONG_DETAILS = [
+        "musicbrainz_id",
+        "wiki_content",
+        "thumbnail",
+        "image",
+        "itunes_url",
+        "amazon_url",
+    ]
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+
+    def _backfill(self, model, fields: List[str], key: Callable) -> int:
+        """Sets the match key on every row of a model, a batch at a time.
+
+        Args:
+            model: The model to backfill.
+            fields (List[str]): The fields the key is built from.
+            key (Callable): Builds the key from a row.
+
+        Returns:
+            int: The number of rows updated.
+        """
+
+        updated = 0
+        last_pk = 0
+
+        while True:
+            batch = list(
+                model.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", "match_key", *fields)[: self.batch_size]
+            )
+            if not batch:
+                return updated
+
+            changed = []
+            for row in batch:
+                match_key = key(row)
+                if row.match_key != match_key:
+                    row.match_key = match_key
+                    changed.append(row)
+
+            model.objects.bulk_update(changed, ["match_key"])
+            updated += len(changed)
+            last_pk = batch[-1].pk
+
+    def backfill_artists(self) -> int:
+        """Sets the match key on every artist.
+
+        Returns:
+            int: The number of artists updated.
+        """
+
+        return self._backfill(
+            Artist, ["name"], lambda artist: artist_match_key(artist.name)
+        )
+
+    def backfill_songs(self) -> int:
+        """Sets the match key on every song.
+
+        Returns:
+            int: The number of songs updated.
+        """
+
+        return self._backfill(
+            Song,
+            ["display_artist", "title"],
+            lambda song: song_match_key(song.display_artist, song.title),
+        )
+
+    def _duplicates(self, model):
+        """Finds groups of rows sharing a match key, a batch at a time.
+
+        Args:
+            model: The model to search.
+
+        Yields:
+            Tuple[int, List[int]]: The oldest row and its duplicates.
+        """
+
+        while True:
+            groups = list(
+                model.objects.values("match_key")
+                .annotate(count=Count("pk"), survivor=Min("pk"))
+                .filter(count__gt=1)
+                .order_by("match_key")[: self.batch_size]
+            )
+            if not groups:
+                return
+
+            for group in groups:
+                duplicates = list(
+                    model.objects.filter(match_key=group["match_key"])
+                    .exclude(pk=group["survivor"])
+                    .values_list("pk", flat=True)
+                )
+                yield (group["survivor"], duplicates)
+
+    def _fill_in(self, survivor, duplicates, fields: List[str]):
+        """Copies details onto the survivor where it doesn't have them.
+
+        Args:
+            survivor: The row we're keeping.
+            duplicates: The rows we're about to remove.
+            fields (List[str]): The fields to consider.
+        """
+
+        changed = []
+        for field in fields:
+            if getattr(survivor, field):
+                continue
+            for duplicate in duplicates:
+                if getattr(duplicate, field):
+                    setattr(survivor, field, getattr(duplicate, field))
+                    changed.append(field)
+                    break
+
+        if changed:
+            survivor.save(update_fields=changed)
+
+    def merge_artists(self) -> int:
+        """Merges artists sharing a match key into the oldest of them.
+
+        Returns:
+            int: The number of artists removed.
+        """
+
+        removed = 0
+        through = Song.artists.through
+
+        for (survivor_id, duplicate_ids) in self._duplicates(Artist):
+            with transaction.atomic():
+                survivor = Artist.objects.get(pk=survivor_id)
+                duplicates = list(Artist.objects.filter(pk__in=duplicate_ids))
+                self._fill_in(survivor, duplicates, self.ARTIST_DETAILS)
+
+                # Point the songs at the survivor
+
+                song_ids = set(
+                    through.objects.filter(artist_id__in=duplicate_ids).values_list(
+                        "song_id", flat=True
+                    )
+                )
+                through.objects.bulk_create(
+                    [
+                        through(song_id=song_id, artist_id=survivor_id)
+                        for song_id in song_ids
+                    ],
+                    ignore_conflicts=True,
+                )
+                through.objects.filter(artist_id__in=duplicate_ids).delete()
+                Artist.objects.filter(pk__in=duplicate_ids).delete()
+
+            removed += len(duplicate_ids)
+
+        return removed
+
+    def merge_songs(self) -> int:
+        """Merges songs sharing a match key into the oldest of them.
+
+        Returns:
+            int: The number of songs removed.
+        """
+
+        removed = 0
+        through = Song.artists.through
+
+        for (survivor_id, duplicate_ids) in self._duplicates(Song):
+            with transaction.atomic():
+                survivor = Song.objects.get(pk=survivor_id)
+                duplicates = list(Song.objects.filter(pk__in=duplicate_ids))
+                self._fill_in(survivor, duplicates, self.SONG_DETAILS)
+
+                # Move the plays and artists across
+
+                SongPlay.objects.filter(song_id__in=duplicate_ids).update(
+                    song_id=survivor_id
+                )
+                artist_ids = set(
+                    through.objects.filter(song_id__in=duplicate_ids).values_list(
+                        "artist_id", flat=True
+                    )
+                )
+                through.objects.bulk_create(
+                    [
+                        through(song_id=survivor_id, artist_id=artist_id)
+                        for artist_id in artist_ids
+                    ],
+                    ignore_conflicts=True,
+                )
+                through.objects.filter(song_id__in=duplicate_ids).delete()
+                Song.objects.filter(pk__in=duplicate_ids).delete()
+
+            removed += len(duplicate_ids)
+
+        return removed
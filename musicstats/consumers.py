@@ -17,21 +17,147 @@
 
 """
 
-from channels.generic.websocket import WebsocketConsumer
-from musicstats.models import Station, SongPlay
-from musicstats.serializers import SongPlaySerializer
-import logging
+import asyncio
 import json
-from asgiref.sync import async_to_sync
+import time
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.http import Http404
+from musicstats import metrics
+from musicstats.broadcast import now_playing_group, now_playing_shard
+from musicstats.models import SongPlay
+from musicstats.protocol import FORMATS, compact, delta, message
+from musicstats.registry import StationRegistry
+from musicstats.renderers import dumps
+from musicstats.representations import now_playing_data, song_plays_data
+from musicstats.streaming import missed_plays
+import logging
 
 logger = logging.getLogger(__name__)
 
+# Close code for listeners that fall too far behind (try again later)
+
+LAGGING_CLOSE_CODE = 1013
+
+
+class CoalescingConsumer(AsyncWebsocketConsumer):
+    """Sends updates to a listener without letting a slow one back things up.
+
+    Updates are handed to a background task rather than sent from the
+    channel layer handler, so the listener's channel keeps draining however
+    slow their connection is. While a send is in progress only the newest
+    update for each key (e.g. station) is kept. At most
+    NOW_PLAYING_SEND_QUEUE_LIMIT keys are kept waiting (the oldest is dropped
+    after that) and listeners whose updates have waited more than
+    NOW_PLAYING_MAX_LAG seconds are disconnected.
+    """
+
+    pending = None
+    pending_since = None
+    sender = None
+
+    async def push(self, key, update):
+        """Queues an update to send to the listener.
+
+        Args:
+            key: Identifies what the update is for. A newer update with the
+                same key replaces this one if it hasn't been sent yet.
+            update: The update (see send_update).
+        """
+
+        if self.pending is None:
+            self.pending = {}
+            self.wake = asyncio.Event()
+            self.sender = asyncio.ensure_future(self.send_pending())
+
+        # Kick out listeners that have fallen too far behind
+
+        now = time.monotonic()
+        if (
+            self.pending_since is not None
+            and now - self.pending_since > settings.NOW_PLAYING_MAX_LAG
+        ):
+            await self.evict()
+            return
+
+        # Latest value wins
+
+        if key in self.pending:
+            del self.pending[key]
+            metrics.websocket_messages_coalesced.inc()
+        elif len(self.pending) >= settings.NOW_PLAYING_SEND_QUEUE_LIMIT:
+            del self.pending[next(iter(self.pending))]
+            metrics.websocket_messages_dropped.inc()
+
+        self.pending[key] = update
+        if self.pending_since is None:
+            self.pending_since = now
+
+        self.wake.set()
+
+    async def send_pending(self):
+        """
+        Sends queued updates to the listener, one at a time.
+        """
+
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+
+            while self.pending:
+                key = next(iter(self.pending))
+                update = self.pending.pop(key)
+                if not self.pending:
+                    self.pending_since = None
+
+                try:
+                    await asyncio.wait_for(
+                        self.send_update(update), settings.NOW_PLAYING_MAX_LAG
+                    )
+                except asyncio.TimeoutError:
+                    await self.evict()
+                    return
+
+            # Keep this process's metrics fresh for /metrics, even if it
+            # isn't serving any HTTP requests
+
+            metrics.maybe_flush()
+
+    async def send_update(self, update):
+        """Sends a queued update to the listener.
+
+        Args:
+            update (str): The update.
+        """
+
+        await self.send(text_data=update)
+
+    async def evict(self):
+        """
+        Disconnects a listener that's fallen too far behind.
+        """
+
+        logger.info("Disconnecting %s as it's fallen behind.", self.channel_name)
+        metrics.websocket_evictions.inc()
+        self.pending.clear()
+        self.pending_since = None
+        await self.close(code=LAGGING_CLOSE_CODE)
 
-class NowPlayingConsumer(WebsocketConsumer):
+    async def disconnect(self, code):
+
+        # Stop sending
+
+        if self.sender and self.sender is not asyncio.current_task():
+            self.sender.cancel()
+
+
+class NowPlayingConsumer(CoalescingConsumer):
 
     # Sends the now playing
 
-    def send_now_playing(self, station):
+    async def send_now_playing(self, station):
 
         # Sanity check
 
@@ -46,54 +172,274 @@ class NowPlayingConsumer(WebsocketConsumer):
         play_query = SongPlay.objects.all()
         play_query = play_query.filter(station__id=station.id)
         play_query = play_query.order_by("-date_time")[:1]
+        song_plays = await database_sync_to_async(song_plays_data)(play_query)
 
-        if len(play_query) == 0:
+        if len(song_plays) == 0:
             logger.debug("Could not find the last song played for {}.".format(station))
             return
 
-        song_play = play_query[0]
-        song_play_serial = SongPlaySerializer(song_play)
+        # Send it to this listener (the others already have it)
 
-        # Send the message to the channel
+        await self.now_playing({"type": "now_playing", "message": song_plays[0]})
 
-        async_to_sync(self.channel_layer.group_send)(
-            self.station_group,
-            {"type": "now_playing", "message": song_play_serial.data},
-        )
-
-    def connect(self):
+    async def connect(self):
 
         # Check we've got a valid station
 
         try:
             name = self.scope["url_route"]["kwargs"]["station_name"]
-            self.station = Station.objects.get(name=name)
-            self.station_group = "nowplaying_{}".format(self.station.id)
+            self.station = await database_sync_to_async(StationRegistry().get_or_404)(
+                name
+            )
+            self.station_group = now_playing_group(
+                self.station.id, now_playing_shard(self.channel_name)
+            )
 
-        except Station.DoesNotExist:
+        except Http404:
             logger.debug("Station named {} does not exists.".format(name))
             return
 
         # Join the channel
 
-        async_to_sync(self.channel_layer.group_add)(
-            self.station_group, self.channel_name
-        )
+        await self.channel_layer.group_add(self.station_group, self.channel_name)
 
-        self.accept()
+        await self.accept()
+        metrics.websocket_connections.inc(station=self.station.name)
 
         # Trigger the update to the channel
 
-        self.send_now_playing(self.station)
+        await self.send_now_playing(self.station)
 
-    def disconnect(self, code):
-        pass
+    async def disconnect(self, code):
 
-    def receive(self, text_data=None, bytes_data=None):
+        # Leave the channel (if we ever joined it)
+
+        if hasattr(self, "station_group"):
+            await self.channel_layer.group_discard(
+                self.station_group, self.channel_name
+            )
+            metrics.websocket_connections.dec(station=self.station.name)
+
+        await super().disconnect(code)
+
+    async def receive(self, text_data=None, bytes_data=None):
         logger.debug("Received message from user: {}".format(text_data))
 
-    def now_playing(self, event):
+    async def now_playing(self, event):
+
+        logger.debug("Sending now playing information.")
+        await self.push("now_playing", dumps(event["message"]).decode())
+
+
+class NowPlayingDashboardConsumer(CoalescingConsumer):
+    """
+    Pushes the now playing for every station (or those named in
+    ?stations=) down one socket.
+
+    Listeners get every station's current song in one message on connect,
+    then each new song play as it happens.
+    """
+
+    async def connect(self):
+
+        # Work out which stations we're listening to
+
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        names = ",".join(query.get("stations", []))
+        self.station_ids = await database_sync_to_async(StationRegistry().ids)(names)
+
+        # Join their channels
+
+        shard = now_playing_shard(self.channel_name)
+        self.station_groups = [
+            now_playing_group(station_id, shard) for station_id in self.station_ids
+        ]
+        for group in self.station_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+
+        await self.accept()
+        metrics.websocket_connections.inc(station="dashboard")
+
+        # Send everything that's currently playing
+
+        data = await database_sync_to_async(now_playing_data)(self.station_ids)
+        await self.push(None, dumps(data).decode())
+
+    async def disconnect(self, code):
+
+        # Leave the channels (if we ever joined them)
+
+        if hasattr(self, "station_groups"):
+            for group in self.station_groups:
+                await self.channel_layer.group_discard(group, self.channel_name)
+            metrics.websocket_connections.dec(station="dashboard")
+
+        await super().disconnect(code)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        logger.debug("Received message from user: {}".format(text_data))
+
+    async def now_playing(self, event):
 
         logger.debug("Sending now playing information.")
         message = event["message"]
-        self.send(text_data=json.dumps(message))
+        await self.push(message.get("station"), dumps(message).decode())
+
+
+class NowPlayingProtocolConsumer(CoalescingConsumer):
+    """
+    Pushes the now playing for the stations a listener subscribes to, using
+    the versioned protocol described in protocol.py.
+    """
+
+    async def connect(self):
+        self.format = FORMATS[0]
+
+        # Station ID -> (name, group) and station ID -> (seq, payload sent)
+
+        self.subscriptions = {}
+        self.sent = {}
+
+        await self.accept()
+
+    async def disconnect(self, code):
+
+        # Leave the channels
+
+        for (name, group) in self.subscriptions.values():
+            await self.channel_layer.group_discard(group, self.channel_name)
+            metrics.websocket_connections.dec(station=name)
+
+        await super().disconnect(code)
+
+    async def error(self, error: str):
+        """
+        Tells the listener something was wrong with their message.
+        """
+
+        await self.send(text_data=message("error", error=error))
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            request = json.loads(text_data or "")
+        except ValueError:
+            request = None
+
+        if not isinstance(request, dict):
+            await self.error("Messages must be JSON objects.")
+            return
+
+        handler = {
+            "subscribe": self.subscribe,
+            "unsubscribe": self.unsubscribe,
+        }.get(request.get("type"))
+
+        if not handler:
+            await self.error(f"Unknown message type {request.get('type')!r}.")
+            return
+
+        names = request.get("stations")
+        if not isinstance(names, list) or not all(
+            isinstance(name, str) for name in names
+        ):
+            await self.error("Stations must be a list of names.")
+            return
+
+        await handler(request, names)
+
+    async def subscribe(self, request: dict, names: list):
+        """
+        Starts sending the now playing for some stations.
+        """
+
+        # Check what they've asked for
+
+        payload_format = request.get("format", self.format)
+        if payload_format not in FORMATS:
+            await self.error(f"Format must be one of {', '.join(FORMATS)}.")
+            return
+
+        since = request.get("since")
+        if since is not None and (
+            isinstance(since, bool) or not isinstance(since, int)
+        ):
+            await self.error("Since must be a sequence number.")
+            return
+
+        self.format = payload_format
+        stations = await database_sync_to_async(StationRegistry().get_many)(names)
+        missing = [name for name in names if name not in stations]
+        if missing:
+            await self.error(f"Unknown stations: {', '.join(missing)}.")
+
+        # Join the channels
+
+        shard = now_playing_shard(self.channel_name)
+        for station in stations.values():
+            if station.id not in self.subscriptions:
+                group = now_playing_group(station.id, shard)
+                await self.channel_layer.group_add(group, self.channel_name)
+                self.subscriptions[station.id] = (station.name, group)
+                metrics.websocket_connections.inc(station=station.name)
+
+        await self.send(
+            text_data=message(
+                "subscribed",
+                stations=sorted(name for (name, _) in self.subscriptions.values()),
+            )
+        )
+
+        # Catch them up (the current song, or what they missed)
+
+        for station in stations.values():
+            for (play_id, data) in await database_sync_to_async(missed_plays)(
+                station.id, since
+            ):
+                await self.push((station.id, play_id), (station.id, play_id, data))
+
+    async def unsubscribe(self, request: dict, names: list):
+        """
+        Stops sending the now playing for some stations.
+        """
+
+        for (station_id, (name, group)) in list(self.subscriptions.items()):
+            if name in names:
+                await self.channel_layer.group_discard(group, self.channel_name)
+                metrics.websocket_connections.dec(station=name)
+                del self.subscriptions[station_id]
+                self.sent.pop(station_id, None)
+
+    async def now_playing(self, event):
+
+        station_id = event.get("station")
+        if station_id in self.subscriptions:
+            await self.push(station_id, (station_id, event.get("id"), event["message"]))
+
+    async def send_update(self, update):
+        """
+        Sends a song play whole if it's the first for the station, otherwise
+        just what's changed.
+        """
+
+        (station_id, seq, data) = update
+        if station_id not in self.subscriptions:
+            return
+
+        # Skip anything they've already had
+
+        previous = self.sent.get(station_id)
+        if previous and None not in (seq, previous[0]) and seq <= previous[0]:
+            return
+
+        payload = data if self.format == "full" else compact(data)
+        name = self.subscriptions[station_id][0]
+        self.sent[station_id] = (seq, payload)
+
+        if previous:
+            text_data = message(
+                "delta", station=name, seq=seq, data=delta(previous[1], payload)
+            )
+        else:
+            text_data = message("now_playing", station=name, seq=seq, data=payload)
+
+        await self.send(text_data=text_data)
@@ -18,14 +18,18 @@
 """
 
 
+import logging
 import math
 import tempfile
 from datetime import datetime
+from functools import wraps
 import requests
 from requests.exceptions import RequestException
 from django.conf import settings
 from django.core.files import File
 from django_cron import CronJobBase, Schedule
+from musicstats import metrics, querylog
+from musicstats.log import JobRun
 from musicstats.epg import OnAir2Parser, ProRadioParser, EpgSynchroniser
 from musicstats.presenters import (
     PresenterSynchroniser,
@@ -43,6 +47,43 @@ from musicstats.models import (
     WordpressPresenterDataSource,
 )
 
+logger = logging.getLogger(__name__)
+
+
+def fetch(service: str, url: str, **kwargs) -> requests.Response:
+    """Makes a GET request to another service, recording how long it took.
+
+    Args:
+        service (str): The service (for the metrics).
+        url (str): The URL to request.
+        kwargs: Passed on to requests.get().
+
+    Returns:
+        requests.Response: The response.
+    """
+
+    with metrics.upstream_request_duration.time(service=service):
+        return requests.get(url, **kwargs)
+
+
+def instrumented(do):
+    """
+    Records how long each run of a cron job takes (and the queries it makes),
+    handing the job a JobRun to log its progress with.
+    """
+
+    @wraps(do)
+    def wrapper(self):
+        try:
+            with metrics.cron_job_duration.time(job=self.code):
+                with JobRun(self.code, logger) as run, querylog.recording(self.code):
+                    return do(self, run)
+        finally:
+            metrics.flush()
+            querylog.flush()
+
+    return wrapper
+
 
 class CronUtil(object):
     """
@@ -58,16 +99,24 @@ class CronUtil(object):
 
         # Attempt the actual download
 
-        print(f"Downloading {url}...")
+        logger.debug("Downloading %s.", url, extra={"url": url})
 
         try:
-            download_request = requests.get(url)
+            download_request = fetch("images", url)
             if download_request.status_code != self.HTTP_SUCCESS:
-                print(f"Failed to download {url}.")
-                print(f"Reason: {download_request.text}")
+                logger.warning(
+                    "Failed to download %s.",
+                    url,
+                    extra={"url": url, "reason": download_request.text},
+                )
                 return None
         except RequestException:
-            print(f"Ran into a problem downloading from {url}.")
+            logger.warning(
+                "Ran into a problem downloading from %s.",
+                url,
+                exc_info=True,
+                extra={"url": url},
+            )
             return None
 
         # Write it to a temp file
@@ -105,7 +154,8 @@ class LastFmArtistSync(CronJobBase):
     # pylint: disable=invalid-name
     # It's not proper snake case but part of the API
 
-    def do(self):
+    @instrumented
+    def do(self, run):
         """
         Perform the sync
         """
@@ -116,61 +166,72 @@ class LastFmArtistSync(CronJobBase):
 
         artists = Artist.objects.filter(musicbrainz_id="")
         for artist in artists:
+            with run.item(artist.name):
 
-            # Find the artist in last.fm
-
-            print(f"Accessing last.fm data for artist {artist.name}.")
-
-            artists_payload = {
-                "method": "artist.getinfo",
-                "artist": artist.name,
-                "api_key": settings.LAST_FM["KEY"],
-                "format": "json",
-            }
+                # Find the artist in last.fm
 
-            artist_request = requests.get(self.LFM_API_URL, params=artists_payload)
-            if artist_request.status_code != self.HTTP_SUCCESS:
-                print(f"Failed to get the last.fm data for artist {artist.name}.")
-                print(f"Reason: {artist_request.text}")
-                continue
+                artists_payload = {
+                    "method": "artist.getinfo",
+                    "artist": artist.name,
+                    "api_key": settings.LAST_FM["KEY"],
+                    "format": "json",
+                }
 
-            json = artist_request.json()
-
-            # Pull out and test the musicbrainz ID
-
-            if ("error" in json) or (not "mbid" in json["artist"]):
-                artist.musicbrainz_id = self.BLANK_MBID
-                artist.save()
-                continue
-            else:
-                mbid = json["artist"]["mbid"]
-                artist.musicbrainz_id = mbid
+                with run.phase("fetch"):
+                    artist_request = fetch(
+                        "lastfm", self.LFM_API_URL, params=artists_payload
+                    )
+                if artist_request.status_code != self.HTTP_SUCCESS:
+                    run.failed(
+                        "Failed to get the last.fm data for artist %s.",
+                        artist.name,
+                        item=artist.name,
+                        reason=artist_request.text,
+                    )
+                    continue
 
-            # Pull out the images
+                with run.phase("parse"):
+                    json = artist_request.json()
 
-            for image in json["artist"]["image"]:
-                if image["size"] == "small":
-                    small_image = util.download_image(image["#text"])
-                elif image["size"] == "extralarge":
-                    large_image = util.download_image(image["#text"])
+                # Pull out and test the musicbrainz ID
 
-            if small_image:
-                artist.thumbnail.save(
-                    small_image["file_name"], File(small_image["temp_file"])
-                )
-            if large_image:
-                artist.image.save(
-                    large_image["file_name"], File(large_image["temp_file"])
-                )
+                if ("error" in json) or (not "mbid" in json["artist"]):
+                    artist.musicbrainz_id = self.BLANK_MBID
+                    with run.phase("db_write"):
+                        artist.save()
+                    continue
+                else:
+                    mbid = json["artist"]["mbid"]
+                    artist.musicbrainz_id = mbid
+
+                # Pull out the images
+
+                with run.phase("download_image"):
+                    for image in json["artist"]["image"]:
+                        if image["size"] == "small":
+                            small_image = util.download_image(image["#text"])
+                        elif image["size"] == "extralarge":
+                            large_image = util.download_image(image["#text"])
+
+                with run.phase("db_write"):
+                    if small_image:
+                        artist.thumbnail.save(
+                            small_image["file_name"], File(small_image["temp_file"])
+                        )
+                    if large_image:
+                        artist.image.save(
+                            large_image["file_name"], File(large_image["temp_file"])
+                        )
 
-            # Bio/wiki
+                # Bio/wiki
 
-            if "bio" in json["artist"]:
-                artist.wiki_content = json["artist"]["bio"]["content"]
+                if "bio" in json["artist"]:
+                    artist.wiki_content = json["artist"]["bio"]["content"]
 
-            # Write everything back to the database
+                # Write everything back to the database
 
-            artist.save()
+                with run.phase("db_write"):
+                    artist.save()
 
 
 class LastFmSongSync(CronJobBase):
@@ -192,7 +253,8 @@ class LastFmSongSync(CronJobBase):
     # pylint: disable=invalid-name
     # It's not proper snake case but part of the API
 
-    def do(self):
+    @instrumented
+    def do(self, run):
         """
         Perform the sync
         """
@@ -203,76 +265,89 @@ class LastFmSongSync(CronJobBase):
 
         songs = Song.objects.filter(musicbrainz_id="")
         for song in songs:
+            with run.item(str(song)):
 
-            # Find the song in last.fm
-
-            print("Accessing last.fm data for song {}.".format(song))
-
-            song_payload = {
-                "method": "track.getinfo",
-                "artist": song.display_artist,
-                "track": song.title,
-                "api_key": settings.LAST_FM["KEY"],
-                "format": "json",
-            }
-
-            song_request = requests.get(self.LFM_API_URL, params=song_payload)
-            if song_request.status_code != self.HTTP_SUCCESS:
-                print(f"Failed to get the last.fm data for song {song}.")
-                print(f"Reason: {song_request.text}")
-                continue
+                # Find the song in last.fm
 
-            json = song_request.json()
+                song_payload = {
+                    "method": "track.getinfo",
+                    "artist": song.display_artist,
+                    "track": song.title,
+                    "api_key": settings.LAST_FM["KEY"],
+                    "format": "json",
+                }
 
-            # Obtain the iTunes URL
-
-            self.getItunesUrl(song)
+                with run.phase("fetch"):
+                    song_request = fetch(
+                        "lastfm", self.LFM_API_URL, params=song_payload
+                    )
+                if song_request.status_code != self.HTTP_SUCCESS:
+                    run.failed(
+                        "Failed to get the last.fm data for song %s.",
+                        song,
+                        item=str(song),
+                        reason=song_request.text,
+                    )
+                    continue
 
-            # Pull out and test the musicbrainz ID
+                with run.phase("parse"):
+                    json = song_request.json()
 
-            if ("error" in json) or (not "mbid" in json["track"]):
-                song.musicbrainz_id = self.BLANK_MBID
-                song.save()
-                continue
-            else:
-                mbid = json["track"]["mbid"]
-                song.musicbrainz_id = mbid
+                # Obtain the iTunes URL
 
-            # Pull out the images
+                with run.phase("itunes"):
+                    self.getItunesUrl(song)
 
-            small_image = None
-            large_image = None
+                # Pull out and test the musicbrainz ID
 
-            if "album" in json["track"]:
-                for image in json["track"]["album"]["image"]:
-                    if image["size"] == "small":
-                        small_image = util.download_image(image["#text"])
-                    elif image["size"] == "extralarge":
-                        large_image = util.download_image(image["#text"])
-            else:
-                print(
-                    "No album art found for {} - {}".format(
-                        song.display_artist, song.title
+                if ("error" in json) or (not "mbid" in json["track"]):
+                    song.musicbrainz_id = self.BLANK_MBID
+                    with run.phase("db_write"):
+                        song.save()
+                    continue
+                else:
+                    mbid = json["track"]["mbid"]
+                    song.musicbrainz_id = mbid
+
+                # Pull out the images
+
+                small_image = None
+                large_image = None
+
+                if "album" in json["track"]:
+                    with run.phase("download_image"):
+                        for image in json["track"]["album"]["image"]:
+                            if image["size"] == "small":
+                                small_image = util.download_image(image["#text"])
+                            elif image["size"] == "extralarge":
+                                large_image = util.download_image(image["#text"])
+                else:
+                    logger.debug(
+                        "No album art found for %s - %s.",
+                        song.display_artist,
+                        song.title,
+                        extra={"job": self.code, "item": str(song)},
                     )
-                )
 
-            if small_image:
-                song.thumbnail.save(
-                    small_image["file_name"], File(small_image["temp_file"])
-                )
-            if large_image:
-                song.image.save(
-                    large_image["file_name"], File(large_image["temp_file"])
-                )
+                with run.phase("db_write"):
+                    if small_image:
+                        song.thumbnail.save(
+                            small_image["file_name"], File(small_image["temp_file"])
+                        )
+                    if large_image:
+                        song.image.save(
+                            large_image["file_name"], File(large_image["temp_file"])
+                        )
 
-            # Wiki
+                # Wiki
 
-            if "wiki" in json["track"]:
-                song.wiki_content = json["track"]["wiki"]["content"]
+                if "wiki" in json["track"]:
+                    song.wiki_content = json["track"]["wiki"]["content"]
 
-            # Write everything back to the database
+                # Write everything back to the database
 
-            song.save()
+                with run.phase("db_write"):
+                    song.save()
 
     def getItunesUrl(self, song):
         """
@@ -287,10 +362,13 @@ class LastFmSongSync(CronJobBase):
             "media": "music",
         }
 
-        itunes_request = requests.get(self.ITUNES_API_URL, params=itunes_payload)
+        itunes_request = fetch("itunes", self.ITUNES_API_URL, params=itunes_payload)
         if itunes_request.status_code != self.HTTP_SUCCESS:
-            print(f"Failed to get the iTunes URL for song {song}.")
-            print(f"Reason: {itunes_request.text}")
+            logger.warning(
+                "Failed to get the iTunes URL for song %s.",
+                song,
+                extra={"item": str(song), "reason": itunes_request.text},
+            )
             return
 
         json = itunes_request.json()
@@ -298,7 +376,7 @@ class LastFmSongSync(CronJobBase):
         # Check we got a song back
 
         if json["resultCount"] == 0:
-            print(f"No iTunes URL found for {song}.")
+            logger.debug("No iTunes URL found for %s.", song, extra={"item": str(song)})
             return
 
         # Look for the first song and URL
@@ -306,7 +384,12 @@ class LastFmSongSync(CronJobBase):
         for result in json["results"]:
             if result["wrapperType"] == "track":
                 song.itunes_url = result["trackViewUrl"]
-                print(f"The iTunes URL for {song} is {song.itunes_url}")
+                logger.debug(
+                    "The iTunes URL for %s is %s.",
+                    song,
+                    song.itunes_url,
+                    extra={"item": str(song)},
+                )
                 return
 
 
@@ -325,7 +408,8 @@ class EpgUpdater(CronJobBase):
     # pylint: disable=invalid-name
     # It's not proper snake case but part of the API
 
-    def do(self):
+    @instrumented
+    def do(self, run):
         """
         Performs the actual updates.
         """
@@ -340,45 +424,52 @@ class EpgUpdater(CronJobBase):
             # Does the station have an EPG
 
             if station.epg:
+                with run.item(station.name):
 
-                # Let's go and update that EPG
-
-                if isinstance(station.epg, OnAir2DataSource):
+                    # Let's go and update that EPG
 
                     new_epg = None
+                    parser = None
 
-                    # Read in the HTML and the EPG
-
-                    try:
-                        result = requests.get(station.epg.schedule_url)
-                        result.raise_for_status()
-                        new_epg = OnAir2Parser().parse(result.text)
-                    except requests.exceptions.RequestException as ex:
-                        print(
-                            f"Failed to get EPG data from {station.epg.schedule_url}. Reason: {ex}"
-                        )
-
-                if isinstance(station.epg, ProRadioDataSource):
+                    if isinstance(station.epg, OnAir2DataSource):
+                        parser = OnAir2Parser()
+                    if isinstance(station.epg, ProRadioDataSource):
+                        parser = ProRadioParser()
 
                     # Read in the HTML and the EPG
 
-                    try:
-                        result = requests.get(station.epg.schedule_url)
-                        result.raise_for_status()
-                        new_epg = ProRadioParser().parse(result.text)
-                    except requests.exceptions.RequestException as ex:
-                        print(
-                            f"Failed to get EPG data from {station.epg.schedule_url}. Reason: {ex}"
-                        )
+                    if parser:
+                        try:
+                            with run.phase("fetch"):
+                                result = fetch("epg", station.epg.schedule_url)
+                                result.raise_for_status()
+                            with run.phase("parse"):
+                                new_epg = parser.parse(result.text)
+                        except requests.exceptions.RequestException as ex:
+                            logger.warning(
+                                "Failed to get EPG data from %s. Reason: %s",
+                                station.epg.schedule_url,
+                                ex,
+                                extra={"job": self.code, "item": station.name},
+                            )
 
-                # Error out if we didn't get an EPG entry
+                    # Error out if we didn't get an EPG entry
 
-                if new_epg:
-                    synchroniser.synchronise(station, new_epg)
-                    print(f"Syncrhonised EPG for {station}.")
-                if not new_epg:
-                    print(f"Failed to get a new EPG entry for {station}.")
-                    continue
+                    if new_epg:
+                        with run.phase("db_write"):
+                            synchroniser.synchronise(station, new_epg)
+                        logger.info(
+                            "Synchronised EPG for %s.",
+                            station,
+                            extra={"job": self.code, "item": station.name},
+                        )
+                    if not new_epg:
+                        run.failed(
+                            "Failed to get a new EPG entry for %s.",
+                            station,
+                            item=station.name,
+                        )
+                        continue
 
 
 class PresenterSynchroniserJob(CronJobBase):
@@ -391,7 +482,8 @@ class PresenterSynchroniserJob(CronJobBase):
     schedule = Schedule(run_every_mins=RUN_INTERVAL)
     code = "musicstats.cron.presenters"
 
-    def do(self):
+    @instrumented
+    def do(self, run):
         """Executes the synchronisation."""
 
         for station in Station.objects.all():
@@ -400,46 +492,63 @@ class PresenterSynchroniserJob(CronJobBase):
 
             if station.presenters:
                 if isinstance(station.presenters, WordpressPresenterDataSource):
+                    with run.item(station.name):
 
-                    # Wordpress as a source
-
-                    presenters = []
-
-                    try:
-                        result = requests.get(station.presenters.presenter_list_url)
-                        result.raise_for_status()
-                        presenters = WordpressPresenterParser().parse(
-                            result.text, station
-                        )
-                    except requests.exceptions.RequestException as ex:
-                        print(
-                            f"Failed to get presenter list from {station.presenters.presenter_list_url}. Reason: {ex}"
-                        )
-                        continue
-
-                    # Sanity check
-
-                    if not presenters:
-                        print(
-                            f"Extracted no presenters from {station.presenters.presenter_list_url}."
-                        )
-                        continue
-
-                    # Get image URLs for each presenter
+                        # Wordpress as a source
 
-                    image_url_parser = WordpressPresenterImage()
+                        presenters = []
+                        list_url = station.presenters.presenter_list_url
 
-                    for presenter in presenters:
                         try:
-                            result = requests.get(presenter.url)
-                            result.raise_for_status()
-                            presenter.image = image_url_parser.parse(result.text)
+                            with run.phase("fetch"):
+                                result = fetch("presenters", list_url)
+                                result.raise_for_status()
+                            with run.phase("parse"):
+                                presenters = WordpressPresenterParser().parse(
+                                    result.text, station
+                                )
                         except requests.exceptions.RequestException as ex:
-                            print(
-                                f"Failed to extract presenter image from {presenter.url}. Reason: {ex}"
+                            run.failed(
+                                "Failed to get presenter list from %s. Reason: %s",
+                                list_url,
+                                ex,
+                                item=station.name,
                             )
                             continue
 
-                    # Synchronise
+                        # Sanity check
+
+                        if not presenters:
+                            run.failed(
+                                "Extracted no presenters from %s.",
+                                list_url,
+                                item=station.name,
+                            )
+                            continue
 
-                    PresenterSynchroniser().synchronise(station, presenters)
+                        # Get image URLs for each presenter
+
+                        image_url_parser = WordpressPresenterImage()
+
+                        for presenter in presenters:
+                            try:
+                                with run.phase("fetch"):
+                                    result = fetch("presenters", presenter.url)
+                                    result.raise_for_status()
+                                with run.phase("parse"):
+                                    presenter.image = image_url_parser.parse(
+                                        result.text
+                                    )
+                            except requests.exceptions.RequestException as ex:
+                                logger.warning(
+                                    "Failed to extract presenter image from %s. Reason: %s",
+                                    presenter.url,
+                                    ex,
+                                    extra={"job": self.code, "item": station.name},
+                                )
+                                continue
+
+                        # Synchronise
+
+                        with run.phase("db_write"):
+                            PresenterSynchroniser().synchronise(station, presenters)
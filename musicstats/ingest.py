@@ -0,0 +1,495 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from musicstats.authentication import AuthenticationCache
+from musicstats.broadcast import broadcast_now_playing
+from musicstats.models import Artist, Song, SongPlay
+from musicstats.registry import StationRegistry
+from musicstats.normalise import artist_match_key, song_match_key
+from musicstats.representations import song_play_data
+
+
+def derive_idempotency_key(
+    song_id: int, date_time: datetime = None, previous_id: int = None
+) -> str:
+    """Derives an idempotency key for a song play the client didn't supply one for.
+
+    Plays with a time from the client are keyed on that time, so a replay is
+    spotted. Live plays are keyed on the play they follow, so two playout
+    systems reporting the same song at once can't both be recorded.
+
+    Args:
+        song_id (int): The ID of the song played.
+        date_time (datetime): The time supplied by the client (if any).
+        previous_id (int): The ID of the play this one follows (if any).
+
+    Returns:
+        str: The idempotency key.
+    """
+
+    if date_time:
+        return f"auto:{song_id}@{date_time.isoformat()}"
+
+    return f"auto:{song_id}>{previous_id or 0}"
+
+
+def latest_play(station_id: int) -> Optional[dict]:
+    """Obtains the latest play on a station, to check for back to back repeats.
+
+    Always read from the database (one indexed lookup) so every worker sees
+    the same play, however the cache is set up.
+
+    Args:
+        station_id (int): The station ID.
+
+    Returns:
+        Optional[dict]: The ID, song ID and time of the latest play.
+    """
+
+    return (
+        SongPlay.objects.filter(station_id=station_id)
+        .order_by("-date_time")
+        .values("id", "song_id", "date_time")
+        .first()
+    )
+
+
+class IdempotentResponses:
+    """Caches the responses to song plays logged with an idempotency key."""
+
+    def _cache_key(self, station_id: int, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f"musicstats_idempotency_{station_id}_{digest}"
+
+    def get(self, station_id: int, key: str) -> Optional[dict]:
+        """Obtains the response to an earlier request with the same key.
+
+        Args:
+            station_id (int): The station the play was logged against.
+            key (str): The idempotency key.
+
+        Returns:
+            Optional[dict]: The serialised song play, if we've seen the key.
+        """
+
+        return cache.get(self._cache_key(station_id, key))
+
+    def remember(self, station_id: int, key: str, song_play: dict):
+        """Stores the response to a request with an idempotency key.
+
+        Args:
+            station_id (int): The station the play was logged against.
+            key (str): The idempotency key.
+            song_play (dict): The serialised song play.
+        """
+
+        cache.set(
+            self._cache_key(station_id, key),
+            song_play,
+            settings.SONG_PLAY_IDEMPOTENCY_TTL,
+        )
+
+
+class SongResolver:
+    """Resolves the song details supplied with a song play into songs.
+
+    Songs and artists are matched on their normalised match keys, so casing,
+    accents and "feat." variants don't create duplicates.
+    """
+
+    def _artists(self, names: List[str]) -> List[Artist]:
+        """Obtains the artists with the supplied names, creating any we're missing.
+
+        Args:
+            names (List[str]): The artist names.
+
+        Returns:
+            List[Artist]: The artists, without duplicates.
+        """
+
+        names_by_key = {artist_match_key(name): name for name in reversed(names)}
+        if not names_by_key:
+            return []
+
+        # Find the ones we already know about (oldest wins)
+
+        artists: Dict[str, Artist] = {}
+        for artist in Artist.objects.filter(match_key__in=names_by_key.keys()).order_by(
+            "-pk"
+        ):
+            artists[artist.match_key] = artist
+
+        # Create the rest
+
+        missing = [
+            Artist(name=name, match_key=key)
+            for (key, name) in names_by_key.items()
+            if key not in artists
+        ]
+
+        if missing:
+            Artist.objects.bulk_create(missing)
+            for artist in Artist.objects.filter(
+                match_key__in=[artist.match_key for artist in missing]
+            ).order_by("-pk"):
+                artists[artist.match_key] = artist
+
+        return [
+            artists[key]
+            for key in dict.fromkeys(artist_match_key(name) for name in names)
+        ]
+
+    def resolve(self, song_data: dict):
+        """Resolves a single song, creating it if we don't know about it yet.
+
+        Args:
+            song_data (dict): The song details from the song play.
+
+        Returns:
+            Tuple[Song, bool]: The song and whether it was newly created.
+        """
+
+        key = song_match_key(song_data["display_artist"], song_data["title"])
+        song = Song.objects.filter(match_key=key).order_by("pk").first()
+
+        if song:
+            return (song, False)
+
+        song = Song()
+        song.title = song_data["title"]
+        song.display_artist = song_data["display_artist"]
+        song.save()
+        song.artists.add(*self._artists(song_data["artists"]))
+
+        return (song, True)
+
+    def resolve_many(self, songs_data: List[dict]) -> List[Song]:
+        """Resolves a list of songs in bulk, creating any we don't know about.
+
+        Matching follows the same rules as resolve() but costs a fixed number
+        of queries regardless of the number of songs.
+
+        Args:
+            songs_data (List[dict]): The song details from the song plays.
+
+        Returns:
+            List[Song]: The songs, in the same order as supplied.
+        """
+
+        if not songs_data:
+            return []
+
+        keys = [
+            song_match_key(song["display_artist"], song["title"]) for song in songs_data
+        ]
+
+        # Pull every matching song in one go (oldest wins)
+
+        songs: Dict[str, Song] = {}
+        for song in Song.objects.filter(match_key__in=set(keys)).order_by("-pk"):
+            songs[song.match_key] = song
+
+        # Plan new songs for the rest
+
+        new_songs: List[Song] = []
+        new_song_artists: Dict[str, List[str]] = {}
+
+        for (key, song_data) in zip(keys, songs_data):
+            if key in songs:
+                continue
+
+            song = Song(
+                title=song_data["title"],
+                display_artist=song_data["display_artist"],
+                match_key=key,
+            )
+            songs[key] = song
+            new_songs.append(song)
+            new_song_artists[key] = song_data["artists"]
+
+        if new_songs:
+            self._create_many(new_songs, new_song_artists)
+
+        return [songs[key] for key in keys]
+
+    def _create_many(self, songs: List[Song], song_artists: Dict[str, List[str]]):
+        """Saves new songs and their artists in bulk.
+
+        Args:
+            songs (List[Song]): The unsaved songs.
+            song_artists (Dict[str, List[str]]): The artist names for each song,
+                by song match key.
+        """
+
+        Song.objects.bulk_create(songs)
+
+        # Create any artists we've not seen before
+
+        names: List[str] = []
+        for artists in song_artists.values():
+            names.extend(artists)
+
+        artists = {artist.match_key: artist for artist in self._artists(names)}
+
+        # Link them up
+
+        links = [
+            Song.artists.through(song_id=song.id, artist_id=artists[key].id)
+            for song in songs
+            for key in dict.fromkeys(
+                artist_match_key(name) for name in song_artists[song.match_key]
+            )
+        ]
+        Song.artists.through.objects.bulk_create(links, ignore_conflicts=True)
+
+
+class BulkSongPlayLogger:
+    """Logs a batch of song plays, e.g. those buffered during an outage."""
+
+    CREATED = "created"
+    DUPLICATE = "duplicate"
+    INVALID = "invalid"
+    UNKNOWN_STATION = "unknown_station"
+    UNAUTHORISED = "unauthorised"
+
+    def log(self, user: User, plays: List[dict]) -> List[dict]:
+        """Logs the song plays.
+
+        Only the newest play for each station is sent to websocket listeners.
+
+        Args:
+            user (User): The user making the request.
+            plays (List[dict]): The validated song plays. Those without a time
+                are treated as played now, in the order supplied.
+
+        Returns:
+            List[dict]: The result for each song play, in the order supplied.
+        """
+
+        results = [{"index": index} for index in range(len(plays))]
+
+        # Check the stations exist and we're allowed to update them
+
+        stations = StationRegistry().get_many({play["station"] for play in plays})
+        permitted = AuthenticationCache().stations(user.id)
+        accepted = []
+
+        for (index, play) in enumerate(plays):
+            station = stations.get(play["station"])
+            if not station:
+                results[index]["result"] = self.UNKNOWN_STATION
+            elif station.id not in permitted:
+                results[index]["result"] = self.UNAUTHORISED
+            else:
+                accepted.append((index, station, play))
+
+        if not accepted:
+            return results
+
+        now = timezone.now()
+
+        with transaction.atomic():
+            songs = SongResolver().resolve_many(
+                [play["song"] for (_, _, play) in accepted]
+            )
+
+            # Group up by station, defaulting to now if no time was given
+
+            station_plays: Dict[int, list] = {}
+            for ((index, station, play), song) in zip(accepted, songs):
+                date_time = play.get("date_time")
+                key = play.get("idempotency_key")
+
+                if date_time and not key:
+                    key = derive_idempotency_key(song.id, date_time)
+
+                date_time = date_time or now
+                station_plays.setdefault(station.id, []).append(
+                    (date_time, index, station, song, key)
+                )
+
+            # Skip anything we've already been sent
+
+            seen_keys = set(
+                SongPlay.objects.filter(
+                    station_id__in=station_plays.keys(),
+                    idempotency_key__in={
+                        play[4]
+                        for plays in station_plays.values()
+                        for play in plays
+                        if play[4]
+                    },
+                ).values_list("station_id", "idempotency_key")
+            )
+
+            # Drop back to back repeats (as we do for a single song play)
+
+            new_plays: List[SongPlay] = []
+            new_indexes: List[int] = []
+            newest: Dict[int, SongPlay] = {}
+
+            for (station_id, plays_to_log) in station_plays.items():
+                plays_to_log.sort(key=lambda play: (play[0], play[1]))
+                (history, latest) = self._history(
+                    station_id, plays_to_log[0][0], plays_to_log[-1][0]
+                )
+                timeline = sorted(
+                    [(date_time, 0, song_id) for (date_time, song_id) in history]
+                    + [(play[0], 1, play) for play in plays_to_log],
+                    key=lambda event: (event[0], event[1]),
+                )
+
+                # A late arrival repeats the play after it too if that's one
+                # we already have
+
+                next_song_ids = []
+                next_song_id = None
+                for (_, is_new, event) in reversed(timeline):
+                    next_song_ids.append(next_song_id)
+                    if not is_new:
+                        next_song_id = event
+
+                next_song_ids.reverse()
+                last_song_id = None
+
+                for ((_, is_new, event), next_song_id) in zip(timeline, next_song_ids):
+                    if not is_new:
+                        last_song_id = event
+                        continue
+
+                    (date_time, index, station, song, key) = event
+                    if (
+                        song.id in (last_song_id, next_song_id)
+                        or (station_id, key) in seen_keys
+                    ):
+                        results[index]["result"] = self.DUPLICATE
+                        continue
+
+                    last_song_id = song.id
+                    if key:
+                        seen_keys.add((station_id, key))
+                    song_play = SongPlay(
+                        station=station,
+                        song=song,
+                        date_time=date_time,
+                        idempotency_key=key,
+                    )
+                    new_plays.append(song_play)
+                    new_indexes.append(index)
+                    results[index]["result"] = self.CREATED
+
+                    if (not latest) or date_time >= latest:
+                        newest[station_id] = song_play
+
+            self._insert(new_plays, new_indexes, results, newest)
+
+        # Only tell listeners about the newest play on each station
+        # Backfilled history older than what we already have isn't news
+
+        for (station_id, song_play) in newest.items():
+            broadcast_now_playing(station_id, song_play_data(song_play), song_play.id)
+
+        return results
+
+    def _insert(
+        self,
+        song_plays: List[SongPlay],
+        indexes: List[int],
+        results: List[dict],
+        newest: Dict[int, SongPlay],
+    ):
+        """Saves new song plays, marking any the database rejects as duplicates.
+
+        Args:
+            song_plays (List[SongPlay]): The new song plays.
+            indexes (List[int]): The request index for each song play.
+            results (List[dict]): The results to update.
+            newest (Dict[int, SongPlay]): The newest play on each station.
+        """
+
+        try:
+            with transaction.atomic():
+                SongPlay.objects.bulk_create(song_plays)
+            return
+        except IntegrityError:
+            pass
+
+        # Someone beat us to at least one of them
+        # Fall back to saving one at a time
+
+        for (song_play, index) in zip(song_plays, indexes):
+            try:
+                with transaction.atomic():
+                    song_play.save()
+            except IntegrityError:
+                results[index]["result"] = self.DUPLICATE
+                if newest.get(song_play.station_id) is song_play:
+                    del newest[song_play.station_id]
+
+    def _history(self, station_id: int, start: datetime, end: datetime):
+        """Obtains the existing plays a batch of song plays will slot in amongst.
+
+        Args:
+            station_id (int): The station the plays are for.
+            start (datetime): The time of the earliest play in the batch.
+            end (datetime): The time of the latest play in the batch.
+
+        Returns:
+            Tuple[List[Tuple[datetime, int]], datetime]: The time and song ID
+            of the plays from just before start to just after end, plus the
+            time of the latest play on the station.
+        """
+
+        plays = SongPlay.objects.filter(station_id=station_id).order_by("date_time")
+        history = list(
+            plays.filter(date_time__gte=start, date_time__lte=end).values_list(
+                "date_time", "song_id"
+            )
+        )
+        previous = (
+            plays.filter(date_time__lt=start)
+            .order_by("-date_time")
+            .values_list("date_time", "song_id")
+            .first()
+        )
+        latest = (
+            plays.order_by("-date_time").values_list("date_time", flat=True).first()
+        )
+
+        if previous:
+            history.insert(0, previous)
+
+        # Only backfilled plays have anything after them
+
+        if latest and latest > end:
+            history.append(
+                plays.filter(date_time__gt=end)
+                .values_list("date_time", "song_id")
+                .first()
+            )
+
+        return (history, latest)
@@ -0,0 +1,342 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import asyncio
+import random
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, List
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from musicstats.benchmark import BenchmarkResult
+from musicstats.broadcast import send_now_playing_async
+from musicstats.models import Song, SongPlay, Station
+from musicstats.routing import websocket_urlpatterns
+
+
+class LoadTestResult(BenchmarkResult):
+    """Timings from a load test scenario.
+
+    Throughput is worked out from the wall clock time, as requests run side
+    by side.
+    """
+
+    def __init__(self, name: str, timings: List[float], elapsed: float, errors: int):
+        super().__init__(name, timings, 1)
+        self.elapsed = elapsed
+        self.errors = errors
+
+    @property
+    def per_second(self) -> float:
+        """Requests completed per second."""
+        return len(self.timings) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.name}: {len(self.timings)} requests ({self.errors} errors) in "
+            f"{self.elapsed:.2f}s, {self.per_second:.1f} requests/sec, "
+            f"p50 {self.percentile(50) * 1000:.1f}ms, "
+            f"p90 {self.percentile(90) * 1000:.1f}ms, "
+            f"p99 {self.percentile(99) * 1000:.1f}ms, "
+            f"max {self.percentile(100) * 1000:.1f}ms"
+        )
+
+
+class LoadTest:
+    """Runs load test scenarios against the application in this process.
+
+    Requests go straight through Django (and Channels, for websockets)
+    rather than over the network, so the results show the cost of the
+    application and database alone. Point it at a copy of the database
+    filled by generate_synthetic_data, as logging song plays writes to it.
+    """
+
+    SCENARIOS = [
+        "log_song_play",
+        "song_play_list",
+        "now_playing_plain",
+        "epg_current",
+        "websocket",
+    ]
+
+    def __init__(self, requests: int = 1000, concurrency: int = 10, seed: int = 1):
+        self.requests = requests
+        self.concurrency = concurrency
+        self.seed = seed
+        self.stations = list(Station.objects.order_by("pk"))
+        self.songs = list(
+            Song.objects.order_by("pk").prefetch_related("artists")[:1000]
+        )
+
+        # Song plays are logged as each station's update account
+
+        self.tokens = {}
+        for station in self.stations:
+            if station.update_account_id:
+                (token, _) = Token.objects.get_or_create(
+                    user_id=station.update_account_id
+                )
+                self.tokens[station.name] = token.key
+
+        # Playout systems log one song at a time per station, never the same
+        # song twice in a row (we'd turn it away as a repeat)
+
+        self.station_locks = {name: threading.Lock() for name in self.tokens}
+        self.last_songs = {
+            station.name: SongPlay.objects.filter(station=station)
+            .order_by("-date_time")
+            .values_list("song_id", flat=True)
+            .first()
+            for station in self.stations
+        }
+
+    def host(self) -> str:
+        """
+        Obtains a host name the application will accept.
+        """
+
+        for host in settings.ALLOWED_HOSTS:
+            if host != "*":
+                return host.lstrip(".")
+
+        return "localhost"
+
+    def run(self, scenario: str) -> List[LoadTestResult]:
+        """Runs a scenario.
+
+        Args:
+            scenario (str): The name of the scenario (from SCENARIOS).
+
+        Returns:
+            List[LoadTestResult]: The results.
+        """
+
+        if scenario == "websocket":
+            return asyncio.run(self._websocket())
+
+        return [self._http(scenario, getattr(self, scenario))]
+
+    def _http(self, name: str, request: Callable) -> LoadTestResult:
+        """Makes requests from several threads at once.
+
+        Args:
+            name (str): The name of the scenario.
+            request (Callable): Makes a request, given a client and a random
+                number generator.
+
+        Returns:
+            LoadTestResult: The timings.
+        """
+
+        timings = []
+        errors = []
+        lock = threading.Lock()
+        credentials = {}
+        if self.tokens:
+            credentials[
+                "HTTP_AUTHORIZATION"
+            ] = f"Token {next(iter(self.tokens.values()))}"
+
+        def worker(index: int):
+            client = Client(
+                HTTP_HOST=self.host(), raise_request_exception=False, **credentials
+            )
+            rng = random.Random(self.seed + index)
+            count = self.requests // self.concurrency
+            if index < self.requests % self.concurrency:
+                count += 1
+
+            try:
+                for _ in range(count):
+                    start = time.perf_counter()
+                    response = request(client, rng)
+                    elapsed = time.perf_counter() - start
+
+                    with lock:
+                        timings.append(elapsed)
+                        if response.status_code >= 400:
+                            errors.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(index,))
+            for index in range(self.concurrency)
+        ]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return LoadTestResult(name, timings, time.perf_counter() - start, len(errors))
+
+    # Scenarios
+
+    def log_song_play(self, client: Client, rng: random.Random):
+        """
+        Logs a play of a popular song on a random station.
+
+        Plays for a station are picked and logged one at a time, so each
+        follows the last and none are repeats (stations are logged to side
+        by side).
+        """
+
+        station_name = rng.choice(list(self.tokens))
+        with self.station_locks[station_name]:
+            song = rng.choice(
+                [
+                    song
+                    for song in self.songs
+                    if song.id != self.last_songs.get(station_name)
+                ]
+            )
+            self.last_songs[station_name] = song.id
+
+            return client.post(
+                reverse("song_play_log"),
+                {
+                    "song": {
+                        "display_artist": song.display_artist,
+                        "artists": [artist.name for artist in song.artists.all()],
+                        "title": song.title,
+                    },
+                    "station": station_name,
+                },
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Token {self.tokens[station_name]}",
+            )
+
+    def song_play_list(self, client: Client, rng: random.Random):
+        """
+        Lists the last hour's song plays on a random station.
+        """
+
+        end = timezone.now()
+        return client.get(
+            reverse(
+                "song_play_specific",
+                kwargs={
+                    "station_name": rng.choice(self.stations).name,
+                    "start_time": int((end - timedelta(hours=1)).timestamp()),
+                    "end_time": int(end.timestamp()),
+                },
+            )
+        )
+
+    def now_playing_plain(self, client: Client, rng: random.Random):
+        """
+        Gets the plain text now playing for a random station.
+        """
+
+        return client.get(
+            reverse(
+                "now_playing_plain",
+                kwargs={"station_name": rng.choice(self.stations).name},
+            )
+        )
+
+    def epg_current(self, client: Client, rng: random.Random):
+        """
+        Gets the current show on a random station.
+        """
+
+        return client.get(
+            reverse(
+                "epg_current", kwargs={"station_name": rng.choice(self.stations).name}
+            )
+        )
+
+    async def _websocket(self) -> List[LoadTestResult]:
+        """
+        Connects listeners to a station's now playing (concurrency at a
+        time), then times broadcasts reaching all of the last lot.
+        """
+
+        application = URLRouter(websocket_urlpatterns)
+        station = self.stations[0]
+        path = f"nowplaying/{station.name}/"
+
+        async def listen():
+            communicator = WebsocketCommunicator(application, path)
+            start = time.perf_counter()
+            (connected, _) = await communicator.connect()
+            if connected:
+                await communicator.receive_from()
+            return (communicator, connected, time.perf_counter() - start)
+
+        # Connecting
+
+        connect_timings = []
+        errors = 0
+        listeners = []
+        start = time.perf_counter()
+
+        for batch in range(0, self.requests, self.concurrency):
+            for (communicator, _, _) in listeners:
+                await communicator.disconnect()
+
+            results = await asyncio.gather(
+                *[listen() for _ in range(min(self.concurrency, self.requests - batch))]
+            )
+            listeners = [result for result in results if result[1]]
+            errors += len(results) - len(listeners)
+            connect_timings.extend(result[2] for result in results)
+
+        connect = LoadTestResult(
+            "websocket_connect",
+            connect_timings,
+            time.perf_counter() - start,
+            errors,
+        )
+
+        # Broadcasting
+
+        broadcast_timings = []
+        start = time.perf_counter()
+
+        for index in range(10):
+            sent = time.perf_counter()
+            await send_now_playing_async(
+                station.id, {"song": {"title": f"Load test {index}"}}
+            )
+            await asyncio.gather(
+                *[communicator.receive_from() for (communicator, _, _) in listeners]
+            )
+            broadcast_timings.append(time.perf_counter() - sent)
+
+        broadcast = LoadTestResult(
+            f"websocket_broadcast ({len(listeners)} listeners)",
+            broadcast_timings,
+            time.perf_counter() - start,
+            0,
+        )
+
+        for (communicator, _, _) in listeners:
+            await communicator.disconnect()
+
+        return [connect, broadcast]
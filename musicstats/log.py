@@ -0,0 +1,186 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import logging
+import time
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Attributes every log record has, so anything else was passed in extra=
+
+STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as single line JSON objects, including any fields
+    passed with extra=.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        for (key, value) in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exception"] = "".join(traceback.format_exception(*record.exc_info))
+
+        return json.dumps(entry, default=str)
+
+
+class JobRun:
+    """Times a cron job run, each item it works on and the phases of each.
+
+    Used as a context manager around the run. Each item and its phases
+    (fetch, parse, download image, DB write, ...) are logged with their
+    durations, items taking longer than CRON_SLOW_ITEM_THRESHOLD seconds
+    are logged as warnings and a summary is logged at the end.
+
+    Args:
+        job (str): The cron job's code.
+        job_logger (logging.Logger): Where to log to.
+    """
+
+    def __init__(self, job: str, job_logger: Optional[logging.Logger] = None):
+        self.job = job
+        self.logger = job_logger or logger
+        self.items = 0
+        self.errors = 0
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.item_phases: Optional[Dict[str, float]] = None
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.logger.info("Starting %s.", self.job, extra={"job": self.job})
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        duration = time.perf_counter() - self.start
+        summary = self.summary(duration)
+
+        if exc_type:
+            self.logger.error(
+                "%s failed.",
+                self.job,
+                exc_info=(exc_type, exc_value, exc_traceback),
+                extra=summary,
+            )
+        else:
+            self.logger.info("Finished %s.", self.job, extra=summary)
+
+        return False
+
+    def summary(self, duration: float) -> dict:
+        """Summarises the run.
+
+        Args:
+            duration (float): How long the run took (seconds).
+
+        Returns:
+            dict: The job, items processed, errors, duration, throughput and
+                time spent in each phase.
+        """
+
+        return {
+            "job": self.job,
+            "items": self.items,
+            "errors": self.errors,
+            "duration": round(duration, 6),
+            "items_per_second": round(self.items / duration, 3) if duration else 0,
+            "phases": {name: round(total, 6) for (name, total) in self.phases.items()},
+        }
+
+    @contextmanager
+    def item(self, name: str):
+        """
+        Times working on a single item (e.g. a song), counting it as an error
+        if it raises.
+        """
+
+        self.items += 1
+        self.item_phases = defaultdict(float)
+        start = time.perf_counter()
+
+        def fields() -> dict:
+            return {
+                "job": self.job,
+                "item": name,
+                "duration": round(time.perf_counter() - start, 6),
+                "phases": {
+                    phase: round(total, 6)
+                    for (phase, total) in self.item_phases.items()
+                },
+            }
+
+        try:
+            yield
+        except Exception:
+            self.errors += 1
+            self.logger.exception("Failed on %s.", name, extra=fields())
+            raise
+        else:
+            item_fields = fields()
+            if item_fields["duration"] > settings.CRON_SLOW_ITEM_THRESHOLD:
+                self.logger.warning("Slow item %s.", name, extra=item_fields)
+            else:
+                self.logger.debug("Processed %s.", name, extra=item_fields)
+        finally:
+            self.item_phases = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Times a phase of the current item (or of the run, outside an item).
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.phases[name] += duration
+            if self.item_phases is not None:
+                self.item_phases[name] += duration
+
+    def failed(self, message: str, *args, **fields):
+        """Records an item that couldn't be processed (without raising).
+
+        Args:
+            message (str): What went wrong (a logging format string).
+            args: Arguments for the message.
+            fields: Extra fields to log.
+        """
+
+        self.errors += 1
+        self.logger.warning(message, *args, extra={"job": self.job, **fields})
@@ -0,0 +1,99 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from musicstats.synthetic import SyntheticCatalogue
+
+
+class Command(BaseCommand):
+    """
+    Fills the database with synthetic stations, songs and plays for load
+    testing.
+    """
+
+    help = "Generates deterministic synthetic data for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stations", type=int, default=200, help="The number of stations."
+        )
+        parser.add_argument(
+            "--artists", type=int, default=100000, help="The number of artists."
+        )
+        parser.add_argument(
+            "--songs", type=int, default=1000000, help="The number of songs."
+        )
+        parser.add_argument(
+            "--plays", type=int, default=20000000, help="The number of song plays."
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=1,
+            help="Seeds the random choices (the same seed gives the same data).",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="The number of rows to save at a time.",
+        )
+        parser.add_argument(
+            "--exponent",
+            type=float,
+            default=1.1,
+            help="The Zipf exponent for song popularity.",
+        )
+        parser.add_argument(
+            "--end",
+            default=None,
+            help="When the last plays were (ISO 8601, defaults to this hour).",
+        )
+
+    def handle(self, *args, **options):
+        end = None
+        if options["end"]:
+            end = parse_datetime(options["end"])
+            if not end:
+                raise CommandError(f"{options['end']} is not a valid date and time.")
+            if timezone.is_naive(end):
+                end = timezone.make_aware(end)
+
+        catalogue = SyntheticCatalogue(
+            seed=options["seed"],
+            chunk_size=options["chunk_size"],
+            exponent=options["exponent"],
+            end=end,
+        )
+
+        if catalogue.exists():
+            raise CommandError("Synthetic data has already been generated.")
+
+        self.stdout.write(
+            f"Created {catalogue.create_stations(options['stations'])} stations."
+        )
+        self.stdout.write(
+            f"Created {catalogue.create_artists(options['artists'])} artists."
+        )
+        self.stdout.write(f"Created {catalogue.create_songs(options['songs'])} songs.")
+        self.stdout.write(
+            f"Created {catalogue.create_plays(options['plays'])} song plays."
+        )
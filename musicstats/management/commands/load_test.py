@@ -0,0 +1,71 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from musicstats.loadtest import LoadTest
+
+
+class Command(BaseCommand):
+    """
+    Runs load test scenarios and reports throughput and latency.
+    """
+
+    help = "Load tests song play logging, listings, now playing, EPG and websockets."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=LoadTest.SCENARIOS,
+            help="A scenario to run (can be repeated, defaults to all of them).",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=1000,
+            help="The number of requests (or websocket connections) per scenario.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=10,
+            help="The number of requests (or connections) to make at once.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=1,
+            help="Seeds the choice of stations and songs.",
+        )
+
+    def handle(self, *args, **options):
+        load_test = LoadTest(
+            requests=options["requests"],
+            concurrency=options["concurrency"],
+            seed=options["seed"],
+        )
+
+        if not load_test.stations:
+            raise CommandError(
+                "There are no stations to test (try generate_synthetic_data)."
+            )
+
+        for scenario in options["scenario"] or LoadTest.SCENARIOS:
+            for result in load_test.run(scenario):
+                self.stdout.write(str(result))
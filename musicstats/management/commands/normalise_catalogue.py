@@ -0,0 +1,54 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from django.core.management.base import BaseCommand
+from musicstats.catalogue import CatalogueNormaliser
+
+
+class Command(BaseCommand):
+    """
+    Backfills song/artist match keys and merges the duplicates they reveal.
+    """
+
+    help = "Backfills song and artist match keys and merges duplicates."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of rows to work on at a time.",
+        )
+        parser.add_argument(
+            "--no-merge",
+            action="store_true",
+            help="Only backfill the match keys.",
+        )
+
+    def handle(self, *args, **options):
+        normaliser = CatalogueNormaliser(batch_size=options["batch_size"])
+
+        self.stdout.write(f"Updated {normaliser.backfill_artists()} artist keys.")
+        self.stdout.write(f"Updated {normaliser.backfill_songs()} song keys.")
+
+        if options["no_merge"]:
+            return
+
+        self.stdout.write(f"Merged away {normaliser.merge_artists()} artists.")
+        self.stdout.write(f"Merged away {normaliser.merge_songs()} songs.")
@@ -0,0 +1,65 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from musicstats.queueing import SongPlayQueueWorker, get_queue
+
+
+class Command(BaseCommand):
+    """
+    Saves queued song plays and tells listeners about them.
+    """
+
+    help = "Saves queued song plays, in order for each station."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="The most song plays to save for a station at a time.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.5,
+            help="How long (in seconds) to wait when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Empty the queue and stop.",
+        )
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        if not queue:
+            raise CommandError("SONG_PLAY_QUEUE is not configured.")
+
+        worker = SongPlayQueueWorker(queue, batch_size=options["batch_size"])
+
+        while True:
+            processed = worker.run_once()
+            if processed:
+                self.stdout.write(f"Processed {processed} queued song plays.")
+            elif options["once"]:
+                return
+            else:
+                time.sleep(options["interval"])
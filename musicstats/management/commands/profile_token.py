@@ -0,0 +1,42 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from musicstats.profiling import profile_token
+
+
+class Command(BaseCommand):
+    """
+    Creates a token for profiling requests in production.
+    """
+
+    help = "Creates a token that profiles requests sending it in X-Profile."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "label", help="Who or what the token is for (saved with each report)."
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(profile_token(options["label"]))
+        self.stderr.write(
+            f"Valid for {settings.PROFILE_TOKEN_MAX_AGE} seconds. Send it as the "
+            "X-Profile header."
+        )
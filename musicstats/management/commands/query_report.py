@@ -0,0 +1,51 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from django.core.management.base import BaseCommand
+from musicstats import querylog
+
+
+class Command(BaseCommand):
+    """
+    Ranks the queries tallied by the query log.
+    """
+
+    help = "Lists the queries made by each view and cron job, worst first."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit", type=int, default=20, help="The number of queries to list."
+        )
+        parser.add_argument(
+            "--order",
+            choices=sorted(querylog.ORDERS),
+            default="time",
+            help="What to rank the queries by.",
+        )
+
+    def handle(self, *args, **options):
+        lines = querylog.report(options["limit"], options["order"])
+        if not lines:
+            self.stdout.write(
+                "No queries have been logged (is QUERYLOG_ENABLED set, with "
+                "QUERYLOG_DIRECTORY shared with the web and cron processes?)."
+            )
+
+        for line in lines:
+            self.stdout.write(line)
@@ -0,0 +1,468 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+
+# Metrics are kept in memory in each process and served in the Prometheus
+# text format by the /metrics view. With METRICS_DIRECTORY set, every
+# process (web workers, the cron runner, queue workers) also writes its
+# metrics there now and then, and /metrics adds them all up.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Every metric registers itself here when it's created
+
+REGISTRY: List["Metric"] = []
+
+
+class Metric:
+    """A value, optionally split by labels.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): What it measures.
+        registry (list): Where to register it (None to leave it out of the
+            registry, e.g. for values worked out when they're served).
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple, object] = {}
+
+        if registry is not None:
+            registry.append(self)
+
+    def snapshot(self) -> Dict[Tuple, object]:
+        """
+        Copies the current values, by label.
+        """
+
+        with self.lock:
+            return {
+                labels: list(value) if isinstance(value, list) else value
+                for (labels, value) in self.values.items()
+            }
+
+    @staticmethod
+    def combine(first, second):
+        """
+        Adds together two values from different processes.
+        """
+
+        return first + second
+
+    def samples(
+        self, values: Dict[Tuple, object]
+    ) -> Iterable[Tuple[str, Tuple, float]]:
+        """
+        Lists the (name, labels, value) lines to expose.
+        """
+
+        for (labels, value) in sorted(values.items()):
+            yield (self.name, labels, value)
+
+
+class Counter(Metric):
+    """
+    A count that only ever goes up.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Increases the count.
+
+        Args:
+            amount (float): The amount to increase it by.
+            labels: The labels to count against.
+        """
+
+        key = _key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Obtains the current count.
+
+        Args:
+            labels: The labels to read the count for.
+
+        Returns:
+            float: The count.
+        """
+
+        with self.lock:
+            return self.values.get(_key(labels), 0)
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down.
+    """
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        """Decreases the value.
+
+        Args:
+            amount (float): The amount to decrease it by.
+            labels: The labels to change the value for.
+        """
+
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        """Sets the value.
+
+        Args:
+            value (float): The new value.
+            labels: The labels to set the value for.
+        """
+
+        with self.lock:
+            self.values[_key(labels)] = value
+
+
+class Histogram(Metric):
+    """Counts observations (e.g. durations) in buckets.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): What it measures.
+        buckets (tuple): The upper bounds of the buckets, in order.
+        registry (list): Where to register it.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+        registry=REGISTRY,
+    ):
+        super().__init__(name, documentation, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        """Records an observation.
+
+        Args:
+            value (float): The observation.
+            labels: The labels to record it against.
+        """
+
+        key = _key(labels)
+        index = bisect_left(self.buckets, value)
+
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+
+                # A count for each bucket (plus +Inf), then the sum
+
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Records how long the block takes (in seconds).
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        """Obtains the number of observations.
+
+        Args:
+            labels: The labels to read the count for.
+
+        Returns:
+            int: The number of observations.
+        """
+
+        with self.lock:
+            return sum(self.values.get(_key(labels), [0, 0])[:-1])
+
+    @staticmethod
+    def combine(first, second):
+        return [a + b for (a, b) in zip(first, second)]
+
+    def samples(self, values):
+        for (labels, counts) in sorted(values.items()):
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    labels + (("le", _number(bound)),),
+                    cumulative,
+                )
+            yield (f"{self.name}_sum", labels, counts[-1])
+            yield (f"{self.name}_count", labels, cumulative)
+
+
+def _key(labels: dict) -> Tuple:
+    """
+    Turns labels into a dictionary key.
+    """
+
+    return tuple(sorted((name, str(value)) for (name, value) in labels.items()))
+
+
+def _number(value: float) -> str:
+    """
+    Formats a number the way Prometheus expects.
+    """
+
+    if value == float("inf"):
+        return "+Inf"
+
+    if value == int(value):
+        return f"{int(value)}.0" if abs(value) < 1e15 else repr(float(value))
+
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    """
+    Escapes a label value.
+    """
+
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Sharing metrics between processes
+
+_last_flush = 0.0
+
+
+def flush():
+    """
+    Writes this process's metrics to METRICS_DIRECTORY (if it's set).
+    """
+
+    global _last_flush  # pylint: disable=global-statement
+
+    if not settings.METRICS_DIRECTORY:
+        return
+
+    _last_flush = time.monotonic()
+    data = {
+        metric.name: [
+            [list(labels), value] for (labels, value) in metric.snapshot().items()
+        ]
+        for metric in REGISTRY
+    }
+
+    path = os.path.join(settings.METRICS_DIRECTORY, f"{os.getpid()}.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as temp_file:
+        json.dump(data, temp_file)
+    os.replace(f"{path}.tmp", path)
+
+
+def maybe_flush():
+    """
+    Writes this process's metrics if it's been METRICS_FLUSH_INTERVAL seconds
+    since it last did.
+    """
+
+    if (
+        settings.METRICS_DIRECTORY
+        and time.monotonic() - _last_flush > settings.METRICS_FLUSH_INTERVAL
+    ):
+        flush()
+
+
+def _other_processes() -> Dict[str, List]:
+    """
+    Reads the metrics written by every other process.
+    """
+
+    combined = {}
+    if not settings.METRICS_DIRECTORY:
+        return combined
+
+    ours = f"{os.getpid()}.json"
+    for file_name in os.listdir(settings.METRICS_DIRECTORY):
+        if not file_name.endswith(".json") or file_name == ours:
+            continue
+
+        # Processes that have stopped (or been restarted) no longer count
+
+        path = os.path.join(settings.METRICS_DIRECTORY, file_name)
+        try:
+            if time.time() - os.path.getmtime(path) > settings.METRICS_STALE_AFTER:
+                os.remove(path)
+                continue
+
+            with open(path, encoding="utf-8") as metrics_file:
+                data = json.load(metrics_file)
+        except (OSError, ValueError):
+            continue
+
+        for (name, values) in data.items():
+            combined.setdefault(name, []).extend(values)
+
+    return combined
+
+
+def render(extra: Optional[List[Metric]] = None) -> str:
+    """Formats every metric in the Prometheus text format.
+
+    Args:
+        extra (List[Metric]): Further (unregistered) metrics to include.
+
+    Returns:
+        str: The metrics.
+    """
+
+    others = _other_processes()
+    lines = []
+
+    for metric in REGISTRY + (extra or []):
+        values = metric.snapshot()
+        for (labels, value) in others.get(metric.name, []):
+            labels = tuple(tuple(label) for label in labels)
+            values[labels] = (
+                metric.combine(values[labels], value) if labels in values else value
+            )
+
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for (name, labels, value) in metric.samples(values):
+            if labels:
+                label_text = ",".join(
+                    f'{label}="{_escape(label_value)}"'
+                    for (label, label_value) in labels
+                )
+                lines.append(f"{name}{{{label_text}}} {_number(value)}")
+            else:
+                lines.append(f"{name} {_number(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def cron_job_metrics() -> List[Metric]:
+    """Reads how each cron job last went from the django_cron log.
+
+    Cron jobs usually run in their own process, so this works whether or
+    not METRICS_DIRECTORY is set.
+
+    Returns:
+        List[Metric]: The metrics (not registered).
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from django.utils.module_loading import import_string
+    from django_cron.models import CronJobLog
+
+    duration = Gauge(
+        "musicstats_cron_job_last_duration_seconds",
+        "Time taken by the last run of each cron job.",
+        registry=None,
+    )
+    success = Gauge(
+        "musicstats_cron_job_last_success",
+        "Whether the last run of each cron job succeeded.",
+        registry=None,
+    )
+    finished = Gauge(
+        "musicstats_cron_job_last_run_timestamp_seconds",
+        "When the last run of each cron job finished.",
+        registry=None,
+    )
+
+    for class_path in settings.CRON_CLASSES:
+        code = import_string(class_path).code
+        log = CronJobLog.objects.filter(code=code).order_by("-start_time").first()
+        if log:
+            duration.set((log.end_time - log.start_time).total_seconds(), job=code)
+            success.set(1 if log.is_success else 0, job=code)
+            finished.set(log.end_time.timestamp(), job=code)
+
+    return [duration, success, finished]
+
+
+# Requests
+
+http_request_duration = Histogram(
+    "musicstats_http_request_duration_seconds",
+    "Time taken to respond to HTTP requests, by view.",
+)
+http_request_queries = Histogram(
+    "musicstats_http_request_db_queries",
+    "Database queries made by each HTTP request, by view.",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+
+# Websockets
+
+websocket_connections = Gauge(
+    "musicstats_websocket_connections",
+    "Open websocket connections listening to each station (or the dashboard).",
+)
+websocket_messages_coalesced = Counter(
+    "musicstats_websocket_messages_coalesced_total",
+    "Websocket messages replaced by a newer one before they were sent.",
+)
+websocket_messages_dropped = Counter(
+    "musicstats_websocket_messages_dropped_total",
+    "Websocket messages dropped because a listener's send queue was full.",
+)
+websocket_evictions = Counter(
+    "musicstats_websocket_evictions_total",
+    "Websocket listeners disconnected for falling too far behind.",
+)
+broadcast_duration = Histogram(
+    "musicstats_broadcast_duration_seconds",
+    "Time taken to send a now playing update to every listener group.",
+)
+
+# Background jobs
+
+cron_job_duration = Histogram(
+    "musicstats_cron_job_duration_seconds",
+    "Time taken by each cron job run.",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600),
+)
+upstream_request_duration = Histogram(
+    "musicstats_upstream_request_duration_seconds",
+    "Time taken by requests to other services (Last.fm, iTunes, EPG sources).",
+)
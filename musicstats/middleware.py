@@ -0,0 +1,374 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import gzip
+import re
+import time
+import zlib
+from typing import Optional
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from musicstats import metrics, querylog
+from musicstats.profiling import RequestProfiler, profile_label
+from musicstats.querylog import QueryRecorder
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+REFUSED = re.compile(r"q=0(?:\.0{0,3})?")
+
+
+class GzipStream:
+    """
+    Compresses a stream of chunks with gzip, flushing after each one.
+    """
+
+    encoding = "gzip"
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(
+            settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16
+        )
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self.compressor.compress(chunk) + self.compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+    @staticmethod
+    def compress_all(content: bytes) -> bytes:
+        return gzip.compress(content, settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class BrotliStream:
+    """
+    Compresses a stream of chunks with Brotli, flushing after each one.
+    """
+
+    encoding = "br"
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self.compressor.process(chunk) + self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+    @staticmethod
+    def compress_all(content: bytes) -> bytes:
+        return brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses API responses with Brotli (when installed) or gzip.
+
+    Only responses under COMPRESSION_PATH_PREFIX are compressed. Regular
+    responses must be at least COMPRESSION_MIN_SIZE bytes; streaming
+    responses are compressed chunk by chunk so clients still see each chunk
+    as soon as it's sent.
+    """
+
+    def process_response(self, request, response):
+        if not request.path.startswith(settings.COMPRESSION_PATH_PREFIX):
+            return response
+
+        if response.has_header("Content-Encoding"):
+            return response
+
+        # Event streams go out uncompressed as some proxies hold them back
+
+        if response.get("Content-Type", "").startswith("text/event-stream"):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        stream_class = self.choose(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if not stream_class:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.compress_async(
+                    stream_class(), response.streaming_content
+                )
+            else:
+                response.streaming_content = self.compress_sync(
+                    stream_class(), response.streaming_content
+                )
+            del response.headers["Content-Length"]
+        else:
+            if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+                return response
+
+            compressed = stream_class.compress_all(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        # The content's changed so the ETag can only be weak
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+
+        response.headers["Content-Encoding"] = stream_class.encoding
+        return response
+
+    def choose(self, accept_encoding: str) -> Optional[type]:
+        """Picks the best compression the client accepts.
+
+        Args:
+            accept_encoding (str): The Accept-Encoding request header.
+
+        Returns:
+            type: The stream class for the compression (or None for none).
+        """
+
+        accepted = set()
+
+        for item in accept_encoding.split(","):
+            (coding, _, params) = item.strip().partition(";")
+            if REFUSED.fullmatch(params.strip().replace(" ", "")):
+                continue
+            accepted.add(coding.strip().lower())
+
+        if brotli and "br" in accepted:
+            return BrotliStream
+
+        if "gzip" in accepted:
+            return GzipStream
+
+        return None
+
+    def compress_sync(self, stream, chunks):
+        """
+        Compresses a synchronous streaming response.
+        """
+
+        for chunk in chunks:
+            compressed = stream.compress(chunk)
+            if compressed:
+                yield compressed
+
+        yield stream.finish()
+
+    async def compress_async(self, stream, chunks):
+        """
+        Compresses an asynchronous streaming response.
+        """
+
+        async for chunk in chunks:
+            compressed = stream.compress(chunk)
+            if compressed:
+                yield compressed
+
+        yield stream.finish()
+
+
+def view_name(request) -> str:
+    """Names the view that handled a request, for labelling metrics.
+
+    Args:
+        request (HttpRequest): The request.
+
+    Returns:
+        str: The view's class or function name.
+    """
+
+    match = getattr(request, "resolver_match", None)
+    if not match:
+        return "unmatched"
+
+    func = match.func
+    view_class = getattr(func, "view_class", None) or getattr(func, "cls", None)
+    return (view_class or func).__name__
+
+
+class MetricsMiddleware:
+    """
+    Records how long each request takes and how many database queries it
+    makes, by view.
+
+    Async requests stay async (so long polls and streams don't tie up a
+    thread). Their queries run in other threads, so only their latency is
+    recorded.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+
+        self.record(request, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+
+        self.record(request, time.perf_counter() - start)
+        return response
+
+    def record(self, request, duration: float, queries: Optional[int] = None):
+        """Records the metrics for a request.
+
+        Args:
+            request (HttpRequest): The request.
+            duration (float): How long it took (seconds).
+            queries (int): The number of queries it made (if known).
+        """
+
+        view = view_name(request)
+        metrics.http_request_duration.observe(
+            duration, view=view, method=request.method
+        )
+        if queries is not None:
+            metrics.http_request_queries.observe(queries, view=view)
+        metrics.maybe_flush()
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests that ask for it (see profiling.py), saving a report
+    that can be downloaded from the admin. Other requests aren't touched.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        label = profile_label(request)
+        if not label:
+            return self.get_response(request)
+
+        profiler = RequestProfiler()
+        response = profiler.run(self.get_response, request)
+        report = profiler.save(request, response, label, view_name(request))
+        response["X-Profile-Report"] = report.id
+
+        return response
+
+    async def __acall__(self, request):
+        # Only hop threads (checking for staff needs the database) when
+        # profiling's been asked for
+
+        label = None
+        if "X-Profile" in request.headers or "profile" in request.GET:
+            label = await sync_to_async(profile_label)(request)
+
+        if not label:
+            return await self.get_response(request)
+
+        profiler = RequestProfiler()
+        response = await profiler.arun(self.get_response, request)
+        report = await sync_to_async(profiler.save)(
+            request, response, label, view_name(request)
+        )
+        response["X-Profile-Report"] = report.id
+
+        return response
+
+
+class QueryLogMiddleware:
+    """
+    Tallies the queries each view makes, when QUERYLOG_ENABLED is set (see
+    querylog.py).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not settings.QUERYLOG_ENABLED:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with recorder:
+            response = self.get_response(request)
+
+        recorder.save(view_name(request))
+        querylog.maybe_flush()
+
+        return response
+
+    async def __acall__(self, request):
+        if not settings.QUERYLOG_ENABLED:
+            return await self.get_response(request)
+
+        # Async views query through sync_to_async, which runs everything
+        # for a request on the same thread, so that's where we record
+
+        recorder = QueryRecorder()
+        await sync_to_async(recorder.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recorder.__exit__)(None, None, None)
+
+        recorder.save(view_name(request))
+        querylog.maybe_flush()
+
+        return response
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:58
+
+from django.db import migrations, models
+import django.utils.timezone
+from django.db.models import F
+
+
+def copy_received(apps, schema_editor):
+    """Existing plays were received when they were logged."""
+
+    SongPlay = apps.get_model("musicstats", "SongPlay")
+    SongPlay.objects.update(received=F("date_time"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("musicstats", "0016_proradiodatasource_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="songplay",
+            name="received",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_received, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="songplay",
+            name="date_time",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="songplay",
+            index=models.Index(
+                fields=["station", "-date_time"], name="songplay_station_time_idx"
+            ),
+        ),
+    ]
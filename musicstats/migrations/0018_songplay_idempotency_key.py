@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("musicstats", "0017_songplay_received"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="songplay",
+            name="idempotency_key",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="songplay",
+            constraint=models.UniqueConstraint(
+                fields=("station", "idempotency_key"),
+                name="songplay_unique_idempotency_key",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("musicstats", "0018_songplay_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artist",
+            name="match_key",
+            field=models.TextField(blank=True, db_index=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name="song",
+            name="match_key",
+            field=models.TextField(blank=True, db_index=True, editable=False),
+        ),
+    ]
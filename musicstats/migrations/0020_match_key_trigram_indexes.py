@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:20
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+TRIGRAM_INDEXES = [
+    ("song_match_key_trgm_idx", "musicstats_song"),
+    ("artist_match_key_trgm_idx", "musicstats_artist"),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """GIN trigram indexes only exist on Postgres."""
+
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for (name, table) in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} "
+            "USING gin (match_key gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for (name, _) in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("musicstats", "0019_match_keys"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
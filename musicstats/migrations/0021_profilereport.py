@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("musicstats", "0020_match_key_trigram_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProfileReport",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("requested_by", models.TextField()),
+                ("method", models.CharField(max_length=10)),
+                ("path", models.TextField()),
+                ("view", models.TextField()),
+                ("status_code", models.IntegerField()),
+                ("duration", models.FloatField()),
+                ("query_count", models.IntegerField()),
+                ("query_time", models.FloatField()),
+                ("queries", models.JSONField(default=list)),
+                ("stats", models.TextField()),
+                ("profile", models.BinaryField()),
+            ],
+            options={
+                "ordering": ["-created"],
+            },
+        ),
+    ]
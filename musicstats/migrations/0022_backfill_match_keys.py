@@ -0,0 +1,50 @@
+from django.db import migrations
+from musicstats.normalise import artist_match_key, song_match_key
+
+BATCH_SIZE = 1000
+
+
+def backfill(model, fields, key):
+    """Sets the match key on every row still missing one, a batch at a time."""
+
+    last_pk = 0
+    while True:
+        batch = list(
+            model.objects.filter(pk__gt=last_pk, match_key="")
+            .order_by("pk")
+            .only("pk", "match_key", *fields)[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+
+        for row in batch:
+            row.match_key = key(row)
+
+        model.objects.bulk_update(batch, ["match_key"])
+        last_pk = batch[-1].pk
+
+
+def backfill_match_keys(apps, schema_editor):
+    """Existing songs and artists need keys to be matched (and found) at all."""
+
+    backfill(
+        apps.get_model("musicstats", "Artist"),
+        ["name"],
+        lambda artist: artist_match_key(artist.name),
+    )
+    backfill(
+        apps.get_model("musicstats", "Song"),
+        ["display_artist", "title"],
+        lambda song: song_match_key(song.display_artist, song.title),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("musicstats", "0021_profilereport"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_match_keys, migrations.RunPython.noop),
+    ]
@@ -20,9 +20,11 @@
 import calendar
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from colorful.fields import RGBColorField
 from polymorphic.models import PolymorphicModel
 from timezone_field import TimeZoneField
+from musicstats.normalise import artist_match_key, song_match_key
 
 # Utility methods
 
@@ -86,10 +88,15 @@ class Artist(models.Model):
     image = models.ImageField(upload_to=artist_image_path, blank=True)
     musicbrainz_id = models.CharField(max_length=255)
     wiki_content = models.TextField(blank=True)
+    match_key = models.TextField(db_index=True, blank=True, editable=False)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.match_key = artist_match_key(self.name)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ["name"]
 
@@ -108,10 +115,15 @@ class Song(models.Model):
     wiki_content = models.TextField(blank=True)
     itunes_url = models.TextField(blank=True)
     amazon_url = models.TextField(blank=True)
+    match_key = models.TextField(db_index=True, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.display_artist} - {self.title}"
 
+    def save(self, *args, **kwargs):
+        self.match_key = song_match_key(self.display_artist, self.title)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ["display_artist", "title"]
 
@@ -215,11 +227,26 @@ class SongPlay(models.Model):
 
     song = models.ForeignKey(Song, on_delete=models.DO_NOTHING)
     station = models.ForeignKey(Station, on_delete=models.DO_NOTHING)
-    date_time = models.DateTimeField(auto_now=True)
+    date_time = models.DateTimeField(default=timezone.now)
+    received = models.DateTimeField(auto_now_add=True)
+    idempotency_key = models.CharField(max_length=255, blank=True, null=True)
 
     def __str__(self):
         return f"{self.song} on {self.station} at {self.date_time}"
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["station", "-date_time"], name="songplay_station_time_idx"
+            )
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["station", "idempotency_key"],
+                name="songplay_unique_idempotency_key",
+            )
+        ]
+
 
 class EpgEntry(models.Model):
     """
@@ -287,3 +314,26 @@ class Presenter(models.Model):
 
     class Meta:
         unique_together = ["name", "station"]
+
+
+class ProfileReport(models.Model):
+    """A profile of a single request, captured on demand (see profiling.py)."""
+
+    created = models.DateTimeField(auto_now_add=True)
+    requested_by = models.TextField()
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    view = models.TextField()
+    status_code = models.IntegerField()
+    duration = models.FloatField()
+    query_count = models.IntegerField()
+    query_time = models.FloatField()
+    queries = models.JSONField(default=list)
+    stats = models.TextField()
+    profile = models.BinaryField()
+
+    def __str__(self):
+        return f"{self.method} {self.path} at {self.created}"
+
+    class Meta:
+        ordering = ["-created"]
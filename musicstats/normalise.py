@@ -0,0 +1,80 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import re
+import unicodedata
+
+APOSTROPHES = re.compile(r"['‘’`]")
+AMPERSAND = re.compile(r"\s*(?:&|\+)\s*")
+FEATURING = re.compile(r"\b(?:feat|featuring|ft)\b\.?")
+NOT_ALPHANUMERIC = re.compile(r"[^\w]+|_")
+KEY_SEPARATOR = "|"
+
+
+def normalise(text: str) -> str:
+    """Normalises text for matching.
+
+    Ignores case, accents, punctuation, spacing and the different ways of
+    writing "featuring" and "and".
+
+    Args:
+        text (str): The text to normalise.
+
+    Returns:
+        str: The normalised text.
+    """
+
+    folded = unicodedata.normalize("NFKD", text)
+    folded = "".join(char for char in folded if not unicodedata.combining(char))
+    folded = folded.casefold()
+    folded = APOSTROPHES.sub("", folded)
+    folded = AMPERSAND.sub(" and ", folded)
+    folded = FEATURING.sub(" feat ", folded)
+    folded = " ".join(NOT_ALPHANUMERIC.sub(" ", folded).split())
+
+    # Don't lose anything that's nothing but punctuation
+
+    return folded or " ".join(text.casefold().split())
+
+
+def artist_match_key(name: str) -> str:
+    """Obtains the match key for an artist.
+
+    Args:
+        name (str): The artist name.
+
+    Returns:
+        str: The match key.
+    """
+
+    return normalise(name)
+
+
+def song_match_key(display_artist: str, title: str) -> str:
+    """Obtains the match key for a song.
+
+    Args:
+        display_artist (str): The display artist for the song.
+        title (str): The song title.
+
+    Returns:
+        str: The match key.
+    """
+
+    return f"{normalise(display_artist)}{KEY_SEPARATOR}{normalise(title)}"
@@ -0,0 +1,186 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import time
+from typing import Optional
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+from musicstats.models import ProfileReport
+
+SALT = "musicstats.profiling"
+
+
+def profile_token(label: str) -> str:
+    """Creates a token that turns on profiling for requests carrying it in
+    the X-Profile header.
+
+    Args:
+        label (str): Who or what the token is for (saved with each report).
+
+    Returns:
+        str: The token (valid for PROFILE_TOKEN_MAX_AGE seconds).
+    """
+
+    return signing.TimestampSigner(salt=SALT).sign(label)
+
+
+def profile_label(request) -> Optional[str]:
+    """Works out if a request should be profiled.
+
+    Requests are profiled if they carry a valid token in the X-Profile
+    header, or come from a staff member and have ?profile in the query
+    string. Nothing is looked up for any other request.
+
+    Args:
+        request (HttpRequest): The request.
+
+    Returns:
+        str: Who asked for the profile (or None if it shouldn't be
+            profiled).
+    """
+
+    token = request.headers.get("X-Profile")
+    if token:
+        try:
+            return signing.TimestampSigner(salt=SALT).unsign(
+                token, max_age=settings.PROFILE_TOKEN_MAX_AGE
+            )
+        except signing.BadSignature:
+            return None
+
+    if "profile" in request.GET:
+        user = getattr(request, "user", None)
+        if user and user.is_staff:
+            return user.get_username()
+
+    return None
+
+
+class RequestProfiler:
+    """Profiles the code run and times the SQL queries made for a request."""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.queries = []
+        self.duration = 0.0
+
+    def record(self, execute, sql, params, many, context):
+        """
+        Times a query (used as a database execute wrapper).
+        """
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                {"sql": sql, "time": round(time.perf_counter() - start, 6)}
+            )
+
+    def run(self, get_response, request):
+        """Gets the response to a request while profiling it.
+
+        Args:
+            get_response (Callable): Gets the response.
+            request (HttpRequest): The request.
+
+        Returns:
+            HttpResponse: The response.
+        """
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(self.record):
+            self.profiler.enable()
+            try:
+                return get_response(request)
+            finally:
+                self.profiler.disable()
+                self.duration = time.perf_counter() - start
+
+    async def arun(self, get_response, request):
+        """Awaits the response to a request while profiling it.
+
+        Only the code run on the event loop is profiled, and queries made
+        from other threads (through sync_to_async) aren't recorded.
+
+        Args:
+            get_response (Callable): Gets the response (a coroutine).
+            request (HttpRequest): The request.
+
+        Returns:
+            HttpResponse: The response.
+        """
+
+        start = time.perf_counter()
+        self.profiler.enable()
+        try:
+            return await get_response(request)
+        finally:
+            self.profiler.disable()
+            self.duration = time.perf_counter() - start
+
+    def stats(self) -> str:
+        """Summarises the profile, slowest functions (cumulatively) first.
+
+        Returns:
+            str: The top PROFILE_STATS_LIMIT functions.
+        """
+
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats(
+            pstats.SortKey.CUMULATIVE
+        ).print_stats(settings.PROFILE_STATS_LIMIT)
+        return stream.getvalue()
+
+    def save(self, request, response, label: str, view: str) -> ProfileReport:
+        """Saves a report on the request.
+
+        Args:
+            request (HttpRequest): The request.
+            response (HttpResponse): The response.
+            label (str): Who asked for the profile.
+            view (str): The name of the view that handled the request.
+
+        Returns:
+            ProfileReport: The saved report.
+        """
+
+        # pstats takes the stats from the profiler so save them first
+
+        self.profiler.create_stats()
+        profile = marshal.dumps(self.profiler.stats)
+
+        return ProfileReport.objects.create(
+            requested_by=label,
+            method=request.method,
+            path=request.get_full_path(),
+            view=view,
+            status_code=response.status_code,
+            duration=self.duration,
+            query_count=len(self.queries),
+            query_time=sum(query["time"] for query in self.queries),
+            queries=self.queries,
+            stats=self.stats(),
+            profile=profile,
+        )
@@ -0,0 +1,113 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from musicstats.renderers import dumps
+
+# Version 1 of the now playing websocket protocol (nowplaying/v1/).
+#
+# Clients send JSON messages:
+#
+#   {"type": "subscribe", "stations": ["A", "B"], "format": "compact",
+#    "since": 1234}
+#   {"type": "unsubscribe", "stations": ["A"]}
+#
+# "format" is "compact" (the default) or "full". "since" is the last "seq"
+# the client saw, to resume after reconnecting.
+#
+# The server sends:
+#
+#   {"v": 1, "type": "subscribed", "stations": ["A", "B"]}
+#   {"v": 1, "type": "now_playing", "station": "A", "seq": 1235, "data": {...}}
+#   {"v": 1, "type": "delta", "station": "A", "seq": 1236, "data": {...}}
+#   {"v": 1, "type": "error", "error": "..."}
+#
+# The first song play for each station is sent whole, then only the fields
+# that changed (null for ones that went away) for the client to merge in.
+
+PROTOCOL_VERSION = 1
+
+FORMATS = ("compact", "full")
+
+COMPACT_SONG_FIELDS = ("display_artist", "title", "thumbnail")
+
+
+def compact(data: dict) -> dict:
+    """Cuts a serialised song play down to what a now playing display needs.
+
+    Args:
+        data (dict): The serialised song play.
+
+    Returns:
+        dict: The compact song play.
+    """
+
+    return {
+        "song": {
+            field: data["song"][field]
+            for field in COMPACT_SONG_FIELDS
+            if field in data["song"]
+        },
+        "date_time": data.get("date_time"),
+    }
+
+
+def delta(old: dict, new: dict) -> dict:
+    """Works out what changed between two payloads.
+
+    Nested dictionaries are compared field by field. Fields that are no
+    longer present are given as None.
+
+    Args:
+        old (dict): The payload the client has.
+        new (dict): The payload to send.
+
+    Returns:
+        dict: The fields that changed.
+    """
+
+    changes = {}
+
+    for (key, value) in new.items():
+        if key not in old:
+            changes[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            nested = delta(old[key], value)
+            if nested:
+                changes[key] = nested
+        elif old[key] != value:
+            changes[key] = value
+
+    for key in old.keys() - new.keys():
+        changes[key] = None
+
+    return changes
+
+
+def message(message_type: str, **fields) -> str:
+    """Builds a message to send to the client.
+
+    Args:
+        message_type (str): The type of message.
+        fields: The rest of the message.
+
+    Returns:
+        str: The encoded message.
+    """
+
+    return dumps({"v": PROTOCOL_VERSION, "type": message_type, **fields}).decode()
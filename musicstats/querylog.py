@@ -0,0 +1,305 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from typing import Dict, List, Tuple
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# With QUERYLOG_ENABLED set, every query made while handling a request (or
+# running a cron job) is fingerprinted and added to a tally for that view
+# (or job). The tallies are kept in memory in each process and, with
+# QUERYLOG_DIRECTORY set, written there now and then so query_report can
+# rank them across every process.
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+PLACEHOLDERS = re.compile(r"%s|\?")
+LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+SAVEPOINTS = re.compile(r"\b(SAVEPOINT)\s+\"?\w+\"?", re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql: str) -> str:
+    """Reduces a query to its shape, so queries differing only in their
+    values are counted together.
+
+    Values become ?, lists of values (IN clauses, rows of a bulk insert)
+    become (...) and savepoint names are dropped.
+
+    Args:
+        sql (str): The SQL.
+
+    Returns:
+        str: The fingerprint.
+    """
+
+    sql = STRINGS.sub("?", sql)
+    sql = NUMBERS.sub("?", sql)
+    sql = PLACEHOLDERS.sub("?", sql)
+    sql = LISTS.sub("(...)", sql)
+    sql = ROWS.sub("(...)", sql)
+    sql = SAVEPOINTS.sub(r"\1 ?", sql)
+    return WHITESPACE.sub(" ", sql).strip()
+
+
+class QueryTally:
+    """What we know about one kind of query, in one view or cron job."""
+
+    def __init__(self, count=0, total_time=0.0, max_time=0.0, duplicates=0, flagged=0):
+        self.count = count
+        self.total_time = total_time
+        self.max_time = max_time
+        self.duplicates = duplicates
+        self.flagged = flagged
+
+    def add(self, other: "QueryTally"):
+        """
+        Adds another tally to this one.
+        """
+
+        self.count += other.count
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+        self.duplicates += other.duplicates
+        self.flagged += other.flagged
+
+    def to_list(self) -> list:
+        return [
+            self.count,
+            self.total_time,
+            self.max_time,
+            self.duplicates,
+            self.flagged,
+        ]
+
+
+_lock = threading.Lock()
+_tallies: Dict[Tuple[str, str], QueryTally] = {}
+_last_flush = 0.0
+
+
+class QueryRecorder:
+    """Records the queries made on every database connection in this thread
+    while in use as a context manager.
+
+    Call save() afterwards to add them to the tallies and flag repeated
+    queries (a likely N+1).
+    """
+
+    def __init__(self):
+        self.queries: Dict[str, QueryTally] = {}
+        self.seen = set()
+        self.stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            tally = self.queries.setdefault(fingerprint(sql), QueryTally())
+            tally.count += 1
+            tally.total_time += elapsed
+            tally.max_time = max(tally.max_time, elapsed)
+
+            # The same query with the same values is always a duplicate
+
+            key = (sql, repr(params))
+            if key in self.seen:
+                tally.duplicates += 1
+            else:
+                self.seen.add(key)
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    def save(self, scope: str):
+        """Adds the queries to the tallies for a view or cron job.
+
+        Args:
+            scope (str): The view or cron job the queries were made for.
+        """
+
+        for (query, tally) in self.queries.items():
+            if tally.count >= settings.QUERYLOG_REPEAT_THRESHOLD:
+                tally.flagged = 1
+                logger.warning(
+                    "%s made the same query %s times (%s exact duplicates).",
+                    scope,
+                    tally.count,
+                    tally.duplicates,
+                    extra={"scope": scope, "query": query, "count": tally.count},
+                )
+
+        with _lock:
+            for (query, tally) in self.queries.items():
+                _tallies.setdefault((scope, query), QueryTally()).add(tally)
+
+
+@contextmanager
+def recording(scope: str):
+    """Records the queries made within, if QUERYLOG_ENABLED is set.
+
+    Args:
+        scope (str): The view or cron job the queries are made for.
+    """
+
+    if not settings.QUERYLOG_ENABLED:
+        yield
+        return
+
+    recorder = QueryRecorder()
+    try:
+        with recorder:
+            yield
+    finally:
+        recorder.save(scope)
+
+
+def reset():
+    """
+    Forgets every tally in this process.
+    """
+
+    with _lock:
+        _tallies.clear()
+
+
+def flush():
+    """
+    Writes this process's tallies to QUERYLOG_DIRECTORY (if it's set).
+    """
+
+    global _last_flush  # pylint: disable=global-statement
+
+    if not settings.QUERYLOG_DIRECTORY:
+        return
+
+    _last_flush = time.monotonic()
+    with _lock:
+        data = [
+            [scope, query, *tally.to_list()]
+            for ((scope, query), tally) in _tallies.items()
+        ]
+
+    path = os.path.join(settings.QUERYLOG_DIRECTORY, f"{os.getpid()}.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as temp_file:
+        json.dump(data, temp_file)
+    os.replace(f"{path}.tmp", path)
+
+
+def maybe_flush():
+    """
+    Writes this process's tallies if it's been METRICS_FLUSH_INTERVAL seconds
+    since it last did.
+    """
+
+    if (
+        settings.QUERYLOG_DIRECTORY
+        and time.monotonic() - _last_flush > settings.METRICS_FLUSH_INTERVAL
+    ):
+        flush()
+
+
+def tallies() -> Dict[Tuple[str, str], QueryTally]:
+    """Adds up the tallies from this process and every other that's written
+    to QUERYLOG_DIRECTORY.
+
+    Returns:
+        Dict[Tuple[str, str], QueryTally]: The tallies by view (or cron job)
+            and query fingerprint.
+    """
+
+    combined = {}
+    with _lock:
+        for (key, tally) in _tallies.items():
+            combined[key] = QueryTally(*tally.to_list())
+
+    if not settings.QUERYLOG_DIRECTORY:
+        return combined
+
+    ours = f"{os.getpid()}.json"
+    for file_name in os.listdir(settings.QUERYLOG_DIRECTORY):
+        if not file_name.endswith(".json") or file_name == ours:
+            continue
+
+        try:
+            with open(
+                os.path.join(settings.QUERYLOG_DIRECTORY, file_name), encoding="utf-8"
+            ) as querylog_file:
+                data = json.load(querylog_file)
+        except (OSError, ValueError):
+            continue
+
+        for (scope, query, *values) in data:
+            combined.setdefault((scope, query), QueryTally()).add(QueryTally(*values))
+
+    return combined
+
+
+ORDERS = {
+    "time": lambda tally: tally.total_time,
+    "count": lambda tally: tally.count,
+    "duplicates": lambda tally: tally.duplicates,
+}
+
+
+def report(limit: int = 20, order: str = "time") -> List[str]:
+    """Ranks the queries, worst first.
+
+    Args:
+        limit (int): The number of queries to list.
+        order (str): What to rank by (time, count or duplicates).
+
+    Returns:
+        List[str]: The lines of the report.
+    """
+
+    ranked = sorted(
+        tallies().items(), key=lambda item: ORDERS[order](item[1]), reverse=True
+    )
+
+    lines = []
+    for (rank, ((scope, query), tally)) in enumerate(ranked[:limit], 1):
+        lines.append(
+            f"{rank}. {scope}: {tally.count} queries, {tally.total_time * 1000:.1f}ms "
+            f"(max {tally.max_time * 1000:.1f}ms), {tally.duplicates} duplicates"
+            + (f", N+1 in {tally.flagged} runs" if tally.flagged else "")
+        )
+        lines.append(f"   {query}")
+
+    return lines
@@ -0,0 +1,524 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import itertools
+import json
+import logging
+import uuid
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+from musicstats.ingest import BulkSongPlayLogger
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryQueue:
+    """A song play queue held in memory.
+
+    Only useful for tests and development, as nothing's shared between
+    processes and it's all lost on restart.
+    """
+
+    # Shared by every instance in the process: station ID -> [(ID, item)]
+
+    _queues: Dict[int, deque] = {}
+    _dead_letters: Dict[int, list] = {}
+    _attempts: Dict[int, int] = {}
+    _ids = itertools.count(1)
+
+    def __init__(self, **config):
+        pass
+
+    def push(self, station_id: int, item: dict) -> str:
+        """Adds a song play to the end of a station's queue.
+
+        Args:
+            station_id (int): The ID of the station.
+            item (dict): The song play.
+
+        Returns:
+            str: The ID of the queue entry.
+        """
+
+        entry_id = str(next(self._ids))
+        self._queues.setdefault(station_id, deque()).append((entry_id, item))
+        return entry_id
+
+    def stations(self) -> List[int]:
+        """Lists the stations that might have song plays waiting.
+
+        Returns:
+            List[int]: The IDs of the stations.
+        """
+
+        return [station_id for (station_id, queue) in self._queues.items() if queue]
+
+    def claim(self, station_id: int) -> bool:
+        """Claims a station's queue so only one worker applies its plays.
+
+        Args:
+            station_id (int): The ID of the station.
+
+        Returns:
+            bool: True if we've got the claim.
+        """
+
+        return True
+
+    def extend(self, station_id: int) -> bool:
+        """Keeps hold of the claim on a station's queue while we're still
+        applying its plays.
+
+        Args:
+            station_id (int): The ID of the station.
+
+        Returns:
+            bool: True if we've still got the claim.
+        """
+
+        return True
+
+    def release(self, station_id: int):
+        """Releases the claim on a station's queue.
+
+        Args:
+            station_id (int): The ID of the station.
+        """
+
+    def read(self, station_id: int, count: int) -> List[Tuple[str, dict]]:
+        """Reads the oldest song plays on a station's queue (without removing
+        them).
+
+        Args:
+            station_id (int): The ID of the station.
+            count (int): The maximum number of plays to read.
+
+        Returns:
+            List[Tuple[str, dict]]: The queue entry IDs and song plays.
+        """
+
+        return list(itertools.islice(self._queues.get(station_id, ()), count))
+
+    def remove(self, station_id: int, entry_ids: List[str]):
+        """Removes song plays that have been applied from a station's queue.
+
+        Args:
+            station_id (int): The ID of the station.
+            entry_ids (List[str]): The queue entry IDs.
+        """
+
+        queue = self._queues.get(station_id, deque())
+        entry_ids = set(entry_ids)
+
+        while queue and queue[0][0] in entry_ids:
+            queue.popleft()
+
+        self._attempts.pop(station_id, None)
+        if not queue:
+            self._queues.pop(station_id, None)
+
+    def fail(self, station_id: int) -> int:
+        """Counts a failed attempt at applying the oldest song play on a
+        station's queue.
+
+        Args:
+            station_id (int): The ID of the station.
+
+        Returns:
+            int: The number of attempts so far.
+        """
+
+        self._attempts[station_id] = self._attempts.get(station_id, 0) + 1
+        return self._attempts[station_id]
+
+    def dead_letter(self, station_id: int):
+        """Moves the oldest song play on a station's queue to its dead letter
+        queue, so it stops holding up the rest.
+
+        Args:
+            station_id (int): The ID of the station.
+        """
+
+        queue = self._queues.get(station_id)
+        if queue:
+            self._dead_letters.setdefault(station_id, []).append(queue.popleft())
+            self.remove(station_id, [])
+
+    def dead_letters(self, station_id: int) -> List[Tuple[str, dict]]:
+        """Lists the song plays on a station's dead letter queue.
+
+        Args:
+            station_id (int): The ID of the station.
+
+        Returns:
+            List[Tuple[str, dict]]: The queue entry IDs and song plays.
+        """
+
+        return list(self._dead_letters.get(station_id, ()))
+
+    def clear(self):
+        """
+        Empties every queue.
+        """
+
+        self._queues.clear()
+        self._dead_letters.clear()
+        self._attempts.clear()
+
+
+class RedisStreamQueue:
+    """A song play queue held in a Redis stream for each station.
+
+    Workers claim a station with a short lived lock before applying its
+    plays (extending it as they go), so they're always applied in order even
+    with several workers. Plays that keep failing end up in a dead letter
+    stream for each station.
+    """
+
+    PREFIX = "musicstats:songplays"
+    CLAIM_SECONDS = 60
+    ATTEMPTS_SECONDS = 86400
+
+    # Only touch the claim if it's still ours
+
+    EXTEND_SCRIPT = """
+        if redis.call("GET", KEYS[1]) == ARGV[1] then
+            return redis.call("EXPIRE", KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    RELEASE_SCRIPT = """
+        if redis.call("GET", KEYS[1]) == ARGV[1] then
+            return redis.call("DEL", KEYS[1])
+        end
+        return 0
+    """
+
+    # Forget a station once its stream's empty (atomic with push)
+
+    PRUNE_SCRIPT = """
+        if redis.call("XLEN", KEYS[1]) == 0 then
+            redis.call("SREM", KEYS[2], ARGV[1])
+        end
+    """
+
+    # Clients are shared by every instance in the process, by URL
+
+    _clients: dict = {}
+
+    def __init__(self, url: str = "redis://localhost:6379/0", **config):
+        if url not in self._clients:
+            import redis
+
+            self._clients[url] = redis.Redis.from_url(url)
+
+        self.redis = self._clients[url]
+        self.claims: Dict[int, str] = {}
+        self.extend_script = self.redis.register_script(self.EXTEND_SCRIPT)
+        self.release_script = self.redis.register_script(self.RELEASE_SCRIPT)
+        self.prune_script = self.redis.register_script(self.PRUNE_SCRIPT)
+
+    def push(self, station_id: int, item: dict) -> str:
+        pipeline = self.redis.pipeline()
+        pipeline.xadd(self._stream(station_id), {"item": json.dumps(item)})
+        pipeline.sadd(f"{self.PREFIX}:stations", station_id)
+        (entry_id, _) = pipeline.execute()
+        return entry_id.decode()
+
+    def stations(self) -> List[int]:
+        return [
+            int(station) for station in self.redis.smembers(f"{self.PREFIX}:stations")
+        ]
+
+    def claim(self, station_id: int) -> bool:
+        token = uuid.uuid4().hex
+        if not self.redis.set(
+            self._claim(station_id), token, nx=True, ex=self.CLAIM_SECONDS
+        ):
+            return False
+
+        self.claims[station_id] = token
+        return True
+
+    def extend(self, station_id: int) -> bool:
+        return bool(
+            self.extend_script(
+                keys=[self._claim(station_id)],
+                args=[self.claims.get(station_id, ""), self.CLAIM_SECONDS],
+            )
+        )
+
+    def release(self, station_id: int):
+        self.release_script(
+            keys=[self._claim(station_id)], args=[self.claims.pop(station_id, "")]
+        )
+
+    def read(self, station_id: int, count: int) -> List[Tuple[str, dict]]:
+        return [
+            (entry_id.decode(), json.loads(fields[b"item"]))
+            for (entry_id, fields) in self.redis.xrange(
+                self._stream(station_id), count=count
+            )
+        ]
+
+    def remove(self, station_id: int, entry_ids: List[str]):
+        pipeline = self.redis.pipeline()
+        if entry_ids:
+            pipeline.xdel(self._stream(station_id), *entry_ids)
+
+        pipeline.delete(self._attempts(station_id))
+        self.prune_script(
+            keys=[self._stream(station_id), f"{self.PREFIX}:stations"],
+            args=[station_id],
+            client=pipeline,
+        )
+        pipeline.execute()
+
+    def fail(self, station_id: int) -> int:
+        pipeline = self.redis.pipeline()
+        pipeline.incr(self._attempts(station_id))
+        pipeline.expire(self._attempts(station_id), self.ATTEMPTS_SECONDS)
+        (attempts, _) = pipeline.execute()
+        return attempts
+
+    def dead_letter(self, station_id: int):
+        entries = self.redis.xrange(self._stream(station_id), count=1)
+        if entries:
+            (entry_id, fields) = entries[0]
+            pipeline = self.redis.pipeline()
+            pipeline.xadd(self._dead_letter_stream(station_id), fields)
+            pipeline.xdel(self._stream(station_id), entry_id)
+            pipeline.execute()
+            self.remove(station_id, [])
+
+    def dead_letters(self, station_id: int) -> List[Tuple[str, dict]]:
+        return [
+            (entry_id.decode(), json.loads(fields[b"item"]))
+            for (entry_id, fields) in self.redis.xrange(
+                self._dead_letter_stream(station_id)
+            )
+        ]
+
+    def _stream(self, station_id: int) -> str:
+        """
+        Obtains the name of the stream for a station.
+        """
+
+        return f"{self.PREFIX}:{station_id}"
+
+    def _dead_letter_stream(self, station_id: int) -> str:
+        """
+        Obtains the name of the dead letter stream for a station.
+        """
+
+        return f"{self.PREFIX}:dead:{station_id}"
+
+    def _claim(self, station_id: int) -> str:
+        """
+        Obtains the name of the claim on a station's stream.
+        """
+
+        return f"{self.PREFIX}:claim:{station_id}"
+
+    def _attempts(self, station_id: int) -> str:
+        """
+        Obtains the name of the count of failed attempts at a station's
+        oldest play.
+        """
+
+        return f"{self.PREFIX}:attempts:{station_id}"
+
+
+def get_queue():
+    """Obtains the configured song play queue.
+
+    Returns:
+        The queue (or None if song plays are saved straight away).
+    """
+
+    if not settings.SONG_PLAY_QUEUE:
+        return None
+
+    queue_class = import_string(settings.SONG_PLAY_QUEUE["BACKEND"])
+    return queue_class(**settings.SONG_PLAY_QUEUE.get("CONFIG", {}))
+
+
+def queue_item(user: User, play: dict) -> dict:
+    """Converts a validated song play into a queue item.
+
+    Args:
+        user (User): The user logging the song play.
+        play (dict): The validated song play. This must have a time so
+            replaying it can't record it twice.
+
+    Returns:
+        dict: The queue item.
+    """
+
+    return {
+        "user": user.id,
+        "station": play["station"],
+        "song": dict(play["song"]),
+        "date_time": play["date_time"].isoformat(),
+        "idempotency_key": play.get("idempotency_key"),
+    }
+
+
+class SongPlayQueueWorker:
+    """Applies queued song plays in batches, in order for each station."""
+
+    def __init__(self, queue=None, batch_size: Optional[int] = None):
+        self.queue = queue or get_queue()
+        self.batch_size = batch_size or settings.SONG_PLAY_QUEUE_BATCH_SIZE
+
+    def run_once(self) -> int:
+        """Applies a batch of queued song plays for every station.
+
+        Returns:
+            int: The number of queued song plays dealt with.
+        """
+
+        processed = 0
+
+        for station_id in self.queue.stations():
+            if not self.queue.claim(station_id):
+                continue
+
+            try:
+                processed += self.apply(station_id)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(
+                    "Failed to apply queued song plays for station %s.", station_id
+                )
+            finally:
+                self.queue.release(station_id)
+
+        return processed
+
+    def apply(self, station_id: int) -> int:
+        """Applies a batch of queued song plays for a station.
+
+        Plays are only removed from the queue once they've been saved. If
+        the batch fails, they're applied one at a time (the idempotency keys
+        stop any being recorded twice). A play that keeps failing is moved to
+        the dead letter queue after SONG_PLAY_QUEUE_MAX_ATTEMPTS tries, so it
+        doesn't hold up the station for good.
+
+        Args:
+            station_id (int): The ID of the station.
+
+        Returns:
+            int: The number of queued song plays dealt with.
+        """
+
+        entries = self.queue.read(station_id, self.batch_size)
+        if not entries:
+            return 0
+
+        if len(entries) > 1:
+            try:
+                return self.log(station_id, entries)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(
+                    "Failed to apply queued song plays for station %s, "
+                    "trying them one at a time.",
+                    station_id,
+                )
+
+        processed = 0
+
+        for entry in entries:
+            try:
+                processed += self.log(station_id, [entry])
+            except Exception:  # pylint: disable=broad-except
+                self.failed(station_id)
+                raise
+
+        return processed
+
+    def failed(self, station_id: int):
+        """Counts a failed attempt at the oldest queued song play for a station,
+        moving it to the dead letter queue once it's had too many.
+
+        Args:
+            station_id (int): The ID of the station.
+        """
+
+        attempts = self.queue.fail(station_id)
+        if attempts >= settings.SONG_PLAY_QUEUE_MAX_ATTEMPTS:
+            logger.error(
+                "Moving a queued song play for station %s to the dead letter "
+                "queue after %s attempts.",
+                station_id,
+                attempts,
+            )
+            self.queue.dead_letter(station_id)
+
+    def log(self, station_id: int, entries: List[Tuple[str, dict]]) -> int:
+        """Saves queued song plays and removes them from the queue.
+
+        Args:
+            station_id (int): The ID of the station.
+            entries (List[Tuple[str, dict]]): The queue entry IDs and items.
+
+        Returns:
+            int: The number of queued song plays dealt with (none if we've
+                lost our claim on the station to another worker).
+        """
+
+        # Plays are applied as the user that queued them
+        # Anything they're no longer allowed to do is rejected as usual
+
+        users = User.objects.in_bulk({item["user"] for (_, item) in entries})
+        batches: Dict[int, list] = {}
+
+        for (_, item) in entries:
+            play = {
+                "station": item["station"],
+                "song": item["song"],
+                "date_time": parse_datetime(item["date_time"]),
+                "idempotency_key": item["idempotency_key"],
+            }
+            batches.setdefault(item["user"], []).append(play)
+
+        for (user_id, plays) in batches.items():
+            if not self.queue.extend(station_id):
+                logger.warning(
+                    "Lost the claim on station %s, leaving its plays queued.",
+                    station_id,
+                )
+                return 0
+
+            user = users.get(user_id)
+            if not user:
+                logger.warning(
+                    "Dropping %s queued song plays from a removed user.", len(plays)
+                )
+                continue
+
+            for result in BulkSongPlayLogger().log(user, plays):
+                if result["result"] != BulkSongPlayLogger.CREATED:
+                    logger.info("Queued song play not recorded: %s", result["result"])
+
+        self.queue.remove(station_id, [entry_id for (entry_id, _) in entries])
+        return len(entries)
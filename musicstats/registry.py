@@ -0,0 +1,123 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import time
+from typing import Dict, Iterable, List, Optional
+from django.conf import settings
+from django.http import Http404
+from musicstats.models import Station
+
+
+class StationRegistry:
+    """Looks up stations by name from an in-process cache.
+
+    Every request starts by finding its station, so we keep them in memory
+    rather than going to the database each time. Saving or deleting a
+    station clears the cache in this process (see signals.py); other
+    processes pick up the change within STATION_CACHE_TTL seconds.
+    """
+
+    # Shared by every instance in the process: name -> (expiry, station)
+
+    _stations: Dict[str, tuple] = {}
+
+    def get(self, name: str) -> Optional[Station]:
+        """Finds a station by name.
+
+        Args:
+            name (str): The name of the station.
+
+        Returns:
+            Station: The station (or None if there isn't one by that name).
+        """
+
+        return self.get_many([name]).get(name)
+
+    def get_or_404(self, name: str) -> Station:
+        """Finds a station by name, raising a 404 if it doesn't exist.
+
+        Args:
+            name (str): The name of the station.
+
+        Returns:
+            Station: The station.
+        """
+
+        station = self.get(name)
+        if not station:
+            raise Http404("No station matches the given query.")
+
+        return station
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, Station]:
+        """Finds stations by name.
+
+        Args:
+            names (Iterable[str]): The names of the stations.
+
+        Returns:
+            Dict[str, Station]: The stations that exist, by name.
+        """
+
+        now = time.monotonic()
+        found = {}
+        missing = set()
+
+        for name in names:
+            entry = self._stations.get(name)
+            if entry and entry[0] > now:
+                found[name] = entry[1]
+            else:
+                missing.add(name)
+
+        if missing:
+            expiry = now + settings.STATION_CACHE_TTL
+            for station in Station.objects.filter(name__in=missing):
+                self._stations[station.name] = (expiry, station)
+                found[station.name] = station
+
+        return found
+
+    def forget(self):
+        """
+        Clears the cache (e.g. after a station's been renamed or removed).
+        """
+
+        self._stations.clear()
+
+    def ids(self, names: Optional[str]) -> List[int]:
+        """Finds the IDs of a comma separated list of stations.
+
+        Args:
+            names (str): The names of the stations (or None / empty for every
+                station).
+
+        Returns:
+            List[int]: The IDs of the stations that exist.
+        """
+
+        if not names:
+            return list(Station.objects.values_list("id", flat=True))
+
+        return [
+            station.id
+            for station in self.get_many(
+                name.strip() for name in names.split(",") if name.strip()
+            ).values()
+        ]
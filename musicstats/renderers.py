@@ -0,0 +1,156 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.fields.files import FieldFile
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class MusicstatsJSONEncoder(encoders.JSONEncoder):
+    """
+    DRF's JSON encoder, plus files and images as their URLs.
+    """
+
+    def default(self, obj):
+        if isinstance(obj, FieldFile):
+            return obj.url if obj else None
+
+        return super().default(obj)
+
+
+ENCODER = MusicstatsJSONEncoder()
+
+
+def stdlib_dumps(data) -> bytes:
+    """Encodes JSON with the standard library, as DRF does.
+
+    Args:
+        data: The data to encode.
+
+    Returns:
+        bytes: The compact, UTF-8 encoded JSON.
+    """
+
+    return _escape(
+        json.dumps(
+            data, cls=MusicstatsJSONEncoder, ensure_ascii=False, separators=(",", ":")
+        ).encode()
+    )
+
+
+def orjson_dumps(data) -> bytes:
+    """Encodes JSON with orjson, matching stdlib_dumps.
+
+    Args:
+        data: The data to encode.
+
+    Returns:
+        bytes: The compact, UTF-8 encoded JSON.
+    """
+
+    return _escape(
+        orjson.dumps(
+            data,
+            default=ENCODER.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+    )
+
+
+def dumps(data) -> bytes:
+    """Encodes JSON with the configured (or fastest available) backend.
+
+    Args:
+        data: The data to encode.
+
+    Returns:
+        bytes: The compact, UTF-8 encoded JSON.
+    """
+
+    backend = settings.JSON_BACKEND or ("orjson" if orjson else "json")
+
+    if backend == "json":
+        return stdlib_dumps(data)
+
+    if backend == "orjson":
+        if not orjson:
+            raise ImproperlyConfigured("JSON_BACKEND is orjson but it's not installed.")
+        return orjson_dumps(data)
+
+    raise ImproperlyConfigured(f"Unknown JSON_BACKEND {backend}.")
+
+
+def _escape(content: bytes) -> bytes:
+    """Escapes the line and paragraph separators, as DRF does.
+
+    Args:
+        content (bytes): The encoded JSON.
+
+    Returns:
+        bytes: JSON that's also valid JavaScript.
+    """
+
+    return content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+        b"\xe2\x80\xa9", b"\\u2029"
+    )
+
+
+class MusicstatsJSONRenderer(JSONRenderer):
+    """
+    Renders JSON with the configured backend.
+
+    Pretty printed (indented) and ASCII only output goes through DRF as usual.
+    """
+
+    encoder_class = MusicstatsJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        return dumps(data)
+
+
+class JsonResponse(HttpResponse):
+    """
+    Drop in replacement for Django's JsonResponse using the configured backend.
+    """
+
+    def __init__(self, data, safe: bool = True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                "In order to allow non-dict objects to be serialized set the "
+                "safe parameter to False."
+            )
+
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
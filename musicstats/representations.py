@@ -0,0 +1,339 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from rest_framework.settings import ISO_8601, api_settings
+from musicstats.models import EpgEntry, Song, SongPlay, Station
+
+# Fast path equivalents of the serialisers used on the hot read paths (song
+# play lists, now playing and the EPG). These read plain values() rows rather
+# than model instances and must produce exactly what the DRF serialisers do -
+# see test_representations.py.
+
+SONG_DETAIL_FIELDS = (
+    "thumbnail",
+    "image",
+    "musicbrainz_id",
+    "wiki_content",
+    "itunes_url",
+    "amazon_url",
+)
+
+SONG_FIELDS = ("display_artist", "title") + SONG_DETAIL_FIELDS
+
+SONG_IMAGE_FIELDS = ("thumbnail", "image")
+
+
+def datetime_representation(value):
+    """Formats a datetime the way DRF's DateTimeField does.
+
+    Args:
+        value (datetime): The datetime to format.
+
+    Returns:
+        str: The formatted datetime.
+    """
+
+    if not value:
+        return None
+
+    output_format = api_settings.DATETIME_FORMAT
+    if output_format is None or isinstance(value, str):
+        return value
+
+    if settings.USE_TZ:
+        current = timezone.get_current_timezone()
+        if timezone.is_aware(value):
+            value = value.astimezone(current)
+        else:
+            value = timezone.make_aware(value, current)
+    elif timezone.is_aware(value):
+        value = timezone.make_naive(value, dt_timezone.utc)
+
+    if output_format.lower() == ISO_8601:
+        value = value.isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+
+    return value.strftime(output_format)
+
+
+def time_representation(value):
+    """Formats a time the way DRF's TimeField does.
+
+    Args:
+        value (time): The time to format.
+
+    Returns:
+        str: The formatted time.
+    """
+
+    if value in (None, ""):
+        return None
+
+    output_format = api_settings.TIME_FORMAT
+    if output_format is None or isinstance(value, str):
+        return value
+
+    if output_format.lower() == ISO_8601:
+        return value.isoformat()
+
+    return value.strftime(output_format)
+
+
+def image_representation(model, field: str, name: str, request=None):
+    """Obtains the URL of an image the way DRF's ImageField does.
+
+    Args:
+        model (Model): The model the image field belongs to.
+        field (str): The name of the image field.
+        name (str): The stored name of the image.
+        request (HttpRequest): The request to build absolute URLs for.
+
+    Returns:
+        str: The image URL (or None if there's no image).
+    """
+
+    if not name:
+        return None
+
+    url = model._meta.get_field(field).storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+
+    return url
+
+
+def artist_names(song_ids) -> Dict[int, List[str]]:
+    """Obtains the names of the artists on songs in a single query.
+
+    Args:
+        song_ids (iterable): The IDs of the songs.
+
+    Returns:
+        Dict[int, List[str]]: The artist names for each song, in name order.
+    """
+
+    names = defaultdict(list)
+    links = (
+        Song.artists.through.objects.filter(song_id__in=set(song_ids))
+        .order_by("artist__name")
+        .values_list("song_id", "artist__name")
+    )
+
+    for (song_id, name) in links:
+        names[song_id].append(name)
+
+    return names
+
+
+def song_plays_data(queryset, request=None) -> List[dict]:
+    """Serialises song plays, matching SongPlaySerializer.
+
+    Args:
+        queryset (QuerySet): The song plays, in the order to return them.
+        request (HttpRequest): The request to build absolute URLs for.
+
+    Returns:
+        List[dict]: The serialised song plays.
+    """
+
+    return [data for (_, data) in song_plays_with_ids(queryset, request)]
+
+
+def song_plays_with_ids(queryset, request=None) -> List[Tuple[int, dict]]:
+    """Serialises song plays, matching SongPlaySerializer, alongside their IDs.
+
+    Args:
+        queryset (QuerySet): The song plays, in the order to return them.
+        request (HttpRequest): The request to build absolute URLs for.
+
+    Returns:
+        List[Tuple[int, dict]]: The IDs and serialised song plays.
+    """
+
+    rows = list(
+        queryset.values(
+            "id",
+            "date_time",
+            "song_id",
+            "station__name",
+            *[f"song__{field}" for field in SONG_FIELDS],
+        )
+    )
+    names = artist_names(row["song_id"] for row in rows)
+
+    return [
+        (
+            row["id"],
+            {
+                "song": _song(row, names[row["song_id"]], request),
+                "station": row["station__name"],
+                "date_time": datetime_representation(row["date_time"]),
+            },
+        )
+        for row in rows
+    ]
+
+
+def song_play_data(song_play: SongPlay, request=None) -> dict:
+    """Serialises a single song play, matching SongPlaySerializer.
+
+    Args:
+        song_play (SongPlay): The song play.
+        request (HttpRequest): The request to build absolute URLs for.
+
+    Returns:
+        dict: The serialised song play.
+    """
+
+    return song_plays_data(SongPlay.objects.filter(pk=song_play.pk), request)[0]
+
+
+def now_playing_data(
+    station_ids: Optional[Iterable[int]] = None, request=None
+) -> List[dict]:
+    """Serialises the now playing for several stations at once.
+
+    The latest play for every station is found in a single query (using
+    DISTINCT ON where the database supports it, otherwise a correlated
+    subquery) rather than one query per station.
+
+    Args:
+        station_ids (Iterable[int]): The IDs of the stations (or None for all
+            of them).
+        request (HttpRequest): The request to build absolute URLs for.
+
+    Returns:
+        List[dict]: The serialised song plays, ordered by station name.
+            Stations that haven't played anything are left out.
+    """
+
+    if connection.features.can_distinct_on_fields:
+        song_plays = SongPlay.objects.order_by("station_id", "-date_time").distinct(
+            "station_id"
+        )
+        if station_ids is not None:
+            song_plays = song_plays.filter(station_id__in=station_ids)
+    else:
+        stations = Station.objects.all()
+        if station_ids is not None:
+            stations = stations.filter(id__in=station_ids)
+
+        latest = SongPlay.objects.filter(station_id=OuterRef("id")).order_by(
+            "-date_time"
+        )
+        song_plays = SongPlay.objects.filter(
+            id__in=stations.annotate(
+                latest_id=Subquery(latest.values("id")[:1])
+            ).values("latest_id")
+        )
+
+    return sorted(
+        song_plays_data(song_plays, request), key=lambda data: data["station"]
+    )
+
+
+def epg_entries_data(queryset) -> List[dict]:
+    """Serialises EPG entries, matching EpgEntrySerializer.
+
+    Args:
+        queryset (QuerySet): The EPG entries, in the order to return them.
+
+    Returns:
+        List[dict]: The serialised EPG entries.
+    """
+
+    return [
+        _epg_entry(row)
+        for row in queryset.values("title", "description", "image", "start")
+    ]
+
+
+def epg_days_data(station_id: int) -> Dict[int, List[dict]]:
+    """Serialises a station's week of EPG entries in a single query.
+
+    Args:
+        station_id (int): The ID of the station.
+
+    Returns:
+        Dict[int, List[dict]]: The serialised EPG entries for each day.
+    """
+
+    days = {day: [] for day in range(0, 7)}
+    entries = EpgEntry.objects.filter(station_id=station_id, day__in=days.keys())
+
+    for row in entries.order_by("start").values(
+        "day", "title", "description", "image", "start"
+    ):
+        days[row["day"]].append(_epg_entry(row))
+
+    return days
+
+
+def _song(row: dict, artists: List[str], request=None) -> dict:
+    """Serialises the song from a song play row, matching SongSerializer.
+
+    Args:
+        row (dict): The song play row.
+        artists (List[str]): The names of the artists on the song.
+        request (HttpRequest): The request to build absolute URLs for.
+
+    Returns:
+        dict: The serialised song.
+    """
+
+    song = {
+        "display_artist": row["song__display_artist"],
+        "artists": artists,
+        "title": row["song__title"],
+    }
+
+    for field in SONG_DETAIL_FIELDS:
+        value = row[f"song__{field}"]
+        if field in SONG_IMAGE_FIELDS:
+            value = image_representation(Song, field, value, request)
+        song[field] = value
+
+    return song
+
+
+def _epg_entry(row: dict) -> dict:
+    """Serialises an EPG entry row, matching EpgEntrySerializer.
+
+    Args:
+        row (dict): The EPG entry row.
+
+    Returns:
+        dict: The serialised EPG entry.
+    """
+
+    return {
+        "title": row["title"],
+        "description": row["description"],
+        "image": row["image"],
+        "start": time_representation(row["start"]),
+    }
@@ -19,19 +19,27 @@
 
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
+from django.core.asgi import get_asgi_application
 from django.urls import re_path
-from musicstats.consumers import NowPlayingConsumer
+from musicstats.consumers import (
+    NowPlayingConsumer,
+    NowPlayingDashboardConsumer,
+    NowPlayingProtocolConsumer,
+)
 
 # pylint: disable=invalid-name
 
 websocket_urlpatterns = [
-    re_path(r"^nowplaying/(?P<station_name>[^/]+)/$", NowPlayingConsumer.as_asgi())
+    re_path(r"^v1/nowplaying/$", NowPlayingProtocolConsumer.as_asgi()),
+    re_path(r"^nowplaying/$", NowPlayingDashboardConsumer.as_asgi()),
+    re_path(r"^nowplaying/(?P<station_name>[^/]+)/$", NowPlayingConsumer.as_asgi()),
 ]
 
 # pylint: disable=invalid-name
 
 application = ProtocolTypeRouter(
     {
+        "http": get_asgi_application(),
         "websocket": AuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
     }
 )
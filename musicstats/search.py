@@ -0,0 +1,119 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from typing import List
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from musicstats.models import Artist, Song
+from musicstats.normalise import KEY_SEPARATOR, normalise
+
+
+class CatalogueSearch:
+    """Search as you type over songs and artists.
+
+    Searches the normalised match keys (which cover song titles, display
+    artists and artist names). On Postgres this uses the pg_trgm GIN indexes
+    and ranks by word similarity. Elsewhere (e.g. SQLite in tests) it falls
+    back to a substring search ranked in Python.
+    """
+
+    # How many more rows than we need the fallback considers for ranking
+
+    FALLBACK_CANDIDATES = 10
+
+    def songs(self, query: str, limit: int) -> List[Song]:
+        """Searches for songs.
+
+        Args:
+            query (str): What the user has typed so far.
+            limit (int): The maximum number of results.
+
+        Returns:
+            List[Song]: The matching songs, best first.
+        """
+
+        return self._search(Song.objects.all(), query, limit)
+
+    def artists(self, query: str, limit: int) -> List[Artist]:
+        """Searches for artists.
+
+        Args:
+            query (str): What the user has typed so far.
+            limit (int): The maximum number of results.
+
+        Returns:
+            List[Artist]: The matching artists, best first.
+        """
+
+        return self._search(Artist.objects.all(), query, limit)
+
+    def _search(self, queryset, query: str, limit: int) -> list:
+        """Searches the match keys of a queryset.
+
+        Args:
+            queryset (QuerySet): The rows to search.
+            query (str): What the user has typed so far.
+            limit (int): The maximum number of results.
+
+        Returns:
+            list: The matching rows, best first.
+        """
+
+        term = normalise(query)
+        if not term:
+            return []
+
+        if connection.vendor == "postgresql":
+            return list(
+                queryset.filter(match_key__trigram_word_similar=term)
+                .annotate(similarity=TrigramWordSimilarity(term, "match_key"))
+                .order_by("-similarity", "match_key", "pk")[:limit]
+            )
+
+        candidates = queryset.filter(match_key__contains=term).order_by("pk")[
+            : limit * self.FALLBACK_CANDIDATES
+        ]
+        return sorted(candidates, key=lambda row: self._rank(row.match_key, term))[
+            :limit
+        ]
+
+    def _rank(self, match_key: str, term: str):
+        """Ranks a substring match (lower is better).
+
+        Args:
+            match_key (str): The match key of the row.
+            term (str): The normalised search term.
+
+        Returns:
+            tuple: The sort key.
+        """
+
+        parts = match_key.split(KEY_SEPARATOR)
+        words = match_key.replace(KEY_SEPARATOR, " ").split()
+
+        if term in parts:
+            rank = 0
+        elif any(part.startswith(term) for part in parts):
+            rank = 1
+        elif any(word.startswith(term.split()[0]) for word in words):
+            rank = 2
+        else:
+            rank = 3
+
+        return (rank, len(match_key), match_key)
@@ -29,7 +29,29 @@ from musicstats.models import (
 )
 
 
-class ArtistSerializer(serializers.ModelSerializer):
+class FieldSelectionMixin:
+    """
+    Lets the fields a serialiser returns be chosen.
+
+    Pass fields to return only those fields. Pass lean to leave out the
+    heavy fields listed in Meta.heavy_fields, unless they're named in expand.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, lean=False, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        wanted = set(self.fields)
+
+        if fields:
+            wanted &= set(fields)
+        elif lean:
+            wanted -= set(getattr(self.Meta, "heavy_fields", ())) - set(expand or ())
+
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+
+class ArtistSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     """
     Serialiser for artists.
     """
@@ -37,9 +59,10 @@ class ArtistSerializer(serializers.ModelSerializer):
     class Meta:
         model = Artist
         fields = ("name", "thumbnail", "image", "musicbrainz_id", "wiki_content")
+        heavy_fields = ("wiki_content",)
 
 
-class SongSerializer(serializers.ModelSerializer):
+class SongSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     """
     Serialiser for songs.
     """
@@ -59,6 +82,27 @@ class SongSerializer(serializers.ModelSerializer):
             "itunes_url",
             "amazon_url",
         )
+        heavy_fields = ("wiki_content",)
+
+
+class ArtistSearchSerializer(serializers.ModelSerializer):
+    """
+    Compact serialiser for artists in search results.
+    """
+
+    class Meta:
+        model = Artist
+        fields = ("name", "thumbnail")
+
+
+class SongSearchSerializer(serializers.ModelSerializer):
+    """
+    Compact serialiser for songs in search results.
+    """
+
+    class Meta:
+        model = Song
+        fields = ("display_artist", "title", "thumbnail")
 
 
 class SimpleSongSerializer(serializers.ModelSerializer):
@@ -78,7 +122,7 @@ class TimezoneField(serializers.Field):
         return value.key
 
 
-class StationSerializer(serializers.ModelSerializer):
+class StationSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     """
     Serialiser for radio stations.
     """
@@ -112,13 +156,17 @@ class SimpleSongPlaySerializer(serializers.ModelSerializer):
 
     song = SimpleSongSerializer()
     station = serializers.CharField()
+    idempotency_key = serializers.CharField(
+        max_length=255, required=False, write_only=True
+    )
 
     class Meta:
         model = SongPlay
-        fields = ("song", "station", "date_time")
+        fields = ("song", "station", "date_time", "idempotency_key")
+        validators = []
 
 
-class SongPlaySerializer(serializers.ModelSerializer):
+class SongPlaySerializer(FieldSelectionMixin, serializers.ModelSerializer):
     """
     Serialiser for song plays.
     """
@@ -131,7 +179,7 @@ class SongPlaySerializer(serializers.ModelSerializer):
         fields = ("song", "station", "date_time")
 
 
-class EpgEntrySerializer(serializers.ModelSerializer):
+class EpgEntrySerializer(FieldSelectionMixin, serializers.ModelSerializer):
     """
     Serialiser for EPG entries
     """
@@ -141,7 +189,7 @@ class EpgEntrySerializer(serializers.ModelSerializer):
         fields = ("title", "description", "image", "start")
 
 
-class MarketingLinerSerializer(serializers.ModelSerializer):
+class MarketingLinerSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     """
     Serialiser for marketing liners.
     """
@@ -151,7 +199,7 @@ class MarketingLinerSerializer(serializers.ModelSerializer):
         fields = ("line",)
 
 
-class PresenterSerializer(serializers.ModelSerializer):
+class PresenterSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     """Serializer for presenters."""
 
     class Meta:
@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "musicstats",
     "rest_framework",
     "rest_framework.authtoken",
@@ -56,7 +57,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "musicstats.middleware.MetricsMiddleware",
+    "musicstats.middleware.QueryLogMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "musicstats.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -64,6 +68,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "musicstats.middleware.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "musicstats.urls"
@@ -144,8 +149,70 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.TokenAuthentication",
     ],
     "DEFAULT_PAGINATION_CLASS": "musicstats.pagination.MusicstatsPagination",
+    "DEFAULT_RENDERER_CLASSES": [
+        "musicstats.renderers.MusicstatsJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
+# JSON encoding for the API and websockets
+# Either "orjson" or "json" (the standard library). Leave as None to use
+# orjson when it's installed.
+
+JSON_BACKEND = None
+
+# Response compression
+# API responses of at least COMPRESSION_MIN_SIZE bytes are compressed with
+# Brotli (when it's installed and the client accepts it) or gzip.
+
+COMPRESSION_PATH_PREFIX = "/api/"
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4
+
+# Catalogue search
+
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+
+# How long (in seconds) each process caches stations for. Changes made in
+# one process are seen by the others once their copies expire.
+
+STATION_CACHE_TTL = 60
+
+# Song play ingestion
+
+SONG_PLAY_BATCH_LIMIT = 1000
+
+# How long (in seconds) we remember the responses to requests made with an
+# idempotency key. Each worker has its own cache unless a shared one (e.g.
+# Redis) is set up in CACHES; either way the database has the final say on
+# duplicates.
+
+SONG_PLAY_IDEMPOTENCY_TTL = 86400
+
+# Queued ingestion
+# Set SONG_PLAY_QUEUE to have log_song_play queue plays (and reply straight
+# away) for the process_song_play_queue worker to save, e.g.
+# {"BACKEND": "musicstats.queueing.RedisStreamQueue",
+#  "CONFIG": {"url": "redis://localhost:6379/0"}}
+
+SONG_PLAY_QUEUE = None
+SONG_PLAY_QUEUE_BATCH_SIZE = 500
+
+# How many times the worker tries a queued play before moving it to the
+# station's dead letter queue (so one bad play can't hold up the rest)
+
+SONG_PLAY_QUEUE_MAX_ATTEMPTS = 5
+
+# How long (in seconds) the ingestion endpoints remember passwords they've
+# checked and the stations each user may update. Only IDs are kept and the
+# user is loaded on every request, so deactivating them or changing their
+# password applies straight away. Station changes only reach other processes
+# within this time unless a shared cache (e.g. Redis) is set up in CACHES.
+
+INGEST_AUTH_CACHE_TTL = 60
+
 # Last.fm Settings
 
 LAST_FM = None
@@ -158,6 +225,10 @@ CRON_CLASSES = [
     "musicstats.cron.EpgUpdater",
 ]
 
+# Cron jobs log items that take longer than this many seconds as warnings.
+
+CRON_SLOW_ITEM_THRESHOLD = 10
+
 # CORS
 
 CORS_ORIGIN_WHITELIST = ()
@@ -170,18 +241,95 @@ CORS_ORIGIN_ALLOW_ALL = False
 ASGI_APPLICATION = "musicstats.routing.application"
 CHANNEL_LAYERS = None
 
+# Listeners for each station are split across this many channel layer
+# groups, which are all sent to at once. Raise it for stations with many
+# thousands of listeners (1 keeps the single nowplaying_<id> group).
+
+NOW_PLAYING_GROUP_SHARDS = 1
+
+# Websocket listeners are sent only the newest update while a send is in
+# progress, with at most NOW_PLAYING_SEND_QUEUE_LIMIT (e.g. stations on the
+# dashboard) waiting. Listeners whose updates have waited longer than
+# NOW_PLAYING_MAX_LAG seconds are disconnected.
+
+NOW_PLAYING_SEND_QUEUE_LIMIT = 50
+NOW_PLAYING_MAX_LAG = 30
+
+# Server-sent event streams send a heartbeat after this many quiet seconds
+# and replay up to NOW_PLAYING_STREAM_RESUME_LIMIT plays to listeners that
+# reconnect.
+
+NOW_PLAYING_STREAM_HEARTBEAT = 15
+NOW_PLAYING_STREAM_RESUME_LIMIT = 20
+
+# Long polls for the now playing give up (with a 304) after this many seconds.
+
+NOW_PLAYING_POLL_TIMEOUT = 30
+
+# Now playing updates are sent in the background by BROADCAST_WORKERS
+# threads (0 sends them as soon as the play's saved). Each station's updates
+# always go through the same thread, so they're sent in order. Failed sends
+# are retried with a back off. After BROADCAST_BREAKER_THRESHOLD failures in
+# a row we stop trying for BROADCAST_BREAKER_RESET seconds.
+
+BROADCAST_WORKERS = 2
+BROADCAST_MAX_PENDING = 1000
+BROADCAST_RETRIES = 2
+BROADCAST_RETRY_DELAY = 0.1
+BROADCAST_BREAKER_THRESHOLD = 5
+BROADCAST_BREAKER_RESET = 30
+
+# Metrics are served in the Prometheus text format on /metrics. Set
+# METRICS_TOKEN to require "Authorization: Bearer <token>". Set
+# METRICS_DIRECTORY to a directory shared by every process (web, cron and
+# queue workers) for /metrics to add up all their metrics; each writes there
+# at most every METRICS_FLUSH_INTERVAL seconds (when handling a request or
+# sending now playing updates). Files not written for METRICS_STALE_AFTER
+# seconds (from stopped or restarted processes) are left out and removed.
+
+METRICS_TOKEN = None
+METRICS_DIRECTORY = None
+METRICS_FLUSH_INTERVAL = 10
+METRICS_STALE_AFTER = 300
+
+# Requests carrying a token from "manage.py profile_token" in the X-Profile
+# header (or from staff with ?profile) are profiled and a report saved for
+# the admin. Tokens last PROFILE_TOKEN_MAX_AGE seconds. Reports list the
+# PROFILE_STATS_LIMIT slowest functions.
+
+PROFILE_TOKEN_MAX_AGE = 3600
+PROFILE_STATS_LIMIT = 50
+
+# With QUERYLOG_ENABLED set, the queries made by each view and cron job are
+# fingerprinted and tallied, and logged as a likely N+1 when one runs at
+# least QUERYLOG_REPEAT_THRESHOLD times in a request or job. Set
+# QUERYLOG_DIRECTORY to a directory shared by every process for
+# "manage.py query_report" to rank them all.
+
+QUERYLOG_ENABLED = False
+QUERYLOG_DIRECTORY = None
+QUERYLOG_REPEAT_THRESHOLD = 10
+
 # Logging
 
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
-    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "formatters": {"json": {"()": "musicstats.log.JsonFormatter"}},
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+        "json_console": {"class": "logging.StreamHandler", "formatter": "json"},
+    },
     "loggers": {
         "django": {
             "handlers": ["console"],
             "level": os.getenv("DJANGO_LOG_LEVEL", "INFO"),
         },
-        "musicstats": {"handlers": ["console"], "level": "DEBUG", "propogate": True},
+        "musicstats": {
+            "handlers": ["json_console"],
+            "level": "DEBUG",
+            "propogate": True,
+        },
     },
 }
 
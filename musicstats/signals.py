@@ -0,0 +1,44 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from musicstats.authentication import AuthenticationCache
+from musicstats.models import Station
+from musicstats.registry import StationRegistry
+
+
+@receiver(post_save, sender=Station)
+def station_saved(sender, instance, **kwargs):
+    """
+    Refreshes the cached stations.
+    """
+
+    StationRegistry().forget()
+    AuthenticationCache().forget_stations()
+
+
+@receiver(post_delete, sender=Station)
+def station_deleted(sender, instance, **kwargs):
+    """
+    Stops looking up a removed station from the cache.
+    """
+
+    StationRegistry().forget()
+    AuthenticationCache().forget_stations()
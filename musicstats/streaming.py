@@ -0,0 +1,206 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import asyncio
+from typing import List, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from musicstats.broadcast import now_playing_subscription
+from musicstats.models import SongPlay
+from musicstats.renderers import dumps
+from musicstats.representations import song_plays_with_ids
+
+
+def server_sent_event(data: dict, event_id: Optional[int] = None) -> bytes:
+    """Formats a now playing server-sent event.
+
+    Args:
+        data (dict): The serialised song play.
+        event_id (int): The ID of the song play.
+
+    Returns:
+        bytes: The event.
+    """
+
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}".encode())
+    lines.append(b"event: now_playing")
+    lines.append(b"data: " + dumps(data))
+
+    return b"\n".join(lines) + b"\n\n"
+
+
+def missed_plays(station_id: int, last_event_id: Optional[int]) -> List[Tuple]:
+    """Obtains the song plays a listener needs to catch up on.
+
+    Plays are picked by time rather than ID, as backfilled plays get a later
+    ID than the plays they come before. The last play can be on any station
+    (protocol clients resume several stations from one play).
+
+    Args:
+        station_id (int): The ID of the station.
+        last_event_id (int): The ID of the last song play the listener had
+            (or None if they're new).
+
+    Returns:
+        List[Tuple]: The IDs and serialised song plays, oldest first.
+    """
+
+    song_plays = SongPlay.objects.filter(station_id=station_id)
+    if last_event_id is None:
+        limit = 1
+    else:
+        last_date_time = (
+            SongPlay.objects.filter(id=last_event_id)
+            .values_list("date_time", flat=True)
+            .first()
+        )
+
+        # Fall back to the ID if the play's since been removed
+
+        if last_date_time:
+            song_plays = song_plays.filter(
+                Q(date_time__gt=last_date_time)
+                | Q(date_time=last_date_time, id__gt=last_event_id)
+            )
+        else:
+            song_plays = song_plays.filter(id__gt=last_event_id)
+
+        limit = settings.NOW_PLAYING_STREAM_RESUME_LIMIT
+
+    return list(
+        reversed(song_plays_with_ids(song_plays.order_by("-date_time")[:limit]))
+    )
+
+
+async def now_playing_events(station_id: int, last_event_id: Optional[int] = None):
+    """Streams now playing updates for a station as server-sent events.
+
+    Listeners get the current song (or the plays they missed, if resuming)
+    and then every new play as it's logged. A comment is sent every
+    NOW_PLAYING_STREAM_HEARTBEAT seconds when it's quiet, to keep proxies
+    from closing the connection.
+
+    Args:
+        station_id (int): The ID of the station.
+        last_event_id (int): The ID of the last song play the listener had
+            (or None if they're new).
+    """
+
+    # Start listening before catching up so nothing falls in the gap
+
+    async with now_playing_subscription(station_id) as receive:
+        sent = set()
+
+        for (play_id, data) in await sync_to_async(missed_plays)(
+            station_id, last_event_id
+        ):
+            sent.add(play_id)
+            yield server_sent_event(data, play_id)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    receive(), settings.NOW_PLAYING_STREAM_HEARTBEAT
+                )
+            except asyncio.TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+
+            if event.get("id") in sent:
+                continue
+
+            yield server_sent_event(event["message"], event.get("id"))
+
+
+def now_playing_text(data: dict) -> str:
+    """Formats a serialised song play for the plain text now playing.
+
+    Args:
+        data (dict): The serialised song play.
+
+    Returns:
+        str: The artist and title.
+    """
+
+    return f"{data['song']['display_artist']} - {data['song']['title']}"
+
+
+def current_play(station_id: int) -> Optional[Tuple[int, str]]:
+    """Obtains the song currently playing on a station.
+
+    Args:
+        station_id (int): The ID of the station.
+
+    Returns:
+        Tuple[int, str]: The ID of the song play and the plain text now
+            playing (or None if nothing's been played).
+    """
+
+    song_play = (
+        SongPlay.objects.filter(station_id=station_id)
+        .select_related("song")
+        .order_by("-date_time")
+        .first()
+    )
+
+    if not song_play:
+        return None
+
+    return (song_play.id, f"{song_play.song.display_artist} - {song_play.song.title}")
+
+
+async def wait_for_play(
+    station_id: int, since: Optional[int], timeout: float
+) -> Optional[Tuple[int, str]]:
+    """Waits for the now playing on a station to change.
+
+    Returns straight away if the current song play isn't the one the
+    listener already has.
+
+    Args:
+        station_id (int): The ID of the station.
+        since (int): The ID of the song play the listener already has.
+        timeout (float): The longest to wait (seconds).
+
+    Returns:
+        Tuple[int, str]: The ID of the new song play and the plain text now
+            playing (or None if nothing changed in time).
+    """
+
+    # Start listening before checking so nothing falls in the gap
+
+    async with now_playing_subscription(station_id) as receive:
+        current = await sync_to_async(current_play)(station_id)
+        if current and current[0] != since:
+            return current
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        while True:
+            try:
+                event = await asyncio.wait_for(receive(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return None
+
+            if event.get("id") != since:
+                return (event.get("id"), now_playing_text(event["message"]))
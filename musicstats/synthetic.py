@@ -0,0 +1,327 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import random
+from datetime import datetime, time, timedelta
+from itertools import accumulate, islice
+from typing import Iterable, Iterator, List, Optional
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from musicstats.models import (
+    Artist,
+    EpgEntry,
+    MarketingLiner,
+    Presenter,
+    Song,
+    SongPlay,
+    Station,
+)
+from musicstats.normalise import artist_match_key, song_match_key
+
+# Everything we create is named with this so it's easy to spot (and refuse
+# to create twice)
+
+PREFIX = "Synthetic"
+
+
+def chunks(items: Iterable, size: int) -> Iterator[List]:
+    """Splits items into lists of a given size (the last may be shorter).
+
+    Args:
+        items (Iterable): The items to split.
+        size (int): The number of items in each list.
+
+    Yields:
+        List: The next chunk.
+    """
+
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def zipf_weights(count: int, exponent: float) -> List[float]:
+    """Obtains cumulative Zipf weights for picking by popularity rank.
+
+    The song at rank r is picked in proportion to 1 / r ** exponent, so a
+    handful of hits get most of the plays and there's a long tail.
+
+    Args:
+        count (int): The number of ranks.
+        exponent (float): How steeply popularity falls away.
+
+    Returns:
+        List[float]: The cumulative weights (for random.choices).
+    """
+
+    return list(accumulate(1 / rank**exponent for rank in range(1, count + 1)))
+
+
+class SyntheticCatalogue:
+    """Fills the database with a large, realistic looking catalogue.
+
+    The same seed always gives the same stations, songs and sequence of
+    plays. Rows are created with bulk_create, a chunk at a time, so memory
+    use stays flat however many plays are asked for.
+    """
+
+    def __init__(
+        self,
+        seed: int = 1,
+        chunk_size: int = 5000,
+        exponent: float = 1.1,
+        end: Optional[datetime] = None,
+    ):
+        self.random = random.Random(seed)
+        self.chunk_size = chunk_size
+        self.exponent = exponent
+        self.end = end or timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.stations = []
+        self.artist_ids = []
+        self.song_ids = []
+        self.zipf = []
+
+    def exists(self) -> bool:
+        """Checks if synthetic data has already been generated.
+
+        Returns:
+            bool: True if it has.
+        """
+
+        return Station.objects.filter(name__startswith=PREFIX).exists()
+
+    def _bulk_create(self, model, rows: Iterable) -> List:
+        """Saves rows a chunk at a time.
+
+        Args:
+            model: The model the rows are for.
+            rows (Iterable): The unsaved rows.
+
+        Returns:
+            List: The IDs of the saved rows.
+        """
+
+        ids = []
+        for chunk in chunks(rows, self.chunk_size):
+            with transaction.atomic():
+                ids.extend(
+                    row.pk for row in model.objects.bulk_create(chunk, self.chunk_size)
+                )
+
+        return ids
+
+    def create_stations(self, count: int) -> int:
+        """Creates stations with a week of EPG, liners and presenters.
+
+        Args:
+            count (int): The number of stations.
+
+        Returns:
+            int: The number of stations created.
+        """
+
+        user, _ = User.objects.get_or_create(
+            username=PREFIX.lower(), defaults={"email": "synthetic@example.com"}
+        )
+
+        stations = [
+            Station(
+                name=f"{PREFIX} {index + 1}",
+                slogan="Synthetic hits.",
+                primary_colour="#FFFFFF",
+                text_colour="#FFFFFF",
+                stream_aac_high="https://example.com/stream",
+                stream_aac_low="https://example.com/stream",
+                stream_mp3_high="https://example.com/stream",
+                stream_mp3_low="https://example.com/stream",
+                update_account=user,
+            )
+            for index in range(count)
+        ]
+        ids = self._bulk_create(Station, stations)
+        self.stations = list(Station.objects.filter(pk__in=ids).order_by("pk"))
+
+        # Shows start every two to four hours, every day of the week
+
+        entries = []
+        for station in self.stations:
+            for day in range(7):
+                hour = 0
+                while hour < 24:
+                    entries.append(
+                        EpgEntry(
+                            title=f"{PREFIX} Show {self.random.randrange(100)}",
+                            description="A synthetic show.",
+                            station=station,
+                            image="https://example.com/show.png",
+                            start=time(hour),
+                            day=day,
+                        )
+                    )
+                    hour += self.random.choice((2, 3, 4))
+
+        self._bulk_create(EpgEntry, entries)
+        self._bulk_create(
+            MarketingLiner,
+            (
+                MarketingLiner(line=f"{PREFIX} liner {index}", station=station)
+                for station in self.stations
+                for index in range(10)
+            ),
+        )
+        self._bulk_create(
+            Presenter,
+            (
+                Presenter(
+                    name=f"{PREFIX} Presenter {index}",
+                    station=station,
+                    biography="Talks between the songs.",
+                    image="https://example.com/presenter.png",
+                )
+                for station in self.stations
+                for index in range(10)
+            ),
+        )
+
+        return len(self.stations)
+
+    def create_artists(self, count: int) -> int:
+        """Creates artists.
+
+        Args:
+            count (int): The number of artists.
+
+        Returns:
+            int: The number of artists created.
+        """
+
+        def artist(index):
+            name = f"{PREFIX} Artist {index + 1}"
+            return Artist(name=name, match_key=artist_match_key(name))
+
+        self.artist_ids = self._bulk_create(Artist, map(artist, range(count)))
+        return len(self.artist_ids)
+
+    def create_songs(self, count: int) -> int:
+        """Creates songs by the artists, one in ten featuring a second artist.
+
+        Args:
+            count (int): The number of songs.
+
+        Returns:
+            int: The number of songs created.
+        """
+
+        credits = []
+
+        def song(index):
+            artists = [self.random.randrange(len(self.artist_ids))]
+            if self.random.random() < 0.1:
+                artists.append(self.random.randrange(len(self.artist_ids)))
+
+            display_artist = " feat. ".join(
+                f"{PREFIX} Artist {artist + 1}" for artist in artists
+            )
+            title = f"{PREFIX} Song {index + 1}"
+            credits.append(artists)
+
+            return Song(
+                display_artist=display_artist,
+                title=title,
+                match_key=song_match_key(display_artist, title),
+            )
+
+        self.song_ids = self._bulk_create(Song, map(song, range(count)))
+        self._bulk_create(
+            Song.artists.through,
+            (
+                Song.artists.through(song_id=song_id, artist_id=self.artist_ids[artist])
+                for (song_id, artists) in zip(self.song_ids, credits)
+                for artist in set(artists)
+            ),
+        )
+
+        return len(self.song_ids)
+
+    def _station_plays(self, station: Station, count: int) -> Iterator[SongPlay]:
+        """Generates a station's plays, most recent first.
+
+        Each station has its own cadence (a song every three to four
+        minutes, give or take) and its own take on what's popular.
+
+        Args:
+            station (Station): The station.
+            count (int): The number of plays.
+
+        Yields:
+            SongPlay: The next (unsaved) play.
+        """
+
+        gap = self.random.uniform(180, 240)
+        offset = self.random.randrange(len(self.song_ids))
+        date_time = self.end
+
+        # Songs and timings come from their own generators so the plays
+        # don't depend on the chunk size
+
+        picks = random.Random(self.random.getrandbits(64))
+        timings = random.Random(self.random.getrandbits(64))
+
+        for chunk in chunks(range(count), self.chunk_size):
+            ranks = picks.choices(
+                range(len(self.song_ids)), cum_weights=self.zipf, k=len(chunk)
+            )
+            for rank in ranks:
+                date_time -= timedelta(seconds=gap * timings.uniform(0.8, 1.2))
+                yield SongPlay(
+                    song_id=self.song_ids[(rank + offset) % len(self.song_ids)],
+                    station=station,
+                    date_time=date_time,
+                )
+
+    def create_plays(self, count: int) -> int:
+        """Creates song plays, shared evenly between the stations.
+
+        Args:
+            count (int): The number of plays.
+
+        Returns:
+            int: The number of plays created.
+        """
+
+        if not self.stations or not self.song_ids:
+            return 0
+
+        self.zipf = zipf_weights(len(self.song_ids), self.exponent)
+        created = 0
+
+        for (index, station) in enumerate(self.stations):
+            plays = count // len(self.stations)
+            if index < count % len(self.stations):
+                plays += 1
+
+            created += len(
+                self._bulk_create(SongPlay, self._station_plays(station, plays))
+            )
+
+        return created
@@ -0,0 +1,261 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import base64
+from unittest.mock import patch
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from musicstats.authentication import AuthenticationCache, CachedBasicAuthentication
+from musicstats.benchmark import benchmark, measure
+from musicstats.models import Station
+
+
+class CachedAuthenticationTest(APITestCase):
+    """
+    Tests remembering credentials for the ingestion endpoints.
+    """
+
+    username = "cached_auth_user"
+    password = "C@ch3dP@55!"
+    email = "cached@auth.user"
+    station_name = "Auth FM"
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Creates a user and a station they update.
+        """
+
+        cache.clear()
+
+        self.user = User.objects.create_user(self.username, self.email, self.password)
+        self.station = Station(
+            name=self.station_name,
+            primary_colour=self.colour,
+            text_colour=self.colour,
+            stream_aac_high=self.stream_url,
+            stream_aac_low=self.stream_url,
+            stream_mp3_high=self.stream_url,
+            stream_mp3_low=self.stream_url,
+            update_account=self.user,
+        )
+        self.station.save()
+
+    def test_password_remembered(self):
+        """
+        Tests a password is only checked once.
+        """
+
+        # Arrange
+
+        authentication = CachedBasicAuthentication()
+        authentication.authenticate_credentials(self.username, self.password)
+
+        # Act
+
+        with patch.object(User, "check_password") as check_password:
+            with self.assertNumQueries(1):
+                (user, _) = authentication.authenticate_credentials(
+                    self.username, self.password
+                )
+
+        # Assert
+
+        check_password.assert_not_called()
+        self.assertEqual(user.id, self.user.id)
+
+    def test_only_ids_remembered(self):
+        """
+        Tests the user themselves never ends up in the cache.
+        """
+
+        # Arrange
+
+        authentication = CachedBasicAuthentication()
+
+        # Act
+
+        authentication.authenticate_credentials(self.username, self.password)
+
+        # Assert
+
+        (user_id, stamp) = AuthenticationCache().get(
+            "Basic", f"{self.username}:{self.password}"
+        )
+        self.assertEqual(user_id, self.user.id)
+        self.assertNotIn(self.user.password, stamp)
+
+    def test_password_changed(self):
+        """
+        Tests the old password stops working once it's been changed.
+        """
+
+        # Arrange
+
+        authentication = CachedBasicAuthentication()
+        authentication.authenticate_credentials(self.username, self.password)
+
+        # Act
+
+        self.user.set_password("N3wP@55!")
+        self.user.save()
+
+        # Assert
+
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(self.username, self.password)
+
+    def test_deactivated(self):
+        """
+        Tests a deactivated user is turned away.
+        """
+
+        # Arrange
+
+        authentication = CachedBasicAuthentication()
+        authentication.authenticate_credentials(self.username, self.password)
+
+        # Act
+
+        User.objects.filter(pk=self.user.id).update(is_active=False)
+
+        # Assert
+
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(self.username, self.password)
+
+    def test_wrong_password(self):
+        """
+        Tests a wrong password is never accepted, even after a right one.
+        """
+
+        # Arrange
+
+        authentication = CachedBasicAuthentication()
+        authentication.authenticate_credentials(self.username, self.password)
+
+        # Act / Assert
+
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(self.username, "wrong")
+
+    def test_stations_remembered(self):
+        """
+        Tests the stations a user may update are only looked up once.
+        """
+
+        # Arrange
+
+        auth_cache = AuthenticationCache()
+        auth_cache.stations(self.user.id)
+
+        # Act
+
+        with self.assertNumQueries(0):
+            stations = auth_cache.stations(self.user.id)
+
+        # Assert
+
+        self.assertEqual(stations, {self.station.id})
+
+    def test_stations_changed(self):
+        """
+        Tests a user can't update a station once it's been handed to someone
+        else.
+        """
+
+        # Arrange
+
+        auth_cache = AuthenticationCache()
+        auth_cache.stations(self.user.id)
+
+        # Act
+
+        self.station.update_account = None
+        self.station.save()
+
+        # Assert
+
+        self.assertEqual(auth_cache.stations(self.user.id), set())
+
+    def test_stations_anonymous(self):
+        """
+        Tests an anonymous user can't update any station.
+        """
+
+        # Act / Assert
+
+        with self.assertNumQueries(0):
+            self.assertEqual(AuthenticationCache().stations(None), set())
+
+    def test_log_song_play(self):
+        """
+        Tests logging song plays with basic authentication.
+        """
+
+        # Arrange
+
+        credentials = base64.b64encode(
+            f"{self.username}:{self.password}".encode()
+        ).decode()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Basic {credentials}")
+
+        # Act
+
+        responses = [
+            self.client.post(
+                reverse("song_play_log"),
+                {
+                    "song": {
+                        "display_artist": "Artist",
+                        "artists": ["Artist"],
+                        "title": title,
+                    },
+                    "station": self.station_name,
+                },
+                format="json",
+            )
+            for title in ("First", "Second")
+        ]
+
+        # Assert
+
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+
+    @benchmark
+    def test_benchmark_basic(self):
+        """
+        Compares checking passwords every time with remembering them.
+        """
+
+        for (name, authentication) in [
+            ("Basic auth (uncached)", BasicAuthentication()),
+            ("Basic auth (cached)", CachedBasicAuthentication()),
+        ]:
+            measure(
+                name,
+                lambda _: authentication.authenticate_credentials(
+                    self.username, self.password
+                ),
+            )
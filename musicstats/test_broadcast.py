@@ -0,0 +1,219 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import threading
+from unittest.mock import patch
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from musicstats.broadcast import (
+    CircuitBreaker,
+    broadcast_now_playing,
+    deliver_now_playing,
+)
+from musicstats.models import Station
+
+MESSAGE = {"song": {"title": "Broadcast"}}
+
+
+@override_settings(
+    BROADCAST_WORKERS=0,
+    BROADCAST_RETRIES=2,
+    BROADCAST_RETRY_DELAY=0,
+    BROADCAST_BREAKER_THRESHOLD=3,
+    BROADCAST_BREAKER_RESET=60,
+)
+@patch("musicstats.broadcast.breaker", new_callable=CircuitBreaker)
+@patch("musicstats.broadcast.send_now_playing")
+class BroadcastTest(APITestCase):
+    """
+    Tests sending now playing updates in the background.
+    """
+
+    def test_after_commit(self, send, _):
+        """
+        Tests updates wait for the transaction to commit.
+        """
+
+        # Act
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            broadcast_now_playing(1, MESSAGE)
+            sent_early = send.called
+
+        # Assert
+
+        self.assertFalse(sent_early)
+        self.assertEqual(len(callbacks), 1)
+        send.assert_called_once_with(1, MESSAGE, None)
+
+    def test_retry(self, send, _):
+        """
+        Tests failed sends are retried.
+        """
+
+        # Arrange
+
+        send.side_effect = [ConnectionError, None]
+
+        # Act / Assert
+
+        self.assertTrue(deliver_now_playing(1, MESSAGE))
+        self.assertEqual(send.call_count, 2)
+
+    def test_give_up(self, send, _):
+        """
+        Tests we give up after a few retries, without raising.
+        """
+
+        # Arrange
+
+        send.side_effect = ConnectionError
+
+        # Act / Assert
+
+        self.assertFalse(deliver_now_playing(1, MESSAGE))
+        self.assertEqual(send.call_count, 3)
+
+    def test_circuit_breaker(self, send, breaker):
+        """
+        Tests we stop trying after repeated failures, then try again later.
+        """
+
+        # Arrange
+
+        send.side_effect = ConnectionError
+        deliver_now_playing(1, MESSAGE)
+
+        # Act
+
+        tripped = deliver_now_playing(1, MESSAGE)
+        calls_while_open = send.call_count
+
+        send.side_effect = None
+        with override_settings(BROADCAST_BREAKER_RESET=0):
+            recovered = deliver_now_playing(1, MESSAGE)
+
+        # Assert
+
+        self.assertFalse(tripped)
+        self.assertEqual(calls_while_open, 3)
+        self.assertTrue(recovered)
+        self.assertTrue(breaker.allow())
+
+    def test_background(self, send, _):
+        """
+        Tests a slow channel layer doesn't hold things up.
+        """
+
+        # Arrange
+
+        release = threading.Event()
+        sent = threading.Event()
+        send.side_effect = lambda *_: release.wait(5) and sent.set()
+
+        # Act
+
+        with override_settings(BROADCAST_WORKERS=1):
+            with self.captureOnCommitCallbacks(execute=True):
+                broadcast_now_playing(1, MESSAGE)
+
+        # Assert
+
+        self.assertFalse(sent.is_set())
+        release.set()
+        self.assertTrue(sent.wait(5))
+
+    def test_order(self, send, _):
+        """
+        Tests a station's updates go out in order, even when one's retried.
+        """
+
+        # Arrange
+
+        sent = []
+        failed = []
+        done = threading.Event()
+
+        def deliver(station_id, message, play_id):
+            if play_id == 1 and not failed:
+                failed.append(play_id)
+                raise ConnectionError
+            sent.append(play_id)
+            if len(sent) == 2:
+                done.set()
+
+        send.side_effect = deliver
+
+        # Act
+
+        with override_settings(BROADCAST_WORKERS=2):
+            with self.captureOnCommitCallbacks(execute=True):
+                broadcast_now_playing(1, MESSAGE, 1)
+                broadcast_now_playing(1, MESSAGE, 2)
+
+        # Assert
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(sent, [1, 2])
+
+    def test_log_song_play(self, send, _):
+        """
+        Tests a failing channel layer never fails ingestion.
+        """
+
+        # Arrange
+
+        user = User.objects.create_user("broadcast", "broadcast@example.com", "B!")
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        Station(
+            name="Broadcast FM",
+            primary_colour="#FFFFFF",
+            text_colour="#FFFFFF",
+            stream_aac_high="https://example.com/stream",
+            stream_aac_low="https://example.com/stream",
+            stream_mp3_high="https://example.com/stream",
+            stream_mp3_low="https://example.com/stream",
+            update_account=user,
+        ).save()
+        send.side_effect = ConnectionError
+
+        # Act
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("song_play_log"),
+                {
+                    "song": {
+                        "display_artist": "Artist",
+                        "artists": ["Artist"],
+                        "title": "Title",
+                    },
+                    "station": "Broadcast FM",
+                },
+                format="json",
+            )
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send.call_count, 3)
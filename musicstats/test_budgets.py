@@ -0,0 +1,395 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import time as dt_time
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.backends.utils import CursorWrapper
+from django.test import AsyncClient, TestCase, TransactionTestCase
+from django.urls import URLResolver, reverse
+from unittest.mock import patch
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from musicstats import urls
+from musicstats.models import (
+    Artist,
+    EpgEntry,
+    MarketingLiner,
+    Presenter,
+    Song,
+    SongPlay,
+    Station,
+)
+from musicstats.normalise import artist_match_key, song_match_key
+from musicstats.registry import StationRegistry
+from musicstats.routing import websocket_urlpatterns
+
+# Query and time budgets for each URL (by name) and websocket route. Keep
+# these tight: an N+1 query should blow the query budget.
+
+with open(
+    os.path.join(os.path.dirname(__file__), "test", "budgets.json"), encoding="utf-8"
+) as budgets_file:
+    BUDGETS = json.load(budgets_file)
+
+STATION = "Budget FM"
+SONG = "Budget Artist 1 - Budget Song 1"
+
+
+def seed():
+    """
+    Creates a realistically sized catalogue: a few stations with a week of
+    EPG, hundreds of songs with a couple of artists each and thousands of
+    plays.
+    """
+
+    user = User.objects.create_user("budget", "budget@example.com", "Budg3t!")
+    token = Token.objects.create(user=user)
+
+    stations = []
+    for name in (STATION, "Budget Gold", "Budget Extra"):
+        station = Station(
+            name=name,
+            primary_colour="#FFFFFF",
+            text_colour="#FFFFFF",
+            stream_aac_high="https://example.com/stream",
+            stream_aac_low="https://example.com/stream",
+            stream_mp3_high="https://example.com/stream",
+            stream_mp3_low="https://example.com/stream",
+            update_account=user,
+        )
+        station.save()
+        stations.append(station)
+
+        EpgEntry.objects.bulk_create(
+            EpgEntry(
+                title=f"Show {day} {hour}",
+                description="A show.",
+                station=station,
+                image="https://example.com/show.png",
+                start=dt_time(hour),
+                day=day,
+            )
+            for day in range(7)
+            for hour in range(0, 24, 2)
+        )
+        MarketingLiner.objects.bulk_create(
+            MarketingLiner(line=f"Liner {index}", station=station)
+            for index in range(10)
+        )
+        Presenter.objects.bulk_create(
+            Presenter(
+                name=f"Presenter {index}",
+                station=station,
+                biography="Talks.",
+                image="https://example.com/presenter.png",
+            )
+            for index in range(10)
+        )
+
+    artists = Artist.objects.bulk_create(
+        Artist(
+            name=f"Budget Artist {index}",
+            match_key=artist_match_key(f"Budget Artist {index}"),
+        )
+        for index in range(200)
+    )
+    songs = Song.objects.bulk_create(
+        Song(
+            display_artist=f"Budget Artist {index % 200}",
+            title=f"Budget Song {index}",
+            match_key=song_match_key(
+                f"Budget Artist {index % 200}", f"Budget Song {index}"
+            ),
+            wiki_content="Some history. " * 20,
+        )
+        for index in range(500)
+    )
+    Song.artists.through.objects.bulk_create(
+        Song.artists.through(song_id=song.id, artist_id=artist.id)
+        for (index, song) in enumerate(songs)
+        for artist in (artists[index % 200], artists[(index + 1) % 200])
+    )
+    SongPlay.objects.bulk_create(
+        SongPlay(song=songs[index % len(songs)], station=stations[index % 3])
+        for index in range(3000)
+    )
+
+    return token
+
+
+# What to request for each URL. Requests that write get a fresh song each
+# time so they aren't treated as repeats.
+
+STATION_URLS = (
+    "song_play_recent",
+    "epg_current",
+    "epg_day",
+    "marketing_liners",
+    "presenters",
+    "now_playing_poll",
+    "now_playing_stream",
+    "now_playing_plain",
+)
+
+
+def song_play(title: str) -> dict:
+    """
+    A song play to log.
+    """
+
+    return {
+        "song": {
+            "display_artist": "Budget Artist 1",
+            "artists": ["Budget Artist 1"],
+            "title": title,
+        },
+        "station": STATION,
+    }
+
+
+def request_for(name: str, since: int) -> tuple:
+    """Works out what to request for a URL.
+
+    Args:
+        name (str): The name of the URL.
+        since (int): The ID of the station's latest song play.
+
+    Returns:
+        tuple: The method, path and a function giving the data for the nth
+            request.
+    """
+
+    if name == "song_play_log":
+        return ("post", reverse(name), lambda n: song_play(f"Logged {n}"))
+
+    if name == "song_play_log_bulk":
+        return (
+            "post",
+            reverse(name),
+            lambda n: [song_play(f"Bulk {n} {index}") for index in range(10)],
+        )
+
+    kwargs = {
+        "song_play_specific": {
+            "station_name": STATION,
+            "start_time": 0,
+            "end_time": 4102444800,
+        },
+        "artist-detail": {"name": "Budget Artist 1"},
+        "song-detail": {"song": SONG},
+        "station-detail": {"name": STATION},
+    }.get(name)
+
+    if name in STATION_URLS:
+        kwargs = {"station_name": STATION}
+
+    data = {
+        "search": {"q": "budget song 1"},
+        "now_playing_poll": {"since": since - 1},
+    }.get(name, {})
+
+    return ("get", reverse(name, kwargs=kwargs), lambda n: data)
+
+
+@contextmanager
+def capture_queries():
+    """
+    Records the SQL run on any connection in any thread (websocket and
+    streaming views query from worker threads).
+    """
+
+    queries = []
+    execute = CursorWrapper._execute_with_wrappers
+
+    def record(cursor, sql, params, many, executor):
+        queries.append(sql)
+        return execute(cursor, sql, params, many, executor)
+
+    with patch.object(CursorWrapper, "_execute_with_wrappers", record):
+        yield queries
+
+
+def url_names(patterns) -> set:
+    """
+    Lists the names of every URL (leaving out the admin).
+    """
+
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if not pattern.namespace:
+                names |= url_names(pattern.url_patterns)
+        elif pattern.name:
+            names.add(pattern.name)
+
+    return names
+
+
+# Websocket routes: path and the message to send (if any) to start them off
+
+WEBSOCKETS = {
+    "websocket_now_playing": (f"/nowplaying/{STATION}/", None),
+    "websocket_dashboard": ("/nowplaying/", None),
+    "websocket_protocol": (
+        "/v1/nowplaying/",
+        {"type": "subscribe", "stations": [STATION]},
+    ),
+}
+
+HTTP_BUDGETS = sorted(name for name in BUDGETS if not BUDGETS[name].get("async"))
+ASYNC_BUDGETS = sorted(name for name in BUDGETS if BUDGETS[name].get("async"))
+
+
+class BudgetTest(TestCase):
+    """
+    Checks every URL keeps within its query and time budget.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.token = seed()
+
+    def setUp(self):
+        cache.clear()
+        StationRegistry().forget()
+        self.since = SongPlay.objects.filter(station__name=STATION).latest("id").id
+
+    def test_every_url(self):
+        """
+        Checks every URL (and nothing else) has a budget.
+        """
+
+        # Act / Assert
+
+        self.assertEqual(
+            url_names(urls.urlpatterns) | set(WEBSOCKETS),
+            set(BUDGETS),
+        )
+
+    @parameterized.expand(HTTP_BUDGETS)
+    def test_budget(self, name):
+        """
+        Checks a URL's query count and time (once it's warmed up).
+        """
+
+        # Arrange
+
+        budget = BUDGETS[name]
+        (method, path, data) = request_for(name, self.since)
+
+        def request(n):
+            if method == "post":
+                return self.client.post(
+                    path,
+                    json.dumps(data(n)),
+                    content_type="application/json",
+                    HTTP_AUTHORIZATION=f"Token {self.token.key}",
+                )
+
+            return self.client.get(
+                path, data(n), HTTP_AUTHORIZATION=f"Token {self.token.key}"
+            )
+
+        request(0)
+
+        # Act
+
+        with capture_queries() as queries:
+            start = time.perf_counter()
+            response = request(1)
+            elapsed = (time.perf_counter() - start) * 1000
+
+        # Assert
+
+        self.assertLess(response.status_code, 400, response.content[:500])
+        self.assertLessEqual(
+            len(queries),
+            budget["queries"],
+            "\n".join(queries),
+        )
+        self.assertLessEqual(elapsed, budget["milliseconds"])
+
+
+class AsyncBudgetTest(TransactionTestCase):
+    """
+    Checks the streaming URLs and websockets keep within their budgets.
+    """
+
+    def setUp(self):
+        cache.clear()
+        StationRegistry().forget()
+        seed()
+        self.since = SongPlay.objects.filter(station__name=STATION).latest("id").id
+
+    async def first_message(self, name):
+        """
+        Opens a stream or websocket and waits for the first message.
+        """
+
+        if name == "now_playing_stream":
+            (_, path, _) = request_for(name, self.since)
+            response = await AsyncClient().get(path)
+            return await response.streaming_content.__anext__()
+
+        (path, message) = WEBSOCKETS[name]
+
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        await communicator.connect()
+        if message:
+            await communicator.send_json_to(message)
+            await communicator.receive_from()
+
+        received = await communicator.receive_from()
+        await communicator.disconnect()
+        return received
+
+    @parameterized.expand(ASYNC_BUDGETS)
+    async def test_budget(self, name):
+        """
+        Checks the queries and time taken to get the first message.
+        """
+
+        # Arrange
+
+        budget = BUDGETS[name]
+        await self.first_message(name)
+
+        # Act
+
+        with capture_queries() as queries:
+            start = time.perf_counter()
+            message = await self.first_message(name)
+            elapsed = (time.perf_counter() - start) * 1000
+
+        # Assert
+
+        self.assertTrue(message)
+        self.assertLessEqual(
+            len(queries),
+            budget["queries"],
+            "\n".join(queries),
+        )
+        self.assertLessEqual(elapsed, budget["milliseconds"])
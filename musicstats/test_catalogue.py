@@ -0,0 +1,282 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from importlib import import_module
+from io import StringIO
+from parameterized import parameterized
+from rest_framework.test import APITestCase
+from rest_framework.authtoken.models import Token
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.urls import reverse
+from musicstats.models import Artist, Song, SongPlay, Station
+from musicstats.ingest import SongResolver
+from musicstats.normalise import artist_match_key, normalise, song_match_key
+
+
+class NormaliseTest(APITestCase):
+    """
+    Tests the normalisation of song and artist names.
+    """
+
+    @parameterized.expand(
+        [
+            ("Beyoncé", "beyonce"),
+            ("  The   Singers ", "the singers"),
+            ("Simon & Garfunkel", "simon and garfunkel"),
+            ("Artist ft. Someone", "artist feat someone"),
+            ("Artist (Featuring Someone)", "artist feat someone"),
+            ("Don’t Stop Me Now", "dont stop me now"),
+            ("AC/DC", "ac dc"),
+            ("!!!", "!!!"),
+        ]
+    )
+    def test_normalise(self, text, expected):
+        """Checks text normalises as expected."""
+
+        # Act
+
+        actual = normalise(text)
+
+        # Assert
+
+        self.assertEqual(actual, expected)
+
+    def test_song_match_key(self):
+        """Checks variants of a song share a match key."""
+
+        self.assertEqual(
+            song_match_key("Artist feat. Someone", "The Song"),
+            song_match_key("ARTIST FT SOMEONE", "the  song"),
+        )
+        self.assertNotEqual(
+            song_match_key("Artist", "The Song"),
+            song_match_key("Artist", "The Song (Remix)"),
+        )
+
+
+class SongMatchingTest(APITestCase):
+    """
+    Tests songs and artists are matched on their normalised names.
+    """
+
+    username = "matching_user"
+    password = "M@tch1ng!"
+    email = "matching@example.com"
+    station_name = "Matching FM"
+    station_slogan = "Spot the difference."
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Required setup for the test case.
+        """
+
+        self.user = User.objects.create_user(self.username, self.email, self.password)
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+        self.station = Station(
+            name=self.station_name,
+            slogan=self.station_slogan,
+            primary_colour=self.colour,
+            text_colour=self.colour,
+            stream_aac_high=self.stream_url,
+            stream_aac_low=self.stream_url,
+            stream_mp3_high=self.stream_url,
+            stream_mp3_low=self.stream_url,
+            use_liners=True,
+            liner_ratio=0.1,
+            update_account=self.user,
+        )
+
+        self.station.save()
+
+    def _songplay(self, display_artist, artists, title):
+        """
+        Builds a song play for submission.
+        """
+
+        return {
+            "song": {
+                "display_artist": display_artist,
+                "artists": artists,
+                "title": title,
+            },
+            "station": self.station_name,
+        }
+
+    def test_variants_match(self):
+        """
+        Tests variants of the same song resolve to a single song and artists.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log")
+        bulk_url = reverse("song_play_log_bulk")
+
+        # Act
+
+        self.client.post(
+            url,
+            self._songplay(
+                "Beyoncé feat. Jay-Z", ["Beyoncé", "Jay-Z"], "Crazy In Love"
+            ),
+            format="json",
+        )
+        self.client.post(
+            url, self._songplay("Other Artist", [], "Other Song"), format="json"
+        )
+        self.client.post(
+            url,
+            self._songplay("beyonce ft jay-z", ["BEYONCE", "jay z"], "crazy in love"),
+            format="json",
+        )
+        self.client.post(
+            bulk_url,
+            [
+                self._songplay("Jay-Z", ["jay-z"], "99 Problems"),
+                self._songplay("Beyonce Featuring Jay Z", ["Jay-Z"], "Crazy  In Love"),
+            ],
+            format="json",
+        )
+
+        # Assert
+
+        self.assertEqual(Song.objects.count(), 3)
+        self.assertEqual(
+            SongPlay.objects.filter(song__title="Crazy In Love").count(), 3
+        )
+        self.assertEqual(
+            sorted(Artist.objects.values_list("name", flat=True)),
+            ["Beyoncé", "Jay-Z"],
+        )
+
+    def test_song_lookup(self):
+        """
+        Tests the song API finds a song by a variant of its name.
+        """
+
+        # Arrange
+
+        Song(display_artist="Beyoncé", title="Irreplaceable").save()
+        url = reverse("song-detail", kwargs={"song": "BEYONCE - irreplaceable"})
+
+        # Act
+
+        response = self.client.get(url)
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["display_artist"], "Beyoncé")
+
+
+class NormaliseCatalogueTest(APITestCase):
+    """
+    Tests backfilling match keys and merging duplicates.
+    """
+
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def test_normalise_catalogue(self):
+        """
+        Tests duplicates from before match keys are merged.
+        """
+
+        # Arrange
+        # Bulk creation skips the match keys, like rows from before we had them
+
+        station = Station.objects.create(
+            name="Merge FM",
+            slogan="Two become one.",
+            primary_colour=self.colour,
+            text_colour=self.colour,
+            stream_aac_high=self.stream_url,
+            stream_aac_low=self.stream_url,
+            stream_mp3_high=self.stream_url,
+            stream_mp3_low=self.stream_url,
+        )
+        artists = Artist.objects.bulk_create(
+            [Artist(name="Beyoncé"), Artist(name="BEYONCE", musicbrainz_id="mbid")]
+        )
+        songs = Song.objects.bulk_create(
+            [
+                Song(display_artist="Beyoncé", title="Halo"),
+                Song(display_artist="beyonce", title="HALO", itunes_url="itunes"),
+                Song(display_artist="Beyoncé", title="Irreplaceable"),
+            ]
+        )
+        songs[0].artists.add(artists[0])
+        songs[1].artists.add(artists[1])
+        songs[2].artists.add(artists[1])
+
+        for song in songs:
+            SongPlay.objects.create(song=song, station=station)
+
+        # Act
+
+        output = StringIO()
+        call_command("normalise_catalogue", batch_size=1, stdout=output)
+
+        # Assert
+
+        self.assertIn("Merged away 1 artists.", output.getvalue())
+        self.assertIn("Merged away 1 songs.", output.getvalue())
+
+        artist = Artist.objects.get()
+        self.assertEqual(artist.name, "Beyoncé")
+        self.assertEqual(artist.musicbrainz_id, "mbid")
+
+        halo = Song.objects.get(title="Halo")
+        self.assertEqual(halo.itunes_url, "itunes")
+        self.assertEqual(list(halo.artists.all()), [artist])
+        self.assertEqual(SongPlay.objects.filter(song=halo).count(), 2)
+        self.assertEqual(
+            list(Song.objects.get(title="Irreplaceable").artists.all()), [artist]
+        )
+
+    def test_migration_backfill(self):
+        """
+        Tests the migration gives existing songs and artists keys, so they're
+        matched rather than duplicated.
+        """
+
+        # Arrange
+
+        Artist.objects.bulk_create([Artist(name="Beyoncé")])
+        Song.objects.bulk_create([Song(display_artist="Beyoncé", title="Halo")])
+        migration = import_module("musicstats.migrations.0022_backfill_match_keys")
+
+        # Act
+
+        migration.backfill_match_keys(apps, None)
+        (song, created) = SongResolver().resolve(
+            {"display_artist": "beyonce", "title": "HALO", "artists": ["Beyonce"]}
+        )
+
+        # Assert
+
+        self.assertFalse(created)
+        self.assertEqual(song.title, "Halo")
+        self.assertEqual(Artist.objects.get().match_key, artist_match_key("Beyoncé"))
@@ -17,12 +17,24 @@
 
 """
 
+import asyncio
 import json
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
 from channels.routing import URLRouter
 from channels.testing import WebsocketCommunicator
 from django.urls import re_path
-from django.test import TransactionTestCase
-from musicstats.consumers import NowPlayingConsumer
+from django.test import TransactionTestCase, override_settings
+from musicstats.benchmark import benchmark, measure
+from musicstats.broadcast import (
+    now_playing_group,
+    now_playing_groups,
+    now_playing_shard,
+    send_now_playing_async,
+)
+from musicstats import metrics
+from musicstats.consumers import LAGGING_CLOSE_CODE, NowPlayingConsumer
 from musicstats.models import Song, SongPlay, Station
 from rest_framework.authtoken.models import Token
 
@@ -66,14 +78,14 @@ class ChannelsTest(TransactionTestCase):
         song_play = SongPlay(song=song, station=station)
         song_play.save()
 
-    async def test_now_playing(self):
+        self.station = station
+
+    def application(self):
         """
-        Makes sure the current song is returned on connection.
+        Routes websockets to the now playing consumer.
         """
 
-        # Make the websocket connection
-
-        application = URLRouter(
+        return URLRouter(
             [
                 re_path(
                     r"^nowplaying/(?P<station_name>[^/]+)/$",
@@ -81,7 +93,17 @@ class ChannelsTest(TransactionTestCase):
                 )
             ]
         )
-        communicator = WebsocketCommunicator(application, "/nowplaying/Channels/")
+
+    async def test_now_playing(self):
+        """
+        Makes sure the current song is returned on connection.
+        """
+
+        # Make the websocket connection
+
+        communicator = WebsocketCommunicator(
+            self.application(), "/nowplaying/Channels/"
+        )
         (connected, _) = await communicator.connect()
         self.assertTrue(connected)
 
@@ -90,3 +112,159 @@ class ChannelsTest(TransactionTestCase):
         self.assertEqual(json_response["song"]["display_artist"], "Channels")
         self.assertEqual(json_response["song"]["title"], "WS Song")
         self.assertEqual(json_response["station"], "Channels")
+
+    @override_settings(NOW_PLAYING_GROUP_SHARDS=4)
+    async def test_sharded(self):
+        """
+        Makes sure listeners spread over several groups all hear about plays.
+        """
+
+        # Arrange
+
+        communicators = [
+            WebsocketCommunicator(self.application(), "/nowplaying/Channels/")
+            for _ in range(8)
+        ]
+        for communicator in communicators:
+            (connected, _) = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_from()
+
+        # Act
+
+        await send_now_playing_async(self.station.id, {"title": "Sharded"})
+
+        # Assert
+
+        for communicator in communicators:
+            self.assertEqual(
+                json.loads(await communicator.receive_from()), {"title": "Sharded"}
+            )
+            await communicator.disconnect()
+
+    def slow_application(self, gate):
+        """
+        Routes websockets to a now playing consumer whose sends wait on a
+        gate, like a listener on a stalled connection.
+        """
+
+        class SlowConsumer(NowPlayingConsumer):
+            async def send(self, text_data=None, bytes_data=None, close=False):
+                await gate.wait()
+                await super().send(text_data, bytes_data, close)
+
+        return URLRouter(
+            [re_path(r"^nowplaying/(?P<station_name>[^/]+)/$", SlowConsumer.as_asgi())]
+        )
+
+    async def test_coalesced(self):
+        """
+        Makes sure slow listeners only get the newest song once they catch up.
+        """
+
+        # Arrange
+
+        gate = asyncio.Event()
+        communicator = WebsocketCommunicator(
+            self.slow_application(gate), "/nowplaying/Channels/"
+        )
+        await communicator.connect()
+        coalesced = metrics.websocket_messages_coalesced.value()
+
+        # Act
+
+        for title in ("One", "Two", "Three"):
+            await send_now_playing_async(self.station.id, {"title": title})
+            await asyncio.sleep(0.01)
+
+        gate.set()
+        current = json.loads(await communicator.receive_from())
+        latest = json.loads(await communicator.receive_from())
+
+        # Assert
+
+        self.assertEqual(current["song"]["title"], "WS Song")
+        self.assertEqual(latest, {"title": "Three"})
+        self.assertTrue(await communicator.receive_nothing())
+        self.assertEqual(metrics.websocket_messages_coalesced.value(), coalesced + 2)
+        await communicator.disconnect()
+
+    @override_settings(NOW_PLAYING_MAX_LAG=0.05)
+    async def test_evicted(self):
+        """
+        Makes sure listeners that stop reading are disconnected.
+        """
+
+        # Arrange
+
+        communicator = WebsocketCommunicator(
+            self.slow_application(asyncio.Event()), "/nowplaying/Channels/"
+        )
+        await communicator.connect()
+        evictions = metrics.websocket_evictions.value()
+
+        # Act
+
+        output = await communicator.receive_output()
+
+        # Assert
+
+        self.assertEqual(
+            output, {"type": "websocket.close", "code": LAGGING_CLOSE_CODE}
+        )
+        self.assertEqual(metrics.websocket_evictions.value(), evictions + 1)
+
+    def test_shard_names(self):
+        """
+        Makes sure unsharded groups keep their old name.
+        """
+
+        # Act / Assert
+
+        self.assertEqual(now_playing_groups(3), ["nowplaying_3"])
+
+        with override_settings(NOW_PLAYING_GROUP_SHARDS=2):
+            self.assertEqual(
+                now_playing_groups(3), ["nowplaying_3_0", "nowplaying_3_1"]
+            )
+            self.assertIn(
+                now_playing_group(3, now_playing_shard("specific.abc!def")),
+                now_playing_groups(3),
+            )
+
+    @benchmark
+    def test_benchmark_fan_out(self):
+        """
+        Compares broadcast latency to 10,000 listeners over 1 and 16 groups.
+        """
+
+        listeners = 10000
+
+        for shards in (1, 16):
+            with override_settings(NOW_PLAYING_GROUP_SHARDS=shards):
+
+                # Arrange
+
+                layer = InMemoryChannelLayer(capacity=1000)
+
+                async def join():
+                    for _ in range(listeners):
+                        channel = await layer.new_channel()
+                        await layer.group_add(
+                            now_playing_group(1, now_playing_shard(channel)), channel
+                        )
+
+                async_to_sync(join)()
+
+                # Act / Assert
+
+                with patch(
+                    "musicstats.broadcast.get_channel_layer", return_value=layer
+                ):
+                    measure(
+                        f"Broadcast to {listeners} listeners ({shards} groups)",
+                        lambda _: async_to_sync(send_now_playing_async)(
+                            1, {"title": "Fan out"}
+                        ),
+                        items=listeners,
+                    )
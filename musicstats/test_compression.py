@@ -0,0 +1,180 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import gzip
+import zlib
+from unittest import skipUnless
+from parameterized import parameterized
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from musicstats.benchmark import benchmark, measure
+from musicstats.middleware import CompressionMiddleware, GzipStream, brotli
+from musicstats.renderers import dumps
+
+CONTENT = dumps(
+    [
+        {
+            "song": {"display_artist": "Artist", "title": f"Song {index}"},
+            "station": "Compression FM",
+            "date_time": "2021-07-10T13:00:00+01:00",
+        }
+        for index in range(100)
+    ]
+)
+
+
+class CompressionMiddlewareTest(TestCase):
+    """
+    Tests compressing API responses.
+    """
+
+    def respond(self, path, response, accept_encoding="gzip, deflate"):
+        """
+        Runs a response through the middleware.
+        """
+
+        request = RequestFactory().get(path, HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda _: response)(request)
+
+    def test_gzip(self):
+        """
+        Tests large API responses are gzipped.
+        """
+
+        # Act
+
+        response = self.respond("/api/songplay/test/", HttpResponse(CONTENT))
+
+        # Assert
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertLess(len(response.content), len(CONTENT))
+        self.assertEqual(gzip.decompress(response.content), CONTENT)
+
+    @parameterized.expand(
+        [
+            ("small", "/api/songplay/test/", b"{}", "gzip"),
+            ("not api", "/admin/", CONTENT, "gzip"),
+            ("not accepted", "/api/songplay/test/", CONTENT, "identity"),
+            ("refused", "/api/songplay/test/", CONTENT, "gzip;q=0"),
+        ]
+    )
+    def test_uncompressed(self, _, path, content, accept_encoding):
+        """
+        Tests we leave alone responses we shouldn't compress.
+        """
+
+        # Act
+
+        response = self.respond(path, HttpResponse(content), accept_encoding)
+
+        # Assert
+
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, content)
+
+    @override_settings(COMPRESSION_MIN_SIZE=0)
+    def test_streaming(self):
+        """
+        Tests streaming responses are compressed a chunk at a time.
+        """
+
+        # Arrange
+
+        chunks = [CONTENT[:500], CONTENT[500:]]
+
+        # Act
+
+        response = self.respond("/api/export/", StreamingHttpResponse(iter(chunks)))
+        compressed = list(response.streaming_content)
+
+        # Assert
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertFalse(response.has_header("Content-Length"))
+        self.assertEqual(len(compressed), 3)
+
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        self.assertEqual(decompressor.decompress(compressed[0]), chunks[0])
+        self.assertEqual(gzip.decompress(b"".join(compressed)), CONTENT)
+
+    def test_event_stream(self):
+        """
+        Tests server-sent event streams aren't compressed.
+        """
+
+        # Act
+
+        response = self.respond(
+            "/api/nowplaying/test/stream",
+            StreamingHttpResponse(iter([CONTENT]), content_type="text/event-stream"),
+        )
+
+        # Assert
+
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(b"".join(response.streaming_content), CONTENT)
+
+    @skipUnless(brotli, "Brotli is not installed.")
+    def test_brotli(self):
+        """
+        Tests Brotli is preferred when the client accepts it.
+        """
+
+        # Act
+
+        response = self.respond(
+            "/api/songplay/test/", HttpResponse(CONTENT), "gzip, deflate, br"
+        )
+
+        # Assert
+
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), CONTENT)
+
+    @benchmark
+    def test_benchmark_compression(self):
+        """
+        Compares the size and CPU cost of each compression level.
+        """
+
+        # Arrange
+
+        content = CONTENT * 50
+        print(f"Uncompressed: {len(content)} bytes")
+
+        # Act / Assert
+
+        for level in (1, 6, 9):
+            with override_settings(COMPRESSION_GZIP_LEVEL=level):
+                size = len(GzipStream.compress_all(content))
+                measure(
+                    f"gzip level {level} ({size} bytes)",
+                    lambda _: GzipStream.compress_all(content),
+                )
+
+        if brotli:
+            for quality in (1, 4, 11):
+                size = len(brotli.compress(content, quality=quality))
+                measure(
+                    f"Brotli quality {quality} ({size} bytes)",
+                    lambda _: brotli.compress(content, quality=quality),
+                )
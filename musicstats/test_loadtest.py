@@ -0,0 +1,122 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from io import StringIO
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TransactionTestCase
+from musicstats.loadtest import LoadTest
+from musicstats.models import SongPlay, Station
+from musicstats.registry import StationRegistry
+from musicstats.synthetic import SyntheticCatalogue
+
+
+class LoadTestTest(TransactionTestCase):
+    """
+    Tests the load test scenarios (on a tiny catalogue).
+    """
+
+    def setUp(self):
+        cache.clear()
+        StationRegistry().forget()
+
+        catalogue = SyntheticCatalogue(chunk_size=100)
+        catalogue.create_stations(2)
+        catalogue.create_artists(10)
+        catalogue.create_songs(50)
+        catalogue.create_plays(200)
+
+    def test_scenarios(self):
+        """
+        Tests every scenario runs without errors.
+        """
+
+        # Arrange
+        # SQLite can't take writes from several threads at once
+
+        concurrency = 1 if connection.vendor == "sqlite" else 2
+        load_test = LoadTest(requests=6, concurrency=concurrency)
+
+        # Act
+
+        results = [
+            result
+            for scenario in LoadTest.SCENARIOS
+            for result in load_test.run(scenario)
+        ]
+
+        # Assert
+
+        self.assertEqual(
+            [result.name for result in results],
+            [
+                "log_song_play",
+                "song_play_list",
+                "now_playing_plain",
+                "epg_current",
+                "websocket_connect",
+                f"websocket_broadcast ({concurrency} listeners)",
+            ],
+        )
+        self.assertEqual([result.errors for result in results], [0] * 6)
+        self.assertEqual([len(result.timings) for result in results[:5]], [6] * 5)
+        self.assertGreater(SongPlay.objects.count(), 200)
+
+    def test_command(self):
+        """
+        Tests the report from the management command.
+        """
+
+        # Arrange
+
+        out = StringIO()
+
+        # Act
+
+        call_command(
+            "load_test",
+            "--scenario=now_playing_plain",
+            "--scenario=epg_current",
+            "--requests=4",
+            stdout=out,
+        )
+
+        # Assert
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("now_playing_plain: 4 requests (0 errors)"))
+        self.assertIn("p99", lines[1])
+
+    def test_no_stations(self):
+        """
+        Tests we need something to test against.
+        """
+
+        # Arrange
+
+        SongPlay.objects.all().delete()
+        Station.objects.all().delete()
+
+        # Act / Assert
+
+        with self.assertRaises(CommandError):
+            call_command("load_test", stdout=StringIO())
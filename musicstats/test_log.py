@@ -0,0 +1,138 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import logging
+from django.test import SimpleTestCase, TestCase, override_settings
+from musicstats.cron import EpgUpdater
+from musicstats.log import JobRun, JsonFormatter
+
+LOGGER = "musicstats.test"
+
+
+class JsonFormatterTest(SimpleTestCase):
+    """
+    Tests formatting log records as JSON.
+    """
+
+    def test_format(self):
+        """
+        Tests the message and extra fields end up in the JSON.
+        """
+
+        # Arrange
+
+        record = logging.makeLogRecord(
+            {
+                "name": LOGGER,
+                "levelname": "INFO",
+                "msg": "Processed %s.",
+                "args": ("Song",),
+                "item": "Song",
+                "duration": 0.5,
+            }
+        )
+
+        # Act
+
+        entry = json.loads(JsonFormatter().format(record))
+
+        # Assert
+
+        self.assertEqual(entry["message"], "Processed Song.")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["logger"], LOGGER)
+        self.assertEqual(entry["item"], "Song")
+        self.assertEqual(entry["duration"], 0.5)
+        self.assertNotIn("args", entry)
+
+
+class JobRunTest(TestCase):
+    """
+    Tests timing and summarising cron job runs.
+    """
+
+    def test_summary(self):
+        """
+        Tests items, errors and phase timings are summarised at the end.
+        """
+
+        # Act
+
+        with self.assertLogs(LOGGER, "DEBUG") as logs:
+            with JobRun("test.job", logging.getLogger(LOGGER)) as run:
+                with run.item("One"):
+                    with run.phase("fetch"):
+                        pass
+                    with run.phase("db_write"):
+                        pass
+                with run.item("Two"):
+                    run.failed("Couldn't get %s.", "Two", item="Two")
+                with self.assertRaises(ValueError):
+                    with run.item("Three"):
+                        raise ValueError()
+
+        # Assert
+
+        summary = logs.records[-1]
+        self.assertEqual(summary.getMessage(), "Finished test.job.")
+        self.assertEqual(summary.items, 3)
+        self.assertEqual(summary.errors, 2)
+        self.assertEqual(set(summary.phases), {"fetch", "db_write"})
+
+        processed = [
+            record for record in logs.records if record.getMessage() == "Processed One."
+        ]
+        self.assertEqual(set(processed[0].phases), {"fetch", "db_write"})
+        self.assertIn(
+            "Failed on Three.", [record.getMessage() for record in logs.records]
+        )
+
+    @override_settings(CRON_SLOW_ITEM_THRESHOLD=-1)
+    def test_slow_item(self):
+        """
+        Tests slow items are logged as warnings.
+        """
+
+        # Act
+
+        with self.assertLogs(LOGGER, "WARNING") as logs:
+            with JobRun("test.job", logging.getLogger(LOGGER)) as run:
+                with run.item("Slow"):
+                    pass
+
+        # Assert
+
+        self.assertEqual(logs.records[0].getMessage(), "Slow item Slow.")
+        self.assertEqual(logs.records[0].item, "Slow")
+
+    def test_cron_job(self):
+        """
+        Tests the cron jobs log a summary of each run.
+        """
+
+        # Act
+
+        with self.assertLogs("musicstats.cron", "INFO") as logs:
+            EpgUpdater().do()
+
+        # Assert
+
+        self.assertEqual(logs.records[-1].job, EpgUpdater.code)
+        self.assertEqual(logs.records[-1].items, 0)
@@ -0,0 +1,225 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import os
+import tempfile
+from datetime import timedelta
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+from django_cron.models import CronJobLog
+from musicstats import metrics
+from musicstats.middleware import MetricsMiddleware
+from musicstats.models import Station
+
+
+class MetricsTest(SimpleTestCase):
+    """
+    Tests recording metrics and formatting them for Prometheus.
+    """
+
+    def test_render(self):
+        """
+        Tests metrics are written in the Prometheus text format.
+        """
+
+        # Arrange
+
+        counter = metrics.Counter("test_total", "A test counter.", registry=None)
+        counter.inc(2, station='Quote " FM')
+        histogram = metrics.Histogram(
+            "test_seconds", "A test histogram.", buckets=(0.1, 1), registry=None
+        )
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+
+        # Act
+
+        text = metrics.render([counter, histogram])
+
+        # Assert
+
+        self.assertIn(
+            "# HELP test_total A test counter.\n"
+            "# TYPE test_total counter\n"
+            'test_total{station="Quote \\" FM"} 2.0\n',
+            text,
+        )
+        self.assertIn(
+            "# TYPE test_seconds histogram\n"
+            'test_seconds_bucket{le="0.1"} 1.0\n'
+            'test_seconds_bucket{le="1.0"} 2.0\n'
+            'test_seconds_bucket{le="+Inf"} 3.0\n'
+            "test_seconds_sum 5.55\n"
+            "test_seconds_count 3.0\n",
+            text,
+        )
+
+    def test_other_processes(self):
+        """
+        Tests metrics written by other processes are added in.
+        """
+
+        # Arrange
+
+        counter = metrics.Counter("test_shared_total", "Shared.", registry=None)
+        counter.inc(1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "1.json"), "w", encoding="utf-8") as file:
+                json.dump({"test_shared_total": [[[], 4]]}, file)
+
+            stale = os.path.join(directory, "2.json")
+            with open(stale, "w", encoding="utf-8") as file:
+                json.dump({"test_shared_total": [[[], 100]]}, file)
+            os.utime(stale, (0, 0))
+
+            # Act
+
+            with override_settings(METRICS_DIRECTORY=directory):
+                metrics.flush()
+                text = metrics.render([counter])
+                flushed = os.listdir(directory)
+
+        # Assert
+
+        self.assertIn("test_shared_total 5.0\n", text)
+        self.assertIn(f"{os.getpid()}.json", flushed)
+        self.assertNotIn("2.json", flushed)
+
+    async def test_async_middleware(self):
+        """
+        Tests async requests are timed without being made synchronous.
+        """
+
+        # Arrange
+
+        async def view(_):
+            return HttpResponse("OK")
+
+        middleware = MetricsMiddleware(view)
+        before = metrics.http_request_duration.snapshot()
+
+        # Act
+
+        response = await middleware(AsyncRequestFactory().get("/"))
+
+        # Assert
+
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(metrics.http_request_duration.snapshot(), before)
+
+
+class MetricsEndpointTest(TestCase):
+    """
+    Tests serving metrics on /metrics.
+    """
+
+    def test_requests(self):
+        """
+        Tests request latency and query counts are recorded by view.
+        """
+
+        # Arrange
+
+        Station(
+            name="Metrics FM",
+            primary_colour="#FFFFFF",
+            text_colour="#FFFFFF",
+            stream_aac_high="https://example.com/stream",
+            stream_aac_low="https://example.com/stream",
+            stream_mp3_high="https://example.com/stream",
+            stream_mp3_low="https://example.com/stream",
+        ).save()
+        before = metrics.http_request_duration.count(
+            view="NowPlayingDashboard", method="GET"
+        )
+
+        # Act
+
+        self.client.get(reverse("now_playing_all"))
+        response = self.client.get(reverse("metrics"))
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertEqual(
+            metrics.http_request_duration.count(
+                view="NowPlayingDashboard", method="GET"
+            ),
+            before + 1,
+        )
+        self.assertIn(
+            'musicstats_http_request_db_queries_count{view="NowPlayingDashboard"}',
+            response.content.decode(),
+        )
+
+    def test_cron_jobs(self):
+        """
+        Tests the last run of each cron job is reported.
+        """
+
+        # Arrange
+
+        end = timezone.now()
+        CronJobLog.objects.create(
+            code="musicstats.cron.epg",
+            start_time=end - timedelta(seconds=90),
+            end_time=end,
+            is_success=True,
+        )
+
+        # Act
+
+        response = self.client.get(reverse("metrics"))
+
+        # Assert
+
+        self.assertIn(
+            'musicstats_cron_job_last_duration_seconds{job="musicstats.cron.epg"} 90.0',
+            response.content.decode(),
+        )
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_token(self):
+        """
+        Tests a token can be required to read the metrics.
+        """
+
+        # Act
+
+        refused = self.client.get(reverse("metrics"))
+        allowed = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer s3cret"
+        )
+
+        # Assert
+
+        self.assertEqual(refused.status_code, 401)
+        self.assertEqual(allowed.status_code, 200)
@@ -0,0 +1,183 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase
+from django.urls import reverse
+from musicstats.benchmark import benchmark, measure
+from musicstats.broadcast import send_now_playing_async
+from musicstats.models import Song, SongPlay, Station
+from musicstats.registry import StationRegistry
+from musicstats.representations import now_playing_data
+from musicstats.routing import websocket_urlpatterns
+
+
+class NowPlayingDashboardTest(TransactionTestCase):
+    """
+    Tests the now playing for several stations at once.
+    """
+
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Creates a few stations, each with a few song plays.
+        """
+
+        StationRegistry().forget()
+
+        self.stations = []
+        for index in range(3):
+            station = Station(
+                name=f"Dashboard {index} FM",
+                primary_colour=self.colour,
+                text_colour=self.colour,
+                stream_aac_high=self.stream_url,
+                stream_aac_low=self.stream_url,
+                stream_mp3_high=self.stream_url,
+                stream_mp3_low=self.stream_url,
+            )
+            station.save()
+            self.stations.append(station)
+
+            for title in ("Old Song", f"Current Song {index}"):
+                song = Song(display_artist="Dashboard Artist", title=title)
+                song.save()
+                SongPlay(song=song, station=station).save()
+
+        # A station that's never played anything
+
+        Station(
+            name="Silent FM",
+            primary_colour=self.colour,
+            text_colour=self.colour,
+            stream_aac_high=self.stream_url,
+            stream_aac_low=self.stream_url,
+            stream_mp3_high=self.stream_url,
+            stream_mp3_low=self.stream_url,
+        ).save()
+
+    def test_all(self):
+        """
+        Tests every station's current song is returned.
+        """
+
+        # Act
+
+        response = self.client.get(reverse("now_playing_all"))
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(play["station"], play["song"]["title"]) for play in response.json()],
+            [(f"Dashboard {index} FM", f"Current Song {index}") for index in range(3)],
+        )
+
+    def test_chosen(self):
+        """
+        Tests the stations can be picked by name.
+        """
+
+        # Act
+
+        response = self.client.get(
+            reverse("now_playing_all"),
+            {"stations": "Dashboard 2 FM,Dashboard 0 FM,Missing FM"},
+        )
+
+        # Assert
+
+        self.assertEqual(
+            [play["station"] for play in response.json()],
+            ["Dashboard 0 FM", "Dashboard 2 FM"],
+        )
+
+    def test_query_count(self):
+        """
+        Tests the query count doesn't grow with the number of stations.
+        """
+
+        # Arrange
+
+        station_ids = [station.id for station in self.stations]
+
+        # Act / Assert
+
+        with self.assertNumQueries(2):
+            now_playing_data(station_ids[:1])
+
+        with self.assertNumQueries(2):
+            now_playing_data(station_ids)
+
+    async def test_websocket(self):
+        """
+        Tests the dashboard socket sends everything on connect, then updates.
+        """
+
+        # Arrange
+
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns),
+            "/nowplaying/?stations=Dashboard%200%20FM,Dashboard%201%20FM",
+        )
+        (connected, _) = await communicator.connect()
+
+        # Act
+
+        initial = json.loads(await communicator.receive_from())
+        await send_now_playing_async(self.stations[2].id, {"title": "Not Mine"})
+        await send_now_playing_async(self.stations[1].id, {"title": "Mine"})
+        update = json.loads(await communicator.receive_from())
+
+        # Assert
+
+        self.assertTrue(connected)
+        self.assertEqual(
+            [play["station"] for play in initial], ["Dashboard 0 FM", "Dashboard 1 FM"]
+        )
+        self.assertEqual(update, {"title": "Mine"})
+        await communicator.disconnect()
+
+    @benchmark
+    def test_benchmark_dashboard(self):
+        """
+        Compares polling each station's now playing with the dashboard.
+        """
+
+        measure(
+            "Now playing per station",
+            lambda _: [
+                self.client.get(
+                    reverse("now_playing_plain", kwargs={"station_name": station.name})
+                )
+                for station in self.stations
+            ],
+            iterations=100,
+            items=len(self.stations),
+        )
+        measure(
+            "Now playing dashboard",
+            lambda _: self.client.get(reverse("now_playing_all")),
+            iterations=100,
+            items=len(self.stations),
+        )
@@ -0,0 +1,220 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import asyncio
+import time
+from django.test import (
+    AsyncClient,
+    AsyncRequestFactory,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from musicstats.benchmark import benchmark
+from musicstats.broadcast import send_now_playing_async
+from musicstats.models import Song, SongPlay, Station
+from musicstats.registry import StationRegistry
+from musicstats.views import now_playing_poll
+
+MESSAGE = {"song": {"display_artist": "Poll Artist", "title": "New Song"}}
+
+
+class NowPlayingPollTest(TransactionTestCase):
+    """
+    Tests long polling the plain text now playing.
+    """
+
+    station_name = "Poll FM"
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Creates a station with a song play.
+        """
+
+        StationRegistry().forget()
+
+        self.station = Station(
+            name=self.station_name,
+            primary_colour=self.colour,
+            text_colour=self.colour,
+            stream_aac_high=self.stream_url,
+            stream_aac_low=self.stream_url,
+            stream_mp3_high=self.stream_url,
+            stream_mp3_low=self.stream_url,
+        )
+        self.station.save()
+
+        song = Song(display_artist="Poll Artist", title="Poll Song")
+        song.save()
+
+        self.song_play = SongPlay(song=song, station=self.station)
+        self.song_play.save()
+
+    async def poll(self, since=None):
+        """
+        Long polls the station's now playing.
+        """
+
+        request = AsyncRequestFactory().get(
+            f"/api/nowplaying/{self.station_name}/poll",
+            {} if since is None else {"since": since},
+        )
+        return await now_playing_poll(request, self.station_name)
+
+    async def test_stale(self):
+        """
+        Tests listeners behind the times get the current song straight away.
+        """
+
+        # Act
+
+        response = await self.poll(since=self.song_play.id - 1)
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"Poll Artist - Poll Song")
+        self.assertEqual(response["X-Song-Play-ID"], str(self.song_play.id))
+
+    async def test_new_play(self):
+        """
+        Tests up to date listeners are held until a new song's played.
+        """
+
+        # Arrange
+
+        poll = asyncio.ensure_future(self.poll(since=self.song_play.id))
+        await asyncio.sleep(0.05)
+        waiting = not poll.done()
+
+        # Act
+
+        await send_now_playing_async(self.station.id, MESSAGE, self.song_play.id + 1)
+        response = await poll
+
+        # Assert
+
+        self.assertTrue(waiting)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"Poll Artist - New Song")
+        self.assertEqual(response["X-Song-Play-ID"], str(self.song_play.id + 1))
+
+    @override_settings(NOW_PLAYING_POLL_TIMEOUT=0.05)
+    async def test_timeout(self):
+        """
+        Tests we give up waiting if nothing's played.
+        """
+
+        # Act
+
+        response = await self.poll(since=self.song_play.id)
+
+        # Assert
+
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(NOW_PLAYING_POLL_TIMEOUT=2)
+    async def test_concurrent(self):
+        """
+        Tests a waiting poll doesn't hold up other requests.
+        """
+
+        # Arrange
+
+        client = AsyncClient()
+        poll = asyncio.ensure_future(
+            client.get(
+                reverse("now_playing_poll", kwargs={"station_name": self.station_name}),
+                {"since": self.song_play.id},
+            )
+        )
+        await asyncio.sleep(0.1)
+
+        # Act
+
+        start = time.perf_counter()
+        response = await client.get(
+            reverse("now_playing_plain", kwargs={"station_name": self.station_name})
+        )
+        elapsed = time.perf_counter() - start
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(poll.done())
+        self.assertLess(elapsed, 1)
+        self.assertEqual((await poll).status_code, 304)
+
+    def test_plain_id(self):
+        """
+        Tests the plain text now playing tells listeners where to poll from.
+        """
+
+        # Act
+
+        response = self.client.get(
+            reverse("now_playing_plain", kwargs={"station_name": self.station_name})
+        )
+
+        # Assert
+
+        self.assertEqual(response["X-Song-Play-ID"], str(self.song_play.id))
+
+    @benchmark
+    async def test_benchmark_requests(self):
+        """
+        Compares the requests a listener makes polling every 0.1 seconds with
+        long polling, while a song's played every 0.5 seconds.
+        """
+
+        duration = 2
+        play_ids = iter(range(self.song_play.id + 1, self.song_play.id + 100))
+
+        async def play_songs():
+            while True:
+                await asyncio.sleep(0.5)
+                await send_now_playing_async(self.station.id, MESSAGE, next(play_ids))
+
+        async def short_poll(requests):
+            while True:
+                await self.poll(since=None)
+                requests.append(time.perf_counter())
+                await asyncio.sleep(0.1)
+
+        async def long_poll(requests):
+            since = self.song_play.id
+            while True:
+                response = await self.poll(since=since)
+                requests.append(time.perf_counter())
+                if response.status_code == 200:
+                    since = int(response["X-Song-Play-ID"])
+
+        for (name, client) in [("Polling", short_poll), ("Long polling", long_poll)]:
+            requests = []
+            tasks = [
+                asyncio.ensure_future(play_songs()),
+                asyncio.ensure_future(client(requests)),
+            ]
+            await asyncio.sleep(duration)
+            for task in tasks:
+                task.cancel()
+
+            print(f"{name}: {len(requests)} requests in {duration} seconds")
@@ -0,0 +1,257 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import asyncio
+import json
+import tracemalloc
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.http import Http404
+from django.test import AsyncRequestFactory, TransactionTestCase, override_settings
+from django.urls import re_path
+from musicstats.benchmark import benchmark
+from musicstats.broadcast import send_now_playing_async
+from musicstats.consumers import NowPlayingConsumer
+from musicstats.models import Song, SongPlay, Station
+from musicstats.registry import StationRegistry
+from musicstats.streaming import missed_plays, now_playing_events
+from musicstats.views import now_playing_stream
+
+
+def parse_event(chunk):
+    """
+    Splits a server-sent event into its fields.
+    """
+
+    fields = {}
+    for line in chunk.decode().strip().split("\n"):
+        (name, _, value) = line.partition(": ")
+        fields[name] = value
+
+    return fields
+
+
+class NowPlayingStreamTest(TransactionTestCase):
+    """
+    Tests streaming the now playing as server-sent events.
+    """
+
+    station_name = "Stream FM"
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Creates a station with a couple of song plays.
+        """
+
+        StationRegistry().forget()
+
+        self.station = Station(
+            name=self.station_name,
+            primary_colour=self.colour,
+            text_colour=self.colour,
+            stream_aac_high=self.stream_url,
+            stream_aac_low=self.stream_url,
+            stream_mp3_high=self.stream_url,
+            stream_mp3_low=self.stream_url,
+        )
+        self.station.save()
+
+        song = Song(display_artist="Stream Artist", title="Stream Song")
+        song.save()
+
+        self.song_plays = []
+        for _ in range(3):
+            song_play = SongPlay(song=song, station=self.station)
+            song_play.save()
+            self.song_plays.append(song_play)
+
+    async def stream(self, **kwargs):
+        """
+        Opens the stream for the station.
+        """
+
+        request = AsyncRequestFactory().get(
+            f"/api/nowplaying/{self.station_name}/stream", **kwargs
+        )
+        return await now_playing_stream(request, self.station_name)
+
+    async def test_current(self):
+        """
+        Tests listeners get the current song first.
+        """
+
+        # Act
+
+        response = await self.stream()
+        event = parse_event(await response.streaming_content.__anext__())
+
+        # Assert
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        self.assertEqual(event["id"], str(self.song_plays[-1].id))
+        self.assertEqual(event["event"], "now_playing")
+        self.assertEqual(json.loads(event["data"])["song"]["title"], "Stream Song")
+
+    async def test_published(self):
+        """
+        Tests new song plays are pushed to listeners.
+        """
+
+        # Arrange
+
+        events = now_playing_events(self.station.id)
+        await events.__anext__()
+
+        # Act
+
+        next_event = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0)
+        await send_now_playing_async(self.station.id, {"title": "Published"}, 999)
+        event = parse_event(await next_event)
+
+        # Assert
+
+        self.assertEqual(event["id"], "999")
+        self.assertEqual(json.loads(event["data"]), {"title": "Published"})
+        await events.aclose()
+
+    @override_settings(NOW_PLAYING_STREAM_HEARTBEAT=0.05)
+    async def test_heartbeat(self):
+        """
+        Tests quiet streams are kept alive.
+        """
+
+        # Arrange
+
+        events = now_playing_events(self.station.id)
+        await events.__anext__()
+
+        # Act / Assert
+
+        self.assertEqual(await events.__anext__(), b": heartbeat\n\n")
+        await events.aclose()
+
+    async def test_resume(self):
+        """
+        Tests reconnecting listeners get the plays they missed, in order.
+        """
+
+        # Act
+
+        response = await self.stream(
+            headers={"Last-Event-ID": str(self.song_plays[0].id)}
+        )
+        events = [
+            parse_event(await response.streaming_content.__anext__()) for _ in range(2)
+        ]
+
+        # Assert
+
+        self.assertEqual(
+            [int(event["id"]) for event in events],
+            [song_play.id for song_play in self.song_plays[1:]],
+        )
+
+    async def test_resume_backfilled(self):
+        """
+        Tests reconnecting listeners aren't sent plays backfilled from before
+        the one they had.
+        """
+
+        # Arrange
+
+        song_play = self.song_plays[-1]
+        await SongPlay.objects.acreate(
+            song_id=song_play.song_id,
+            station=self.station,
+            date_time=song_play.date_time - timedelta(hours=2),
+        )
+
+        # Act
+
+        plays = await sync_to_async(missed_plays)(self.station.id, song_play.id)
+
+        # Assert
+
+        self.assertEqual(plays, [])
+
+    async def test_unknown_station(self):
+        """
+        Tests streams for stations that don't exist are rejected.
+        """
+
+        # Act / Assert
+
+        with self.assertRaises(Http404):
+            await now_playing_stream(AsyncRequestFactory().get("/"), "Missing FM")
+
+    @benchmark
+    async def test_benchmark_memory(self):
+        """
+        Compares the memory held per listener by event streams and websockets.
+        """
+
+        listeners = 500
+
+        async def open_streams():
+            streams = [now_playing_events(self.station.id) for _ in range(listeners)]
+            for stream in streams:
+                await stream.__anext__()
+            return streams
+
+        async def open_websockets():
+            application = URLRouter(
+                [
+                    re_path(
+                        r"^nowplaying/(?P<station_name>[^/]+)/$",
+                        NowPlayingConsumer.as_asgi(),
+                    )
+                ]
+            )
+            communicators = [
+                WebsocketCommunicator(application, f"/nowplaying/{self.station_name}/")
+                for _ in range(listeners)
+            ]
+            for communicator in communicators:
+                await communicator.connect()
+                await communicator.receive_from()
+            return communicators
+
+        for (name, opener) in [
+            ("Server-sent events", open_streams),
+            ("Websockets", open_websockets),
+        ]:
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            connections = await opener()
+            after = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            print(f"{name}: {(after - before) / listeners / 1024:.1f} KiB per listener")
+
+            for connection in connections:
+                if isinstance(connection, WebsocketCommunicator):
+                    await connection.disconnect()
+                else:
+                    await connection.aclose()
@@ -0,0 +1,202 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import marshal
+from io import StringIO
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, override_settings
+from django.urls import reverse
+from musicstats.middleware import ProfilingMiddleware
+from musicstats.models import ProfileReport, Song, SongPlay, Station
+from musicstats.profiling import profile_token
+from musicstats.registry import StationRegistry
+
+
+class ProfilingTest(APITestCase):
+    """
+    Tests profiling requests on demand.
+    """
+
+    def setUp(self):
+        cache.clear()
+        StationRegistry().forget()
+
+        self.user = User.objects.create_user("profile", "profile@example.com", "Pr0f!")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+        station = Station.objects.create(
+            name="Profile FM",
+            primary_colour="#FFFFFF",
+            text_colour="#FFFFFF",
+            stream_aac_high="https://example.com/stream",
+            stream_aac_low="https://example.com/stream",
+            stream_mp3_high="https://example.com/stream",
+            stream_mp3_low="https://example.com/stream",
+        )
+        song = Song.objects.create(display_artist="Artist", title="Title")
+        SongPlay.objects.create(song=song, station=station)
+
+        self.url = reverse("song_play_recent", kwargs={"station_name": "Profile FM"})
+
+    def test_profiled(self):
+        """
+        Tests requests with a valid token are profiled.
+        """
+
+        # Act
+
+        response = self.client.get(self.url, HTTP_X_PROFILE=profile_token("triage"))
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        report = ProfileReport.objects.get()
+        self.assertEqual(response["X-Profile-Report"], str(report.id))
+        self.assertEqual(report.requested_by, "triage")
+        self.assertEqual(report.path, self.url)
+        self.assertEqual(report.view, "SongPlayList")
+        self.assertEqual(report.status_code, 200)
+        self.assertEqual(report.query_count, len(report.queries))
+        self.assertTrue(
+            any("musicstats_songplay" in query["sql"] for query in report.queries)
+        )
+        self.assertIn("cumulative", report.stats)
+        self.assertTrue(marshal.loads(bytes(report.profile)))
+
+    @parameterized.expand(
+        [
+            ("no token", {}),
+            ("bad token", {"HTTP_X_PROFILE": "triage:nonsense"}),
+            ("not staff", {"QUERY_STRING": "profile"}),
+        ]
+    )
+    def test_not_profiled(self, _, extra):
+        """
+        Tests other requests are left alone.
+        """
+
+        # Act
+
+        response = self.client.get(self.url, **extra)
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("X-Profile-Report"))
+        self.assertFalse(ProfileReport.objects.exists())
+
+    @override_settings(PROFILE_TOKEN_MAX_AGE=-1)
+    def test_expired(self):
+        """
+        Tests tokens only last so long.
+        """
+
+        # Act
+
+        self.client.get(self.url, HTTP_X_PROFILE=profile_token("triage"))
+
+        # Assert
+
+        self.assertFalse(ProfileReport.objects.exists())
+
+    def test_staff(self):
+        """
+        Tests staff can profile requests with ?profile, and download the
+        report from the admin.
+        """
+
+        # Arrange
+
+        self.user.is_staff = True
+        self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+        # Act
+
+        self.client.get(self.url, {"profile": ""})
+        report = ProfileReport.objects.get()
+        change = self.client.get(
+            reverse("admin:musicstats_profilereport_change", args=[report.id])
+        )
+        download = self.client.get(
+            reverse("admin:musicstats_profilereport_download", args=[report.id])
+        )
+
+        # Assert
+
+        self.assertEqual(report.requested_by, "profile")
+        self.assertEqual(change.status_code, 200)
+        self.assertContains(change, "Slowest queries")
+        self.assertEqual(download.content, bytes(report.profile))
+        self.assertIn(f"profile_{report.id}.prof", download["Content-Disposition"])
+
+    async def test_async(self):
+        """
+        Tests async views are profiled without being made synchronous.
+        """
+
+        # Arrange
+
+        async def view(_):
+            return HttpResponse("OK")
+
+        middleware = ProfilingMiddleware(view)
+        request = AsyncRequestFactory().get(
+            "/api/nowplaying/Profile FM/poll", headers={"X-Profile": profile_token("a")}
+        )
+
+        # Act
+
+        response = await middleware(request)
+        unprofiled = await middleware(AsyncRequestFactory().get("/"))
+
+        # Assert
+
+        report = await ProfileReport.objects.aget()
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertEqual(response["X-Profile-Report"], str(report.id))
+        self.assertEqual(report.requested_by, "a")
+        self.assertFalse(unprofiled.has_header("X-Profile-Report"))
+
+    def test_command(self):
+        """
+        Tests creating a token from the command line.
+        """
+
+        # Arrange
+
+        out = StringIO()
+
+        # Act
+
+        call_command("profile_token", "triage", stdout=out, stderr=StringIO())
+        self.client.get(self.url, HTTP_X_PROFILE=out.getvalue().strip())
+
+        # Assert
+
+        self.assertEqual(ProfileReport.objects.get().requested_by, "triage")
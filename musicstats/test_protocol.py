@@ -0,0 +1,343 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from datetime import timedelta
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TransactionTestCase
+from parameterized import parameterized
+from musicstats.benchmark import benchmark
+from musicstats.broadcast import send_now_playing_async
+from musicstats.models import Song, SongPlay, Station
+from musicstats.protocol import compact, delta
+from musicstats.registry import StationRegistry
+from musicstats.renderers import dumps
+from musicstats.representations import song_play_data
+from musicstats.routing import websocket_urlpatterns
+
+
+class DeltaTest(SimpleTestCase):
+    """
+    Tests working out what changed between payloads.
+    """
+
+    @parameterized.expand(
+        [
+            ("unchanged", {"a": 1}, {"a": 1}, {}),
+            ("changed", {"a": 1, "b": 2}, {"a": 1, "b": 3}, {"b": 3}),
+            ("added", {"a": 1}, {"a": 1, "b": 2}, {"b": 2}),
+            ("removed", {"a": 1, "b": 2}, {"a": 1}, {"b": None}),
+            (
+                "nested",
+                {"song": {"title": "One", "artist": "A"}},
+                {"song": {"title": "Two", "artist": "A"}},
+                {"song": {"title": "Two"}},
+            ),
+        ]
+    )
+    def test_delta(self, _, old, new, expected):
+        """
+        Tests only changed fields are included.
+        """
+
+        # Act / Assert
+
+        self.assertEqual(delta(old, new), expected)
+
+
+class ProtocolConsumerTest(TransactionTestCase):
+    """
+    Tests the versioned now playing websocket protocol.
+    """
+
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Creates a couple of stations with song plays.
+        """
+
+        StationRegistry().forget()
+
+        self.stations = []
+        self.song_plays = []
+        for name in ("Protocol FM", "Protocol Gold"):
+            station = Station(
+                name=name,
+                primary_colour=self.colour,
+                text_colour=self.colour,
+                stream_aac_high=self.stream_url,
+                stream_aac_low=self.stream_url,
+                stream_mp3_high=self.stream_url,
+                stream_mp3_low=self.stream_url,
+            )
+            station.save()
+            self.stations.append(station)
+
+            for title in ("Earlier", "Latest"):
+                song = Song(
+                    display_artist="Protocol Artist",
+                    title=f"{title} on {name}",
+                    wiki_content="A long story. " * 100,
+                )
+                song.save()
+                song_play = SongPlay(song=song, station=station)
+                song_play.save()
+                self.song_plays.append(song_play)
+
+    async def connect(self):
+        """
+        Opens a protocol websocket.
+        """
+
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), "/v1/nowplaying/"
+        )
+        (connected, _) = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_subscribe(self):
+        """
+        Tests subscribing to several stations at once.
+        """
+
+        # Arrange
+
+        communicator = await self.connect()
+
+        # Act
+
+        await communicator.send_json_to(
+            {"type": "subscribe", "stations": ["Protocol FM", "Protocol Gold"]}
+        )
+        ack = await communicator.receive_json_from()
+        plays = [await communicator.receive_json_from() for _ in range(2)]
+
+        # Assert
+
+        self.assertEqual(
+            ack,
+            {
+                "v": 1,
+                "type": "subscribed",
+                "stations": ["Protocol FM", "Protocol Gold"],
+            },
+        )
+        self.assertEqual(
+            [(play["type"], play["station"], play["seq"]) for play in plays],
+            [
+                ("now_playing", "Protocol FM", self.song_plays[1].id),
+                ("now_playing", "Protocol Gold", self.song_plays[3].id),
+            ],
+        )
+        self.assertEqual(
+            plays[0]["data"]["song"],
+            {
+                "display_artist": "Protocol Artist",
+                "title": "Latest on Protocol FM",
+                "thumbnail": None,
+            },
+        )
+        await communicator.disconnect()
+
+    async def test_delta(self):
+        """
+        Tests only what's changed is sent for later song plays.
+        """
+
+        # Arrange
+
+        communicator = await self.connect()
+        await communicator.send_json_to(
+            {"type": "subscribe", "stations": ["Protocol FM"], "format": "full"}
+        )
+        await communicator.receive_json_from()
+        first = await communicator.receive_json_from()
+
+        message = dict(first["data"])
+        message["song"] = dict(message["song"], title="Newer")
+
+        # Act
+
+        await send_now_playing_async(self.stations[0].id, message, first["seq"] + 10)
+        update = await communicator.receive_json_from()
+
+        # Assert
+
+        self.assertEqual(
+            update,
+            {
+                "v": 1,
+                "type": "delta",
+                "station": "Protocol FM",
+                "seq": first["seq"] + 10,
+                "data": {"song": {"title": "Newer"}},
+            },
+        )
+        await communicator.disconnect()
+
+    async def test_resume(self):
+        """
+        Tests reconnecting clients get what they missed.
+        """
+
+        # Arrange
+
+        communicator = await self.connect()
+
+        # Act
+
+        await communicator.send_json_to(
+            {
+                "type": "subscribe",
+                "stations": ["Protocol FM"],
+                "since": self.song_plays[0].id - 1,
+            }
+        )
+        await communicator.receive_json_from()
+        plays = [await communicator.receive_json_from() for _ in range(2)]
+
+        # Assert
+
+        self.assertEqual(
+            [(play["type"], play["seq"]) for play in plays],
+            [
+                ("now_playing", self.song_plays[0].id),
+                ("delta", self.song_plays[1].id),
+            ],
+        )
+        await communicator.disconnect()
+
+    async def test_resume_backfilled(self):
+        """
+        Tests reconnecting clients aren't sent plays backfilled from before the
+        one they had, on any of the stations they subscribe to.
+        """
+
+        # Arrange
+
+        latest = self.song_plays[3]
+        for station in self.stations:
+            await SongPlay.objects.acreate(
+                song_id=latest.song_id,
+                station=station,
+                date_time=latest.date_time - timedelta(hours=2),
+            )
+
+        communicator = await self.connect()
+
+        # Act
+
+        await communicator.send_json_to(
+            {
+                "type": "subscribe",
+                "stations": ["Protocol FM", "Protocol Gold"],
+                "since": latest.id,
+            }
+        )
+        await communicator.receive_json_from()
+
+        # Assert
+
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_unsubscribe(self):
+        """
+        Tests clients stop hearing about stations they unsubscribe from.
+        """
+
+        # Arrange
+
+        communicator = await self.connect()
+        await communicator.send_json_to(
+            {"type": "subscribe", "stations": ["Protocol FM"]}
+        )
+        await communicator.receive_json_from()
+        await communicator.receive_json_from()
+
+        # Act
+
+        await communicator.send_json_to(
+            {"type": "unsubscribe", "stations": ["Protocol FM"]}
+        )
+        await communicator.receive_nothing()
+        await send_now_playing_async(self.stations[0].id, {"song": {}}, 1000000)
+
+        # Assert
+
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    @parameterized.expand(
+        [
+            ("not json", "nonsense", "Messages must be JSON objects."),
+            ("unknown type", '{"type": "dance"}', "Unknown message type 'dance'."),
+            (
+                "bad stations",
+                '{"type": "subscribe"}',
+                "Stations must be a list of names.",
+            ),
+            (
+                "bad format",
+                '{"type": "subscribe", "stations": [], "format": "tiny"}',
+                "Format must be one of compact, full.",
+            ),
+            (
+                "unknown station",
+                '{"type": "subscribe", "stations": ["Missing FM"]}',
+                "Unknown stations: Missing FM.",
+            ),
+        ]
+    )
+    async def test_errors(self, _, text_data, error):
+        """
+        Tests clients are told about bad messages.
+        """
+
+        # Arrange
+
+        communicator = await self.connect()
+
+        # Act
+
+        await communicator.send_to(text_data=text_data)
+        response = await communicator.receive_json_from()
+
+        # Assert
+
+        self.assertEqual(response, {"v": 1, "type": "error", "error": error})
+        await communicator.disconnect()
+
+    @benchmark
+    def test_benchmark_bandwidth(self):
+        """
+        Compares the bytes sent per song play by the original socket and the
+        protocol's compact deltas.
+        """
+
+        plays = [song_play_data(song_play) for song_play in self.song_plays[:2]]
+
+        full = len(dumps(plays[1]))
+        compact_delta = len(dumps(delta(compact(plays[0]), compact(plays[1]))))
+
+        print(f"Full song play: {full} bytes")
+        print(f"Compact delta: {compact_delta} bytes")
@@ -0,0 +1,257 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import os
+import tempfile
+from io import StringIO
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import AsyncClient, SimpleTestCase, override_settings
+from django.urls import reverse
+from musicstats import querylog
+from musicstats.cron import EpgUpdater
+from musicstats.models import Song, SongPlay, Station
+from musicstats.registry import StationRegistry
+
+
+class FingerprintTest(SimpleTestCase):
+    """
+    Tests reducing queries to their shape.
+    """
+
+    @parameterized.expand(
+        [
+            (
+                "values",
+                "SELECT * FROM song WHERE id = 12 AND title = 'It''s 1'",
+                "SELECT * FROM song WHERE id = ? AND title = ?",
+            ),
+            (
+                "placeholders",
+                'UPDATE "song" SET "title" = %s WHERE "id" = %s',
+                'UPDATE "song" SET "title" = ? WHERE "id" = ?',
+            ),
+            (
+                "in",
+                "SELECT * FROM song WHERE id IN (%s, %s, %s)",
+                "SELECT * FROM song WHERE id IN (...)",
+            ),
+            (
+                "bulk insert",
+                "INSERT INTO song (a, b) VALUES (%s, %s), (%s, %s)",
+                "INSERT INTO song (a, b) VALUES (...)",
+            ),
+            ("savepoint", 'SAVEPOINT "s1404_x22"', "SAVEPOINT ?"),
+            (
+                "identifiers",
+                "SELECT  oauth2.x\n FROM  t1",
+                "SELECT oauth2.x FROM t1",
+            ),
+        ]
+    )
+    def test_fingerprint(self, _, sql, expected):
+        """
+        Tests queries differing only in their values look the same.
+        """
+
+        # Act / Assert
+
+        self.assertEqual(querylog.fingerprint(sql), expected)
+
+
+@override_settings(QUERYLOG_ENABLED=True, QUERYLOG_REPEAT_THRESHOLD=3)
+class QueryLogTest(APITestCase):
+    """
+    Tests tallying the queries made by views and cron jobs.
+    """
+
+    def setUp(self):
+        cache.clear()
+        StationRegistry().forget()
+        querylog.reset()
+        self.addCleanup(querylog.reset)
+
+        self.songs = [
+            Song.objects.create(display_artist="Artist", title=f"Song {index}")
+            for index in range(5)
+        ]
+
+    def scopes(self):
+        """
+        Lists the views and cron jobs with queries tallied.
+        """
+
+        return {scope for (scope, _) in querylog.tallies()}
+
+    def test_view(self):
+        """
+        Tests queries are tallied by view.
+        """
+
+        # Arrange
+
+        user = User.objects.create_user("query", "query@example.com", "Qu3ry!")
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+        # Act
+
+        self.client.get(reverse("song-list"))
+        self.client.get(reverse("song-list"))
+
+        # Assert
+
+        tallies = {
+            query: tally
+            for ((scope, query), tally) in querylog.tallies().items()
+            if scope == "SongViewSet"
+        }
+        self.assertTrue(tallies)
+        self.assertTrue(all(tally.count % 2 == 0 for tally in tallies.values()))
+
+    async def test_async_view(self):
+        """
+        Tests queries made by async views are tallied too.
+        """
+
+        # Arrange
+
+        station = await Station.objects.acreate(
+            name="Query FM",
+            primary_colour="#FFFFFF",
+            text_colour="#FFFFFF",
+            stream_aac_high="https://example.com/stream",
+            stream_aac_low="https://example.com/stream",
+            stream_mp3_high="https://example.com/stream",
+            stream_mp3_low="https://example.com/stream",
+        )
+        await SongPlay.objects.acreate(song=self.songs[0], station=station)
+
+        # Act
+
+        response = await AsyncClient().get(
+            reverse("now_playing_poll", kwargs={"station_name": "Query FM"})
+        )
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("now_playing_poll", self.scopes())
+
+    def test_repeated(self):
+        """
+        Tests repeated queries are flagged, and exact duplicates counted.
+        """
+
+        # Act
+
+        with self.assertLogs("musicstats.querylog", "WARNING") as logs:
+            with querylog.recording("test"):
+                for song in self.songs + self.songs[:2]:
+                    Song.objects.get(pk=song.pk)
+
+        # Assert
+
+        ((_, tally),) = [
+            (query, tally)
+            for ((scope, query), tally) in querylog.tallies().items()
+            if scope == "test"
+        ]
+        self.assertEqual(tally.count, 7)
+        self.assertEqual(tally.duplicates, 2)
+        self.assertEqual(tally.flagged, 1)
+        self.assertEqual(logs.records[0].scope, "test")
+        self.assertEqual(logs.records[0].count, 7)
+
+    def test_cron_job(self):
+        """
+        Tests queries are tallied by cron job.
+        """
+
+        # Act
+
+        EpgUpdater().do()
+
+        # Assert
+
+        self.assertEqual(self.scopes(), {EpgUpdater.code})
+
+    @override_settings(QUERYLOG_ENABLED=False)
+    def test_disabled(self):
+        """
+        Tests nothing is recorded unless enabled.
+        """
+
+        # Act
+
+        with querylog.recording("test"):
+            Station.objects.count()
+        EpgUpdater().do()
+
+        # Assert
+
+        self.assertEqual(self.scopes(), set())
+
+    def test_report(self):
+        """
+        Tests the ranked report adds up every process.
+        """
+
+        # Arrange
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        with open(
+            os.path.join(directory.name, "1.json"), "w", encoding="utf-8"
+        ) as other:
+            json.dump(
+                [["LastFmSongSync", "UPDATE song SET x = ?", 1000, 2.5, 0.01, 0, 1]],
+                other,
+            )
+
+        with querylog.recording("test"):
+            Station.objects.count()
+
+        out = StringIO()
+
+        # Act
+
+        with override_settings(QUERYLOG_DIRECTORY=directory.name):
+            querylog.flush()
+            call_command("query_report", "--order=count", stdout=out)
+
+        # Assert
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            lines[0],
+            "1. LastFmSongSync: 1000 queries, 2500.0ms (max 10.0ms), 0 duplicates, "
+            "N+1 in 1 runs",
+        )
+        self.assertEqual(lines[1], "   UPDATE song SET x = ?")
+        self.assertTrue(lines[2].startswith("2. test: 1 queries"))
+        self.assertTrue(
+            os.path.exists(os.path.join(directory.name, f"{os.getpid()}.json"))
+        )
@@ -0,0 +1,267 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from io import StringIO
+from unittest.mock import patch
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from musicstats.benchmark import benchmark, measure
+from musicstats.ingest import BulkSongPlayLogger
+from musicstats.models import SongPlay, Station
+from musicstats.queueing import InMemoryQueue, SongPlayQueueWorker
+
+IN_MEMORY_QUEUE = {"BACKEND": "musicstats.queueing.InMemoryQueue"}
+
+
+@override_settings(SONG_PLAY_QUEUE=IN_MEMORY_QUEUE)
+class QueuedSongPlayTest(APITestCase):
+    """
+    Tests queueing song plays for a worker to save.
+    """
+
+    username = "queue_user"
+    password = "Qu3u3P@55!"
+    email = "queue@example.com"
+    station_name = "Queue FM"
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Creates a station to log plays against and empties the queue.
+        """
+
+        cache.clear()
+        InMemoryQueue().clear()
+
+        self.user = User.objects.create_user(self.username, self.email, self.password)
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+        self.station = Station(
+            name=self.station_name,
+            primary_colour=self.colour,
+            text_colour=self.colour,
+            stream_aac_high=self.stream_url,
+            stream_aac_low=self.stream_url,
+            stream_mp3_high=self.stream_url,
+            stream_mp3_low=self.stream_url,
+            update_account=self.user,
+        )
+        self.station.save()
+
+    def log(self, title, **kwargs):
+        """
+        Logs a song play.
+        """
+
+        return self.client.post(
+            reverse("song_play_log"),
+            {
+                "song": {
+                    "display_artist": "Queue Artist",
+                    "artists": ["Queue Artist"],
+                    "title": title,
+                },
+                "station": self.station_name,
+            },
+            format="json",
+            **kwargs,
+        )
+
+    def test_queued(self):
+        """
+        Tests song plays are acknowledged straight away and saved in order by
+        the worker.
+        """
+
+        # Act
+
+        responses = [self.log(title) for title in ("One", "Two", "Three")]
+        before = SongPlay.objects.count()
+        call_command("process_song_play_queue", "--once", stdout=StringIO())
+
+        # Assert
+
+        self.assertEqual([response.status_code for response in responses], [202] * 3)
+        self.assertEqual(responses[0].json()["station"], self.station_name)
+        self.assertEqual(before, 0)
+        self.assertEqual(
+            list(
+                SongPlay.objects.order_by("date_time").values_list(
+                    "song__title", flat=True
+                )
+            ),
+            ["One", "Two", "Three"],
+        )
+        self.assertEqual(InMemoryQueue().stations(), [])
+
+    def test_repeats(self):
+        """
+        Tests retries and back to back repeats are only recorded once.
+        """
+
+        # Act
+
+        self.log("One", HTTP_IDEMPOTENCY_KEY="retry-1")
+        self.log("One", HTTP_IDEMPOTENCY_KEY="retry-1")
+        self.log("Two")
+        self.log("Two")
+        SongPlayQueueWorker().run_once()
+
+        # Assert
+
+        self.assertEqual(
+            list(
+                SongPlay.objects.order_by("date_time").values_list(
+                    "song__title", flat=True
+                )
+            ),
+            ["One", "Two"],
+        )
+
+    def test_failure(self):
+        """
+        Tests song plays stay queued until they've been saved.
+        """
+
+        # Arrange
+
+        self.log("One")
+        worker = SongPlayQueueWorker()
+
+        # Act
+
+        with patch.object(BulkSongPlayLogger, "log", side_effect=RuntimeError):
+            failed = worker.run_once()
+
+        retried = worker.run_once()
+
+        # Assert
+
+        self.assertEqual(failed, 0)
+        self.assertEqual(retried, 1)
+        self.assertEqual(SongPlay.objects.count(), 1)
+
+    @override_settings(SONG_PLAY_QUEUE_MAX_ATTEMPTS=2)
+    def test_dead_letter(self):
+        """
+        Tests a play that keeps failing is set aside so the rest get saved.
+        """
+
+        # Arrange
+
+        self.log("One")
+        self.log("Two")
+        self.log("Three")
+        worker = SongPlayQueueWorker()
+        log = BulkSongPlayLogger.log
+
+        def fail_on_two(logger, user, plays):
+            if any(play["song"]["title"] == "Two" for play in plays):
+                raise RuntimeError()
+
+            return log(logger, user, plays)
+
+        # Act
+
+        with patch.object(BulkSongPlayLogger, "log", fail_on_two):
+            for _ in range(3):
+                worker.run_once()
+
+        # Assert
+
+        self.assertEqual(
+            list(
+                SongPlay.objects.order_by("date_time").values_list(
+                    "song__title", flat=True
+                )
+            ),
+            ["One", "Three"],
+        )
+        self.assertEqual(
+            [
+                item["song"]["title"]
+                for (_, item) in InMemoryQueue().dead_letters(self.station.id)
+            ],
+            ["Two"],
+        )
+        self.assertEqual(InMemoryQueue().stations(), [])
+
+    def test_lost_claim(self):
+        """
+        Tests plays are left queued if another worker's taken over the station.
+        """
+
+        # Arrange
+
+        self.log("One")
+
+        # Act
+
+        with patch.object(InMemoryQueue, "extend", return_value=False):
+            processed = SongPlayQueueWorker().run_once()
+
+        # Assert
+
+        self.assertEqual(processed, 0)
+        self.assertEqual(SongPlay.objects.count(), 0)
+        self.assertEqual(InMemoryQueue().stations(), [self.station.id])
+
+    def test_unauthorised(self):
+        """
+        Tests plays are rejected if the user's lost access by the time
+        they're saved.
+        """
+
+        # Arrange
+
+        self.log("One")
+
+        # Act
+
+        self.station.update_account = None
+        self.station.save()
+        processed = SongPlayQueueWorker().run_once()
+
+        # Assert
+
+        self.assertEqual(processed, 1)
+        self.assertEqual(SongPlay.objects.count(), 0)
+
+    @benchmark
+    def test_benchmark_latency(self):
+        """
+        Compares request latency with and without the queue.
+        """
+
+        titles = iter(range(1000000))
+
+        for (name, queue) in [("direct", None), ("queued", IN_MEMORY_QUEUE)]:
+            with override_settings(SONG_PLAY_QUEUE=queue):
+                measure(
+                    f"Log song play ({name})",
+                    lambda _: self.log(f"Song {next(titles)}"),
+                    iterations=200,
+                )
@@ -0,0 +1,186 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from uuid import UUID
+from parameterized import parameterized
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+from django.utils.translation import gettext_lazy
+from musicstats.benchmark import benchmark, measure
+from musicstats.models import Song
+from musicstats.renderers import (
+    JsonResponse,
+    MusicstatsJSONRenderer,
+    dumps,
+    orjson_dumps,
+    stdlib_dumps,
+)
+
+PAYLOAD = {
+    "utc": datetime(2021, 1, 10, 12, 0, 0, tzinfo=timezone.utc),
+    "bst": datetime(2021, 7, 10, 12, 0, 0, 5, tzinfo=timezone(timedelta(hours=1))),
+    "naive": datetime(2021, 7, 10, 12, 0, 0),
+    "date": date(2021, 7, 10),
+    "time": time(9, 30),
+    "decimal": Decimal("1.25"),
+    "uuid": UUID("12345678-1234-5678-1234-567812345678"),
+    "lazy": gettext_lazy("Radio"),
+    "text": "Beyonc\u00e9\u2028\u2029\u266b",
+    "days": {0: ["Monday"], 6: ["Sunday"]},
+    "nothing": None,
+    "list": [1, 2.5, True, False],
+}
+
+
+class RendererTest(APITestCase):
+    """
+    Tests the JSON renderer matches DRF's whichever backend is used.
+    """
+
+    @parameterized.expand([(stdlib_dumps,), (orjson_dumps,)])
+    def test_matches_drf(self, backend):
+        """
+        Tests each backend encodes exactly as DRF's JSONRenderer does.
+        """
+
+        # Act / Assert
+
+        self.assertEqual(backend(PAYLOAD), JSONRenderer().render(PAYLOAD))
+
+    @parameterized.expand([("json",), ("orjson",), (None,)])
+    def test_backend_setting(self, backend):
+        """
+        Tests the backend can be chosen in the settings.
+        """
+
+        # Act
+
+        with override_settings(JSON_BACKEND=backend):
+            rendered = MusicstatsJSONRenderer().render(PAYLOAD)
+
+        # Assert
+
+        self.assertEqual(rendered, JSONRenderer().render(PAYLOAD))
+
+    def test_unknown_backend(self):
+        """
+        Tests we complain about a backend we don't know.
+        """
+
+        # Act / Assert
+
+        with override_settings(JSON_BACKEND="yaml"):
+            with self.assertRaises(ImproperlyConfigured):
+                dumps(PAYLOAD)
+
+    def test_indent(self):
+        """
+        Tests pretty printing still works.
+        """
+
+        # Act
+
+        rendered = MusicstatsJSONRenderer().render(
+            {"a": 1}, "application/json; indent=4"
+        )
+
+        # Assert
+
+        self.assertEqual(rendered, b'{\n    "a": 1\n}')
+
+    @parameterized.expand([(stdlib_dumps,), (orjson_dumps,)])
+    def test_images(self, backend):
+        """
+        Tests images are encoded as their URLs.
+        """
+
+        # Arrange
+
+        song = Song(thumbnail="songs/thumbnails/1_thumb.jpg")
+
+        # Act
+
+        rendered = backend({"thumbnail": song.thumbnail, "image": song.image})
+
+        # Assert
+
+        self.assertEqual(
+            rendered,
+            b'{"thumbnail":"/media/songs/thumbnails/1_thumb.jpg","image":null}',
+        )
+
+    def test_json_response(self):
+        """
+        Tests our JsonResponse behaves like Django's.
+        """
+
+        # Act
+
+        response = JsonResponse({"Error": "Nope."}, status=400)
+
+        # Assert
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.content, b'{"Error":"Nope."}')
+
+        with self.assertRaises(TypeError):
+            JsonResponse([1, 2])
+
+    @benchmark
+    def test_benchmark_renderers(self):
+        """
+        Compares the backends on a large song play list.
+        """
+
+        # Arrange
+
+        song_play = {
+            "song": {
+                "display_artist": "Artist",
+                "artists": ["Artist"],
+                "title": "Title",
+                "thumbnail": "https://example.com/media/thumb.jpg",
+                "image": "https://example.com/media/image.jpg",
+                "musicbrainz_id": "12345678-1234-5678-1234-567812345678",
+                "wiki_content": "Some words about the song. " * 40,
+                "itunes_url": "",
+                "amazon_url": "",
+            },
+            "station": "Benchmark FM",
+            "date_time": "2021-07-10T13:00:00+01:00",
+        }
+        song_plays = [song_play] * 5000
+
+        # Act / Assert
+
+        for (name, backend) in [
+            ("DRF", JSONRenderer().render),
+            ("stdlib", stdlib_dumps),
+            ("orjson", orjson_dumps),
+        ]:
+            measure(
+                f"Render song plays ({name})",
+                lambda _: backend(song_plays),
+                items=len(song_plays),
+            )
@@ -0,0 +1,238 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from datetime import datetime, time, timedelta, timezone
+from parameterized import parameterized
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework.authtoken.models import Token
+from django.contrib.auth.models import User
+from django.urls import reverse
+from musicstats.benchmark import benchmark, measure
+from musicstats.models import Artist, EpgEntry, Song, SongPlay, Station
+from musicstats.representations import (
+    epg_days_data,
+    song_play_data,
+    song_plays_data,
+)
+from musicstats.serializers import EpgEntrySerializer, SongPlaySerializer
+
+
+class RepresentationConformanceTest(APITestCase):
+    """
+    Tests the fast path serialisation matches the DRF serialisers exactly.
+    """
+
+    username = "conformance_user"
+    password = "C0nf0rm!"
+    email = "conformance@example.com"
+    station_name = "Conformance FM"
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Sets up a station with a varied play history and EPG.
+        """
+
+        self.user = User.objects.create_user(self.username, self.email, self.password)
+        self.token = Token.objects.create(user=self.user)
+
+        self.station = Station(
+            name=self.station_name,
+            primary_colour=self.colour,
+            text_colour=self.colour,
+            stream_aac_high=self.stream_url,
+            stream_aac_low=self.stream_url,
+            stream_mp3_high=self.stream_url,
+            stream_mp3_low=self.stream_url,
+            use_liners=False,
+            liner_ratio=0.0,
+        )
+        self.station.save()
+
+        zebra = Artist(name="Zebra")
+        zebra.save()
+        aardvark = Artist(name="Aardvark")
+        aardvark.save()
+
+        pictured = Song(
+            display_artist="Zebra & Aardvark",
+            title="Pictured",
+            thumbnail="songs/thumbnails/1_thumb.jpg",
+            image="songs/images/1_image.jpg",
+            musicbrainz_id="a1b2c3",
+            wiki_content="Some words about the song.",
+            itunes_url="https://example.com/itunes",
+        )
+        pictured.save()
+        pictured.artists.add(zebra, aardvark)
+
+        plain = Song(display_artist="Nobody", title="Plain")
+        plain.save()
+
+        # Winter (GMT), summer (BST) and sub-second play times
+
+        for (song, date_time) in [
+            (pictured, datetime(2021, 1, 10, 12, 0, 0, tzinfo=timezone.utc)),
+            (plain, datetime(2021, 7, 10, 12, 0, 0, tzinfo=timezone.utc)),
+            (pictured, datetime(2021, 7, 10, 12, 3, 30, 123456, tzinfo=timezone.utc)),
+        ]:
+            SongPlay(station=self.station, song=song, date_time=date_time).save()
+
+        for (day, start) in [(0, time(6, 0)), (0, time(9, 30)), (4, time(18, 0))]:
+            EpgEntry(
+                station=self.station,
+                title=f"Show {day} {start}",
+                description="A show.",
+                image="https://example.com/show.jpg",
+                start=start,
+                day=day,
+            ).save()
+
+    def render(self, data) -> bytes:
+        """
+        Renders data as the API would.
+        """
+
+        return JSONRenderer().render(data)
+
+    @parameterized.expand([(True,), (False,)])
+    def test_song_plays(self, with_request):
+        """
+        Tests song plays match SongPlaySerializer, with and without a request.
+        """
+
+        # Arrange
+
+        request = APIRequestFactory().get("/") if with_request else None
+        queryset = SongPlay.objects.filter(station=self.station).order_by("-date_time")
+
+        # Act
+
+        expected = SongPlaySerializer(
+            queryset, many=True, context={"request": request}
+        ).data
+        actual = song_plays_data(queryset, request)
+
+        # Assert
+
+        self.assertEqual(self.render(actual), self.render(expected))
+
+    def test_song_play(self):
+        """
+        Tests a single song play matches SongPlaySerializer.
+        """
+
+        # Arrange
+
+        song_play = SongPlay.objects.order_by("date_time").first()
+
+        # Act / Assert
+
+        self.assertEqual(
+            self.render(song_play_data(song_play)),
+            self.render(SongPlaySerializer(song_play).data),
+        )
+
+    def test_song_play_list(self):
+        """
+        Tests the fast song play list matches the (paged) DRF one.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_recent", kwargs={"station_name": self.station_name})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+        # Act
+
+        fast = self.client.get(url)
+        slow = self.client.get(url, {"page_size": 100})
+
+        # Assert
+
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(len(fast.json()), 3)
+        self.assertEqual(fast.content, self.render(slow.data["results"]))
+
+    def test_epg_days(self):
+        """
+        Tests a week of EPG entries matches EpgEntrySerializer.
+        """
+
+        # Act
+
+        expected = {
+            day: EpgEntrySerializer(
+                EpgEntry.objects.filter(station=self.station, day=day).order_by(
+                    "start"
+                ),
+                many=True,
+            ).data
+            for day in range(0, 7)
+        }
+        actual = epg_days_data(self.station.id)
+
+        # Assert
+
+        self.assertEqual(self.render(actual), self.render(expected))
+
+    @benchmark
+    def test_benchmark_song_plays(self):
+        """
+        Compares the per row cost of the fast and DRF song play serialisation.
+        """
+
+        # Arrange
+
+        song = Song.objects.get(title="Pictured")
+        SongPlay.objects.bulk_create(
+            [
+                SongPlay(
+                    station=self.station,
+                    song=song,
+                    date_time=datetime(2022, 1, 1, tzinfo=timezone.utc)
+                    + timedelta(seconds=index),
+                )
+                for index in range(1000)
+            ]
+        )
+        request = APIRequestFactory().get("/")
+        queryset = SongPlay.objects.filter(station=self.station).order_by("-date_time")
+        rows = queryset.count()
+
+        # Act / Assert
+
+        measure(
+            "Song plays (DRF)",
+            lambda _: SongPlaySerializer(
+                queryset.select_related("song", "station").prefetch_related(
+                    "song__artists"
+                ),
+                many=True,
+                context={"request": request},
+            ).data,
+            items=rows,
+        )
+        measure(
+            "Song plays (fast path)",
+            lambda _: song_plays_data(queryset, request),
+            items=rows,
+        )
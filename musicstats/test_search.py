@@ -0,0 +1,185 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import os
+from rest_framework.test import APITestCase
+from rest_framework.authtoken.models import Token
+from django.contrib.auth.models import User
+from django.urls import reverse
+from musicstats.benchmark import benchmark, measure
+from musicstats.models import Artist, Song
+from musicstats.normalise import artist_match_key, song_match_key
+
+
+class SearchTest(APITestCase):
+    """
+    Tests searching songs and artists.
+    """
+
+    username = "search_user"
+    password = "Se@rch1ng!"
+    email = "search@example.com"
+
+    def setUp(self):
+        """
+        Required setup for the test case.
+        """
+
+        self.user = User.objects.create_user(self.username, self.email, self.password)
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+        for (display_artist, title) in [
+            ("Queen", "Don't Stop Me Now"),
+            ("Queen", "Bohemian Rhapsody"),
+            ("Beyoncé", "Halo"),
+            ("Stopwatch Orchestra", "Ticking"),
+        ]:
+            Song(display_artist=display_artist, title=title).save()
+
+        for name in ["Queen", "Beyoncé", "Queens of the Stone Age"]:
+            Artist(name=name).save()
+
+    def test_search_songs(self):
+        """
+        Tests song results are ranked with the best match first.
+        """
+
+        # Act
+
+        response = self.client.get(reverse("search"), {"q": "dont stop"})
+        songs = response.json()["songs"]
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(songs[0]["title"], "Don't Stop Me Now")
+        self.assertNotIn("wiki_content", songs[0])
+
+    def test_search_artists(self):
+        """
+        Tests artists are found ignoring case and accents.
+        """
+
+        # Act
+
+        response = self.client.get(reverse("search"), {"q": "BEYON"})
+        json_response = response.json()
+
+        # Assert
+
+        self.assertEqual(
+            [artist["name"] for artist in json_response["artists"]], ["Beyoncé"]
+        )
+        self.assertEqual([song["title"] for song in json_response["songs"]], ["Halo"])
+
+    def test_search_limit(self):
+        """
+        Tests the number of results can be limited.
+        """
+
+        # Act
+
+        response = self.client.get(reverse("search"), {"q": "queen", "limit": 1})
+        json_response = response.json()
+
+        # Assert
+
+        self.assertEqual(len(json_response["artists"]), 1)
+        self.assertEqual(json_response["artists"][0]["name"], "Queen")
+        self.assertEqual(len(json_response["songs"]), 1)
+
+    def test_search_no_term(self):
+        """
+        Tests we need something to search for.
+        """
+
+        response = self.client.get(reverse("search"), {"q": " "})
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_bad_limit(self):
+        """
+        Tests the limit must be a number.
+        """
+
+        response = self.client.get(reverse("search"), {"q": "queen", "limit": "lots"})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchBenchmark(APITestCase):
+    """
+    Measures search latency over a large catalogue.
+
+    Set MUSICSTATS_BENCHMARK_SONGS to change the catalogue size (run against
+    Postgres to measure the trigram indexes).
+    """
+
+    username = "search_benchmark"
+    password = "Se@rch1ng!"
+    email = "search@example.com"
+
+    @benchmark
+    def test_benchmark_search(self):
+        """
+        Measures search as you type latency.
+        """
+
+        # Arrange
+
+        user = User.objects.create_user(self.username, self.email, self.password)
+        self.client.force_authenticate(user)
+        song_count = int(os.getenv("MUSICSTATS_BENCHMARK_SONGS", "20000"))
+        batch_size = 5000
+
+        for start in range(0, song_count, batch_size):
+            songs = []
+            for index in range(start, min(start + batch_size, song_count)):
+                display_artist = f"Artist {index % 5000}"
+                title = f"Song Number {index}"
+                songs.append(
+                    Song(
+                        display_artist=display_artist,
+                        title=title,
+                        match_key=song_match_key(display_artist, title),
+                    )
+                )
+            Song.objects.bulk_create(songs)
+
+        Artist.objects.bulk_create(
+            [
+                Artist(
+                    name=f"Artist {index}",
+                    match_key=artist_match_key(f"Artist {index}"),
+                )
+                for index in range(5000)
+            ]
+        )
+
+        # Act / Assert
+        # Simulate typing a query one letter at a time
+
+        query = "song number 1234"
+        url = reverse("search")
+
+        def search(iteration):
+            prefix = query[: 2 + (iteration % (len(query) - 1))]
+            response = self.client.get(url, {"q": prefix})
+            self.assertEqual(response.status_code, 200)
+
+        measure(f"Search over {song_count} songs", search, iterations=50)
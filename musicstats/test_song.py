@@ -22,6 +22,7 @@ from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from django.urls import reverse
+from musicstats.benchmark import benchmark, measure
 from musicstats.models import (
     Artist,
     Song,
@@ -100,3 +101,135 @@ class SongTestCase(APITestCase):
         )
         response = self.client.get(url)
         self.assertEqual(response.status_code, 404)
+
+
+class SongFieldSelectionTestCase(APITestCase):
+    """
+    Tests choosing the fields returned for songs and artists.
+    """
+
+    username = "fields_test"
+    password = "F13ldT3st!"
+    email = "fields@example.com"
+    wiki = "A very long biography. " * 200
+
+    def setUp(self):
+        """
+        Setup auth plus a song and artist with wiki content.
+        """
+
+        self.user = User.objects.create_user(self.username, self.email, self.password)
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+        artist = Artist(name="Wordy Artist", wiki_content=self.wiki)
+        artist.save()
+
+        song = Song(title="Wordy Song", display_artist="Wordy Artist")
+        song.wiki_content = self.wiki
+        song.save()
+        song.artists.add(artist)
+
+    def test_list_is_lean(self):
+        """
+        Tests lists leave out the wiki content by default.
+        """
+
+        # Act
+
+        songs = self.client.get(reverse("song-list")).json()
+        artists = self.client.get(reverse("artist-list")).json()
+
+        # Assert
+
+        self.assertNotIn("wiki_content", songs[0])
+        self.assertEqual(songs[0]["artists"], ["Wordy Artist"])
+        self.assertNotIn("wiki_content", artists[0])
+        self.assertEqual(artists[0]["name"], "Wordy Artist")
+
+    def test_list_expand(self):
+        """
+        Tests the wiki content can be asked for in lists.
+        """
+
+        # Act
+
+        songs = self.client.get(reverse("song-list"), {"expand": "wiki_content"})
+
+        # Assert
+
+        self.assertEqual(songs.json()[0]["wiki_content"], self.wiki)
+
+    def test_fields(self):
+        """
+        Tests only the fields asked for are returned.
+        """
+
+        # Act
+
+        songs = self.client.get(reverse("song-list"), {"fields": "title,artists"})
+        song = self.client.get(
+            reverse("song-detail", kwargs={"song": "Wordy Artist - Wordy Song"}),
+            {"fields": "title, wiki_content"},
+        )
+
+        # Assert
+
+        self.assertEqual(
+            songs.json(), [{"artists": ["Wordy Artist"], "title": "Wordy Song"}]
+        )
+        self.assertEqual(
+            song.json(), {"title": "Wordy Song", "wiki_content": self.wiki}
+        )
+
+    def test_detail_is_full(self):
+        """
+        Tests a single song still comes with its wiki content.
+        """
+
+        # Act
+
+        song = self.client.get(
+            reverse("song-detail", kwargs={"song": "Wordy Artist - Wordy Song"})
+        )
+
+        # Assert
+
+        self.assertEqual(song.json()["wiki_content"], self.wiki)
+
+    @benchmark
+    def test_benchmark_lean_list(self):
+        """
+        Compares the size and speed of lean and full song lists.
+        """
+
+        # Arrange
+
+        songs = Song.objects.bulk_create(
+            [
+                Song(
+                    title=f"Song {index}",
+                    display_artist="Wordy Artist",
+                    wiki_content=self.wiki,
+                )
+                for index in range(1000)
+            ]
+        )
+        artist = Artist.objects.get()
+        Song.artists.through.objects.bulk_create(
+            [
+                Song.artists.through(song_id=song.id, artist_id=artist.id)
+                for song in songs
+            ]
+        )
+        url = reverse("song-list")
+
+        # Act / Assert
+
+        for (name, params) in [("lean", {}), ("full", {"expand": "wiki_content"})]:
+            size = len(self.client.get(url, params).content)
+            measure(
+                f"Song list ({name}, {size} bytes)",
+                lambda _: self.client.get(url, params),
+                items=len(songs),
+            )
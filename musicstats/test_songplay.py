@@ -18,13 +18,17 @@
 """
 
 import json
-from datetime import datetime, time
+from datetime import datetime, time, timedelta, timezone
 from parameterized import parameterized
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
 from django.urls import reverse
-from musicstats.models import Station
+from musicstats.benchmark import benchmark, measure
+from musicstats.ingest import derive_idempotency_key
+from musicstats.models import Artist, Song, SongPlay, Station
 
 
 class LogSongplayTest(APITestCase):
@@ -275,6 +279,166 @@ class LogSongplayTest(APITestCase):
         response = self.client.post(url, songplays[1], format="json")
         self.assertEqual(response.status_code, 200)
 
+    def test_log_songplay_timestamp(self):
+        """
+        Tests the time supplied by the client is kept (and not rewritten).
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.valid_token}")
+        played = datetime(2021, 11, 26, 19, 32, 0, tzinfo=timezone.utc)
+        songplay = {
+            "song": {
+                "display_artist": "Timely Artist",
+                "artists": ["Timely Artist"],
+                "title": "On The Dot",
+            },
+            "station": self.station_name,
+            "date_time": played.isoformat(),
+        }
+
+        # Act
+
+        response = self.client.post(url, songplay, format="json")
+        song_play = SongPlay.objects.get(song__title="On The Dot")
+        song_play.save()
+        song_play.refresh_from_db()
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(song_play.date_time, played)
+        self.assertGreater(song_play.received, played)
+
+    def test_log_songplay_backfill(self):
+        """
+        Tests plays logged late slot into history rather than becoming now playing.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.valid_token}")
+        now = datetime.now(timezone.utc)
+
+        def songplay(title, minutes_ago):
+            return {
+                "song": {
+                    "display_artist": "Backfill Artist",
+                    "artists": [],
+                    "title": title,
+                },
+                "station": self.station_name,
+                "date_time": (now - timedelta(minutes=minutes_ago)).isoformat(),
+            }
+
+        # Act
+
+        responses = [
+            self.client.post(url, songplay("Song C", 0), format="json"),
+            self.client.post(url, songplay("Song A", 10), format="json"),
+            self.client.post(url, songplay("Song B", 5), format="json"),
+            self.client.post(url, songplay("Song B", 4), format="json"),
+        ]
+
+        # Assert
+
+        self.assertEqual(
+            [response.status_code for response in responses], [200, 200, 200, 400]
+        )
+        self.assertEqual(
+            list(
+                SongPlay.objects.order_by("-date_time").values_list(
+                    "song__title", flat=True
+                )
+            ),
+            ["Song C", "Song B", "Song A"],
+        )
+
+    def test_idempotency_key_retry(self):
+        """
+        Tests a retried request with an idempotency key is a no-op.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.valid_token}")
+        songplay = {
+            "song": {
+                "display_artist": "Retry Artist",
+                "artists": ["Retry Artist"],
+                "title": "Try Again",
+            },
+            "station": self.station_name,
+        }
+
+        # Act
+
+        first = self.client.post(
+            url, songplay, format="json", HTTP_IDEMPOTENCY_KEY="play-1"
+        )
+        retry = self.client.post(
+            url, songplay, format="json", HTTP_IDEMPOTENCY_KEY="play-1"
+        )
+        cache.clear()
+        late_retry = self.client.post(
+            url, dict(songplay, idempotency_key="play-1"), format="json"
+        )
+
+        # Assert
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(late_retry.status_code, 200)
+        self.assertEqual(json.loads(retry.content), json.loads(first.content))
+        self.assertEqual(json.loads(late_retry.content), json.loads(first.content))
+        self.assertEqual(SongPlay.objects.count(), 1)
+
+    def test_concurrent_duplicate(self):
+        """
+        Tests the database rejects the same play from two playout systems at once.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.valid_token}")
+
+        def songplay(title):
+            return {
+                "song": {
+                    "display_artist": "Racing Artist",
+                    "artists": [],
+                    "title": title,
+                },
+                "station": self.station_name,
+            }
+
+        self.client.post(url, songplay("Song A"), format="json")
+        first_play = SongPlay.objects.get()
+
+        # The other playout system got Song B in first
+        # We've not heard about it yet
+
+        song = Song.objects.create(display_artist="Racing Artist", title="Song B")
+        SongPlay.objects.create(
+            station=first_play.station,
+            song=song,
+            idempotency_key=derive_idempotency_key(song.id, None, first_play.id),
+        )
+
+        # Act
+
+        response = self.client.post(url, songplay("Song B"), format="json")
+
+        # Assert
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(SongPlay.objects.count(), 2)
+
     def test_invalid_songplay(self):
         """
         Checks invalid songplays don't get logged.
@@ -459,3 +623,330 @@ class RetrieveSongPlay(APITestCase):
 
         response = self.client.get(url)
         self.assertEqual(response.status_code, 400)
+
+
+class BulkLogSongPlayTest(APITestCase):
+    """
+    Tests logging song plays in bulk.
+    """
+
+    username = "bulk_station_user"
+    password = "P@55w0rd!"
+    email = "bulk@user.creds"
+    other_username = "other_station_user"
+    other_email = "other@user.creds"
+    station_name = "Bulk FM"
+    other_station_name = "Other FM"
+    station_slogan = "All the hits at once."
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Required setup for the test case.
+        """
+
+        self.user = User.objects.create_user(self.username, self.email, self.password)
+        other_user = User.objects.create_user(
+            self.other_username, self.other_email, self.password
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+        for (name, user) in [
+            (self.station_name, self.user),
+            (self.other_station_name, other_user),
+        ]:
+            Station(
+                name=name,
+                slogan=self.station_slogan,
+                primary_colour=self.colour,
+                text_colour=self.colour,
+                stream_aac_high=self.stream_url,
+                stream_aac_low=self.stream_url,
+                stream_mp3_high=self.stream_url,
+                stream_mp3_low=self.stream_url,
+                use_liners=True,
+                liner_ratio=0.1,
+                update_account=user,
+            ).save()
+
+    def _songplay(self, title, artists=None, station=None):
+        """
+        Builds a song play for submission.
+        """
+
+        return {
+            "song": {
+                "display_artist": "Bulk Artist",
+                "artists": ["Bulk Artist"] if artists is None else artists,
+                "title": title,
+            },
+            "station": station or self.station_name,
+        }
+
+    def test_log_bulk(self):
+        """
+        Tests we can log a batch of song plays with per item results.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log_bulk")
+        songplays = [
+            self._songplay("Song A"),
+            self._songplay("Song B", artists=[]),
+            self._songplay("Song B", artists=[]),
+            {"song": {"display_artist": "Bulk Artist"}, "station": self.station_name},
+            self._songplay("Song C", station="Nowhere FM"),
+            self._songplay("Song D", station=self.other_station_name),
+            self._songplay("Song A"),
+        ]
+
+        # Act
+
+        response = self.client.post(url, songplays, format="json")
+        json_response = json.loads(response.content)
+
+        # Assert
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json_response["created"], 3)
+        self.assertEqual(
+            [result["result"] for result in json_response["results"]],
+            [
+                "created",
+                "created",
+                "duplicate",
+                "invalid",
+                "unknown_station",
+                "unauthorised",
+                "created",
+            ],
+        )
+        self.assertEqual(
+            [result["index"] for result in json_response["results"]],
+            list(range(len(songplays))),
+        )
+
+        # Song A was only created once and kept its artist
+
+        self.assertEqual(Song.objects.filter(title="Song A").count(), 1)
+        self.assertEqual(
+            list(
+                Song.objects.get(title="Song A").artists.values_list("name", flat=True)
+            ),
+            ["Bulk Artist"],
+        )
+        self.assertEqual(Artist.objects.filter(name="Bulk Artist").count(), 1)
+        self.assertEqual(
+            SongPlay.objects.filter(station__name=self.station_name).count(), 3
+        )
+
+    def test_log_bulk_matches_existing(self):
+        """
+        Tests bulk logging re-uses existing songs and spots repeats of the last play.
+        """
+
+        # Arrange
+
+        self.client.post(
+            reverse("song_play_log"), self._songplay("Song A"), format="json"
+        )
+        url = reverse("song_play_log_bulk")
+
+        # Act
+
+        response = self.client.post(
+            url, [self._songplay("Song A"), self._songplay("Song B")], format="json"
+        )
+        json_response = json.loads(response.content)
+
+        # Assert
+
+        self.assertEqual(
+            [result["result"] for result in json_response["results"]],
+            ["duplicate", "created"],
+        )
+        self.assertEqual(Song.objects.filter(title="Song A").count(), 1)
+
+    def test_log_bulk_out_of_order(self):
+        """
+        Tests bulk plays are ordered by the time they were played.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log_bulk")
+        now = datetime.now(timezone.utc)
+        self.client.post(
+            reverse("song_play_log"),
+            dict(self._songplay("Song B"), date_time=(now - timedelta(minutes=20))),
+            format="json",
+        )
+
+        songplays = [
+            dict(self._songplay(title), date_time=now - timedelta(minutes=minutes))
+            for (title, minutes) in [
+                ("Song C", 10),
+                ("Song A", 30),
+                ("Song B", 25),
+                ("Song B", 15),
+            ]
+        ]
+
+        # Act
+
+        response = self.client.post(url, songplays, format="json")
+        json_response = json.loads(response.content)
+
+        # Assert
+
+        self.assertEqual(
+            [result["result"] for result in json_response["results"]],
+            ["created", "created", "duplicate", "duplicate"],
+        )
+        self.assertEqual(
+            list(
+                SongPlay.objects.order_by("-date_time").values_list(
+                    "song__title", flat=True
+                )
+            ),
+            ["Song C", "Song B", "Song A"],
+        )
+
+    def test_log_bulk_before_repeat(self):
+        """
+        Tests a late play is dropped when it repeats the play after it.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log_bulk")
+        now = datetime.now(timezone.utc)
+        self.client.post(
+            reverse("song_play_log"),
+            dict(self._songplay("Song A"), date_time=(now - timedelta(minutes=5))),
+            format="json",
+        )
+
+        # Act
+
+        response = self.client.post(
+            url,
+            [dict(self._songplay("Song A"), date_time=now - timedelta(minutes=10))],
+            format="json",
+        )
+        json_response = json.loads(response.content)
+
+        # Assert
+
+        self.assertEqual(json_response["results"][0]["result"], "duplicate")
+        self.assertEqual(SongPlay.objects.count(), 1)
+
+    def test_log_before_repeat(self):
+        """
+        Tests a late single play is rejected when it repeats the play after it.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log")
+        now = datetime.now(timezone.utc)
+        for (title, minutes) in [("Song A", 10), ("Song B", 0)]:
+            self.client.post(
+                url,
+                dict(self._songplay(title), date_time=now - timedelta(minutes=minutes)),
+                format="json",
+            )
+
+        # Act
+
+        response = self.client.post(
+            url,
+            dict(self._songplay("Song B"), date_time=now - timedelta(minutes=5)),
+            format="json",
+        )
+
+        # Assert
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            list(
+                SongPlay.objects.order_by("-date_time").values_list(
+                    "song__title", flat=True
+                )
+            ),
+            ["Song B", "Song A"],
+        )
+
+    def test_log_bulk_retry(self):
+        """
+        Tests retrying a batch doesn't record the plays twice.
+        """
+
+        # Arrange
+
+        url = reverse("song_play_log_bulk")
+        now = datetime.now(timezone.utc)
+        songplays = [
+            dict(self._songplay("Song A"), date_time=now - timedelta(minutes=5)),
+            dict(self._songplay("Song B"), idempotency_key="song-b"),
+        ]
+
+        # Act
+
+        first = json.loads(self.client.post(url, songplays, format="json").content)
+        retry = json.loads(self.client.post(url, songplays, format="json").content)
+
+        # Assert
+
+        self.assertEqual(first["created"], 2)
+        self.assertEqual(retry["created"], 0)
+        self.assertEqual(
+            [result["result"] for result in retry["results"]],
+            ["duplicate", "duplicate"],
+        )
+        self.assertEqual(SongPlay.objects.count(), 2)
+
+    def test_log_bulk_not_list(self):
+        """
+        Checks we reject anything that isn't a list of song plays.
+        """
+
+        url = reverse("song_play_log_bulk")
+        response = self.client.post(url, self._songplay("Song A"), format="json")
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(SONG_PLAY_BATCH_LIMIT=1)
+    def test_log_bulk_limit(self):
+        """
+        Checks we reject batches over the size limit.
+        """
+
+        url = reverse("song_play_log_bulk")
+        songplays = [self._songplay("Song A"), self._songplay("Song B")]
+        response = self.client.post(url, songplays, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(SongPlay.objects.count(), 0)
+
+    @benchmark
+    def test_benchmark_log_bulk(self):
+        """
+        Measures bulk logging throughput.
+        """
+
+        url = reverse("song_play_log_bulk")
+        batch_size = 1000
+
+        def log_batch(iteration):
+            songplays = [
+                self._songplay(
+                    f"Song {iteration}-{index}", artists=[f"Artist {index % 50}"]
+                )
+                for index in range(batch_size)
+            ]
+            response = self.client.post(url, songplays, format="json")
+            self.assertEqual(response.status_code, 200)
+
+        measure("Bulk song play logging", log_batch, iterations=5, items=batch_size)
@@ -21,11 +21,14 @@ import json
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
+from django.http import Http404
+from django.test import override_settings
 from django.urls import reverse
 from musicstats.models import (
     Station,
     MarketingLiner,
 )
+from musicstats.registry import StationRegistry
 
 
 class StationTestCase(APITestCase):
@@ -148,3 +151,104 @@ class MarketingLinerTestCase(APITestCase):
 
         for index, liner in enumerate(liners):
             self.assertEqual(json_response[index]["line"], liner)
+
+
+class StationRegistryTestCase(APITestCase):
+    """
+    Tests the station lookup cache.
+    """
+
+    station_name = "Registry FM"
+    colour = "#FFFFFF"
+    stream_url = "https://example.com/stream"
+
+    def setUp(self):
+        """
+        Create a station to look up.
+        """
+
+        self.station = Station(
+            name=self.station_name,
+            primary_colour=self.colour,
+            text_colour=self.colour,
+            stream_aac_high=self.stream_url,
+            stream_aac_low=self.stream_url,
+            stream_mp3_high=self.stream_url,
+            stream_mp3_low=self.stream_url,
+        )
+        self.station.save()
+
+    def test_cached(self):
+        """
+        Tests repeat lookups don't touch the database.
+        """
+
+        # Arrange
+
+        registry = StationRegistry()
+        registry.get(self.station_name)
+
+        # Act / Assert
+
+        with self.assertNumQueries(0):
+            station = registry.get(self.station_name)
+            self.assertEqual(station.id, self.station.id)
+            self.assertEqual(
+                StationRegistry().get_many([self.station_name, self.station_name]),
+                {self.station_name: station},
+            )
+
+    def test_rename(self):
+        """
+        Tests renaming a station is picked up straight away.
+        """
+
+        # Arrange
+
+        registry = StationRegistry()
+        registry.get(self.station_name)
+
+        # Act
+
+        self.station.name = "Renamed FM"
+        self.station.save()
+
+        # Assert
+
+        self.assertIsNone(registry.get(self.station_name))
+        self.assertEqual(registry.get("Renamed FM").id, self.station.id)
+
+    def test_delete(self):
+        """
+        Tests removed stations are no longer found.
+        """
+
+        # Arrange
+
+        registry = StationRegistry()
+        registry.get(self.station_name)
+
+        # Act
+
+        self.station.delete()
+
+        # Assert
+
+        with self.assertRaises(Http404):
+            registry.get_or_404(self.station_name)
+
+    @override_settings(STATION_CACHE_TTL=0)
+    def test_expiry(self):
+        """
+        Tests stations are looked up again once they've expired.
+        """
+
+        # Arrange
+
+        registry = StationRegistry()
+        registry.get(self.station_name)
+
+        # Act / Assert
+
+        with self.assertNumQueries(1):
+            registry.get(self.station_name)
@@ -0,0 +1,182 @@
+"""
+    Radio Music Stats - Radio Music Statistics and Now Playing
+    Copyright (C) 2017-2021 Marc Steele
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from musicstats.models import Artist, EpgEntry, Song, SongPlay, Station
+from musicstats.synthetic import SyntheticCatalogue, chunks, zipf_weights
+
+END = datetime(2021, 7, 10, 13, tzinfo=dt_timezone.utc)
+
+
+def generate(seed=1, chunk_size=100):
+    """
+    Generates a small synthetic catalogue.
+    """
+
+    catalogue = SyntheticCatalogue(seed=seed, chunk_size=chunk_size, end=END)
+    catalogue.create_stations(3)
+    catalogue.create_artists(50)
+    catalogue.create_songs(200)
+    catalogue.create_plays(3000)
+    return catalogue
+
+
+def plays():
+    """
+    Lists every song play's station, song title and time.
+    """
+
+    return list(
+        SongPlay.objects.order_by("station__name", "-date_time").values_list(
+            "station__name", "song__title", "date_time"
+        )
+    )
+
+
+class SyntheticCatalogueTest(TestCase):
+    """
+    Tests generating synthetic data for load testing.
+    """
+
+    def test_generate(self):
+        """
+        Tests everything is created in the numbers asked for.
+        """
+
+        # Act
+
+        generate()
+
+        # Assert
+
+        self.assertEqual(Station.objects.count(), 3)
+        self.assertEqual(Artist.objects.count(), 50)
+        self.assertEqual(Song.objects.count(), 200)
+        self.assertEqual(SongPlay.objects.count(), 3000)
+        self.assertEqual(
+            set(EpgEntry.objects.values_list("station__name", "day").distinct()),
+            {(f"Synthetic {index}", day) for index in (1, 2, 3) for day in range(7)},
+        )
+        self.assertFalse(Song.objects.filter(artists=None).exists())
+
+    def test_deterministic(self):
+        """
+        Tests the same seed gives the same plays, however they're chunked.
+        """
+
+        # Arrange
+
+        generate(chunk_size=100)
+        first = plays()
+        SongPlay.objects.all().delete()
+        Song.objects.all().delete()
+        Artist.objects.all().delete()
+        Station.objects.all().delete()
+
+        # Act
+
+        generate(chunk_size=70)
+
+        # Assert
+
+        self.assertEqual(plays(), first)
+
+    def test_popularity(self):
+        """
+        Tests a few songs get most of the plays.
+        """
+
+        # Act
+
+        generate()
+
+        # Assert
+
+        counts = sorted(
+            Counter(SongPlay.objects.values_list("song_id", flat=True)).values(),
+            reverse=True,
+        )
+        self.assertGreater(sum(counts[:20]), 1500)
+
+    def test_cadence(self):
+        """
+        Tests each station plays a song every few minutes, up to the end.
+        """
+
+        # Act
+
+        generate()
+
+        # Assert
+
+        for station in Station.objects.all():
+            times = list(
+                SongPlay.objects.filter(station=station)
+                .order_by("-date_time")
+                .values_list("date_time", flat=True)
+            )
+            gaps = [earlier - later for (earlier, later) in zip(times, times[1:])]
+
+            self.assertLessEqual(times[0], END)
+            self.assertGreater(times[0], END - timedelta(minutes=5))
+            self.assertGreaterEqual(min(gaps), timedelta(minutes=2, seconds=24))
+            self.assertLessEqual(max(gaps), timedelta(minutes=4, seconds=48))
+
+    def test_command(self):
+        """
+        Tests the management command, which refuses to run twice.
+        """
+
+        # Arrange
+
+        arguments = [
+            "generate_synthetic_data",
+            "--stations=2",
+            "--artists=10",
+            "--songs=20",
+            "--plays=100",
+            "--end=2021-07-10T13:00:00",
+        ]
+        out = StringIO()
+
+        # Act
+
+        call_command(*arguments, stdout=out)
+
+        # Assert
+
+        self.assertIn("Created 100 song plays.", out.getvalue())
+        self.assertEqual(SongPlay.objects.count(), 100)
+        with self.assertRaises(CommandError):
+            call_command(*arguments, stdout=StringIO())
+
+    def test_helpers(self):
+        """
+        Tests chunking and the Zipf weights.
+        """
+
+        # Act / Assert
+
+        self.assertEqual(list(chunks(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(zipf_weights(3, 1), [1, 1.5, 1.5 + 1 / 3])
@@ -27,13 +27,19 @@ from musicstats.views import (
     SongViewSet,
     index,
     log_song_play,
+    log_song_plays,
     StationViewSet,
     EpgCurrent,
     SongPlayList,
     MarketingLinerList,
     EpgDay,
     PresenterList,
+    NowPlayingDashboard,
     NowPlayingPlain,
+    now_playing_poll,
+    prometheus_metrics,
+    now_playing_stream,
+    Search,
 )
 
 # Router for REST API
@@ -47,6 +53,8 @@ router.register(r"station", StationViewSet)
 urlpatterns = [
     re_path(r"^$", index, name="index"),
     re_path(r"^admin/", admin.site.urls),
+    re_path(r"^metrics/?$", prometheus_metrics, name="metrics"),
+    re_path(r"^api/logsongplay/bulk/?", log_song_plays, name="song_play_log_bulk"),
     re_path(r"^api/logsongplay/?", log_song_play, name="song_play_log"),
     re_path(
         r"^api/songplay/(?P<station_name>[^/.]+)/(?P<start_time>[0-9]+)/(?P<end_time>[0-9]+)/?",
@@ -74,10 +82,24 @@ urlpatterns = [
         PresenterList.as_view(),
         name="presenters",
     ),
+    re_path(
+        r"^api/nowplaying/?$", NowPlayingDashboard.as_view(), name="now_playing_all"
+    ),
+    re_path(
+        r"^api/nowplaying/(?P<station_name>[^/.]+)/poll/?$",
+        now_playing_poll,
+        name="now_playing_poll",
+    ),
+    re_path(
+        r"^api/nowplaying/(?P<station_name>[^/.]+)/stream/?$",
+        now_playing_stream,
+        name="now_playing_stream",
+    ),
     re_path(
         r"^api/nowplaying/(?P<station_name>[^/.]+)/?",
         NowPlayingPlain.as_view(),
         name="now_playing_plain",
     ),
+    re_path(r"^api/search/?$", Search.as_view(), name="search"),
     re_path(r"^api/", include(router.urls)),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
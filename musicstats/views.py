@@ -18,23 +18,57 @@
 """
 
 from datetime import datetime, time
-from asgiref.sync import async_to_sync
-from django.http import HttpResponse, JsonResponse, Http404
-from django.shortcuts import get_object_or_404
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import (
+    HttpResponse,
+    HttpResponseNotModified,
+    Http404,
+    StreamingHttpResponse,
+)
 from django.utils import timezone
-from rest_framework.decorators import api_view
+from django.utils.crypto import constant_time_compare
+from rest_framework.authentication import (
+    SessionAuthentication,
+    TokenAuthentication,
+)
+from rest_framework.decorators import api_view, authentication_classes
 from rest_framework.parsers import JSONParser
 from rest_framework.permissions import AllowAny
 from rest_framework.exceptions import ValidationError
 from rest_framework import viewsets, generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from channels.layers import get_channel_layer
+from musicstats import metrics
+from musicstats.authentication import AuthenticationCache, CachedBasicAuthentication
+from musicstats.broadcast import broadcast_now_playing
+from musicstats.normalise import song_match_key
+from musicstats.queueing import get_queue, queue_item
+from musicstats.registry import StationRegistry
+from musicstats.renderers import JsonResponse
+from musicstats.representations import (
+    epg_days_data,
+    now_playing_data,
+    song_play_data,
+    song_plays_data,
+)
+from musicstats.search import CatalogueSearch
+from musicstats.streaming import current_play, now_playing_events, wait_for_play
+from musicstats.ingest import (
+    BulkSongPlayLogger,
+    IdempotentResponses,
+    SongResolver,
+    derive_idempotency_key,
+    latest_play,
+)
 from musicstats.serializers import (
     SongPlaySerializer,
     SimpleSongPlaySerializer,
     ArtistSerializer,
+    ArtistSearchSerializer,
     SongSerializer,
+    SongSearchSerializer,
     StationSerializer,
     EpgEntrySerializer,
     MarketingLinerSerializer,
@@ -50,6 +84,67 @@ from musicstats.models import (
     Presenter,
 )
 
+# Mixins
+
+
+class FieldSelectionViewMixin:
+    """
+    Lets clients choose the fields returned with ?fields= and ?expand=.
+
+    Lists leave out heavy fields (e.g. wiki content) unless they're asked
+    for, and don't load them from the database either.
+    """
+
+    listing = False
+
+    def _query_list(self, name):
+        """
+        Reads a comma separated list from the query string.
+        """
+
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+
+        return [item.strip() for item in value.split(",") if item.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs["fields"] = self._query_list("fields")
+        kwargs["expand"] = self._query_list("expand")
+        kwargs["lean"] = kwargs.get("many", False)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+
+        if not self.listing:
+            return queryset
+
+        # Don't load heavy fields we're not going to send
+
+        fields = self._query_list("fields")
+        wanted = set(fields if fields is not None else self._query_list("expand") or ())
+        unwanted = [
+            name
+            for name in getattr(self.get_serializer_class().Meta, "heavy_fields", ())
+            if name not in wanted
+        ]
+
+        return queryset.defer(*unwanted) if unwanted else queryset
+
+    def list(self, request, *args, **kwargs):
+        self.listing = True
+        return super().list(request, *args, **kwargs)
+
+
+# Ingestion requests come in often, so we remember who's already signed in
+
+INGEST_AUTHENTICATION = [
+    CachedBasicAuthentication,
+    SessionAuthentication,
+    TokenAuthentication,
+]
+
 # Placeholder
 
 
@@ -60,7 +155,24 @@ def index(request):
     return HttpResponse("Hello from the musicstats index.")
 
 
+def prometheus_metrics(request):
+    """
+    Serves our metrics in the Prometheus text format.
+    """
+
+    if settings.METRICS_TOKEN and not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        return HttpResponse(status=401)
+
+    return HttpResponse(
+        metrics.render(metrics.cron_job_metrics()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
 @api_view(http_method_names=["POST", "PUT"])
+@authentication_classes(INGEST_AUTHENTICATION)
 def log_song_play(request):
     """
     Logs a song play.
@@ -75,7 +187,7 @@ def log_song_play(request):
 
         # Obtain the station
 
-        station = Station.objects.filter(name=serializer.data["station"]).first()
+        station = StationRegistry().get(serializer.data["station"])
         if not station:
             return JsonResponse(
                 {"Error": "Failed to find a matching station for the request."},
@@ -84,103 +196,195 @@ def log_song_play(request):
 
         # Check the current user is allowed to make updates
 
-        update_account = station.update_account
-        if (not update_account) or (update_account.id != request.user.id):
+        if station.id not in AuthenticationCache().stations(request.user.id):
             return JsonResponse(
                 {"Error": "Not authenticated to make this request."}, status=401
             )
 
-        # Search for an existing song
+        # Retries of a request we've already handled are a no-op
 
-        song_query = Song.objects.filter(title=serializer.data["song"]["title"])
+        idempotency_key = request.headers.get(
+            "Idempotency-Key"
+        ) or serializer.validated_data.get("idempotency_key")
+        idempotent_responses = IdempotentResponses()
 
-        if serializer.data["song"]["artists"]:
-            for artist in serializer.data["song"]["artists"]:
-                song_query = song_query.filter(artists__name=artist)
-        else:
-            song_query = song_query.filter(
-                display_artist=serializer.data["song"]["display_artist"]
+        if idempotency_key:
+            previous_response = idempotent_responses.get(station.id, idempotency_key)
+            if previous_response:
+                return JsonResponse(previous_response, status=200, safe=False)
+
+        # Leave it to the worker if we're queueing song plays
+        # Stamping the time now means replays can't record it twice
+
+        song_play_queue = get_queue()
+        if song_play_queue:
+            play = dict(serializer.validated_data)
+            play["date_time"] = play.get("date_time") or timezone.now()
+            play["idempotency_key"] = idempotency_key
+            entry_id = song_play_queue.push(station.id, queue_item(request.user, play))
+            return JsonResponse(
+                {"queued": entry_id, "station": station.name}, status=202
             )
 
-        # Build a new song if we have to
+        # Search for an existing song (or build a new one)
 
-        if not song_query:
+        (song, _) = SongResolver().resolve(serializer.data["song"])
 
-            # Get the basics in place
+        # Plays are recorded at the time the client says they happened
+        # This lets playout systems backfill after an outage
 
-            song = Song()
-            song.title = serializer.data["song"]["title"]
-            song.display_artist = serializer.data["song"]["display_artist"]
-            song.save()
+        client_date_time = serializer.validated_data.get("date_time")
+        date_time = client_date_time or timezone.now()
 
-            # Flesh out the artists
+        next_play = None
 
-            for artist in serializer.data["song"]["artists"]:
+        if client_date_time:
+            plays = SongPlay.objects.filter(station=station).values(
+                "id", "song_id", "date_time"
+            )
+            previous_play = (
+                plays.filter(date_time__lte=date_time).order_by("-date_time").first()
+            )
+            next_play = (
+                plays.filter(date_time__gt=date_time).order_by("date_time").first()
+            )
+        else:
+            previous_play = latest_play(station.id)
+
+        # Check we're not matching the previous (or for a late play, the next)
+        # song
+        # It could be a retry we've forgotten about
+
+        if any(
+            play and song.id == play["song_id"] for play in (previous_play, next_play)
+        ):
+            retried_play = (
+                SongPlay.objects.filter(
+                    station=station, idempotency_key=idempotency_key
+                ).first()
+                if idempotency_key
+                else None
+            )
 
-                # Try for the artist in the database
+            if not retried_play:
+                return JsonResponse(
+                    {"Error": "This song play has already been recorded."}, status=400
+                )
 
-                artist_query = Artist.objects.filter(name=artist)
-                if not artist_query:
+            payload = song_play_data(retried_play)
+            idempotent_responses.remember(station.id, idempotency_key, payload)
+            return JsonResponse(payload, status=200, safe=False)
 
-                    # Create the new artist
+        # Now create and save the song play
+        # The database rejects a play with a key it's already seen
 
-                    new_artist = Artist()
-                    new_artist.name = artist
-                    new_artist.save()
-                    song.artists.add(new_artist)
+        song_play = SongPlay()
+        song_play.station = station
+        song_play.song = song
+        song_play.date_time = date_time
+        song_play.idempotency_key = idempotency_key or derive_idempotency_key(
+            song.id,
+            client_date_time,
+            previous_play["id"] if previous_play else None,
+        )
 
-                else:
+        try:
+            with transaction.atomic():
+                song_play.save()
+        except IntegrityError:
+            if not idempotency_key:
+                return JsonResponse(
+                    {"Error": "This song play has already been recorded."}, status=400
+                )
 
-                    # Add the existing artist to the list
+            song_play = SongPlay.objects.get(
+                station=station, idempotency_key=idempotency_key
+            )
+            payload = song_play_data(song_play)
+            idempotent_responses.remember(station.id, idempotency_key, payload)
+            return JsonResponse(payload, status=200, safe=False)
 
-                    song.artists.add(artist_query.first())
+        payload = song_play_data(song_play)
 
-            # Save the song
+        if idempotency_key:
+            idempotent_responses.remember(station.id, idempotency_key, payload)
 
-            song.save()
+        # Inform websocket listeners (unless we're filling in history)
 
-        else:
+        if (not client_date_time) or not SongPlay.objects.filter(
+            station=station, date_time__gt=date_time
+        ).exists():
+            broadcast_now_playing(station.id, payload, song_play.id)
 
-            # Only grab the first song
+        # Let the user know we're successful - send the song back
 
-            song = song_query.first()
+        return JsonResponse(payload, status=200, safe=False)
 
-            # Check we're not matching the previous song
+    else:
+        return JsonResponse(serializer.errors, status=400)
 
-            last_songplay = (
-                SongPlay.objects.filter(station=station).order_by("-date_time").first()
-            )
 
-            if last_songplay and song.id == last_songplay.song.id:
-                return JsonResponse(
-                    {"Error": "This song play has already been recorded."}, status=400
-                )
+@api_view(http_method_names=["POST"])
+@authentication_classes(INGEST_AUTHENTICATION)
+def log_song_plays(request):
+    """
+    Logs a batch of song plays (e.g. those buffered during an outage).
+    """
 
-        # Now create and save the song play
+    # Pull in the song plays
 
-        song_play = SongPlay()
-        song_play.station = station
-        song_play.song = song
-        song_play.save()
-        song_play_serial = SongPlaySerializer(song_play)
+    data = JSONParser().parse(request)
 
-        # Inform websocket listeners
+    if not isinstance(data, list):
+        return JsonResponse(
+            {"Error": "Expected a list of song plays."},
+            status=400,
+        )
 
-        layer = get_channel_layer()
-        async_to_sync(layer.group_send)(
-            f"nowplaying_{station.id}",
-            {"type": "now_playing", "message": song_play_serial.data},
+    if len(data) > settings.SONG_PLAY_BATCH_LIMIT:
+        return JsonResponse(
+            {
+                "Error": f"No more than {settings.SONG_PLAY_BATCH_LIMIT} song plays can be logged at once."
+            },
+            status=400,
         )
 
-        # Let the user know we're successful - send the song back
+    # Validate each one in turn
 
-        return JsonResponse(song_play_serial.data, status=200, safe=False)
+    results = []
+    plays = []
+    play_indexes = []
 
-    else:
-        return JsonResponse(serializer.errors, status=400)
+    for (index, item) in enumerate(data):
+        serializer = SimpleSongPlaySerializer(data=item)
+        if serializer.is_valid():
+            plays.append(serializer.validated_data)
+            play_indexes.append(index)
+            results.append(None)
+        else:
+            results.append(
+                {
+                    "index": index,
+                    "result": BulkSongPlayLogger.INVALID,
+                    "errors": serializer.errors,
+                }
+            )
+
+    # Log the valid ones
 
+    for (play_index, result) in zip(
+        play_indexes, BulkSongPlayLogger().log(request.user, plays)
+    ):
+        result["index"] = play_index
+        results[play_index] = result
 
-class ArtistViewSet(viewsets.ReadOnlyModelViewSet):
+    created = sum(
+        1 for result in results if result["result"] == BulkSongPlayLogger.CREATED
+    )
+    return JsonResponse({"created": created, "results": results}, status=200)
+
+
+class ArtistViewSet(FieldSelectionViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     Read only artists viewset.
     """
@@ -191,7 +395,7 @@ class ArtistViewSet(viewsets.ReadOnlyModelViewSet):
     lookup_value_regex = ".*"
 
 
-class StationViewSet(viewsets.ReadOnlyModelViewSet):
+class StationViewSet(FieldSelectionViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     Read only station viewset.
     """
@@ -201,12 +405,12 @@ class StationViewSet(viewsets.ReadOnlyModelViewSet):
     lookup_field = "name"
 
 
-class SongViewSet(viewsets.ReadOnlyModelViewSet):
+class SongViewSet(FieldSelectionViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     Read only songs viewset.
     """
 
-    queryset = Song.objects.all()
+    queryset = Song.objects.prefetch_related("artists")
     serializer_class = SongSerializer
     lookup_field = "song"
     lookup_value_regex = ".*"
@@ -224,11 +428,57 @@ class SongViewSet(viewsets.ReadOnlyModelViewSet):
         except:
             raise Http404
 
-        song = get_object_or_404(Song, display_artist=artist, title=title)
+        song = (
+            Song.objects.filter(match_key=song_match_key(artist, title))
+            .order_by("pk")
+            .first()
+        )
+        if not song:
+            raise Http404
+
         return song
 
 
-class MarketingLinerList(generics.ListAPIView):
+class Search(APIView):
+    """
+    Search as you type over songs and artists.
+    """
+
+    def get(self, request, **kwargs):
+
+        # Read in what the user has typed and how much they want back
+
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            raise ValidationError("A search term (q) must be supplied.")
+
+        try:
+            limit = int(
+                request.query_params.get("limit", settings.SEARCH_DEFAULT_LIMIT)
+            )
+        except ValueError:
+            raise ValidationError("The limit must be a number.")
+
+        limit = max(1, min(limit, settings.SEARCH_MAX_LIMIT))
+
+        # Perform the search
+
+        search = CatalogueSearch()
+        context = {"request": request}
+
+        return Response(
+            {
+                "songs": SongSearchSerializer(
+                    search.songs(query, limit), many=True, context=context
+                ).data,
+                "artists": ArtistSearchSerializer(
+                    search.artists(query, limit), many=True, context=context
+                ).data,
+            }
+        )
+
+
+class MarketingLinerList(FieldSelectionViewMixin, generics.ListAPIView):
     """
     Lists marketing liners (filtered by station).
     """
@@ -240,11 +490,11 @@ class MarketingLinerList(generics.ListAPIView):
         Returns the list of liners associated with a station.
         """
 
-        station = get_object_or_404(Station, name=self.kwargs["station_name"])
+        station = StationRegistry().get_or_404(self.kwargs["station_name"])
         return MarketingLiner.objects.filter(station=station)
 
 
-class SongPlayList(generics.ListAPIView):
+class SongPlayList(FieldSelectionViewMixin, generics.ListAPIView):
     """
     Songplay list. Filters by station, start, end and limits.
     """
@@ -256,7 +506,7 @@ class SongPlayList(generics.ListAPIView):
         Returns the song plays for a station.
         """
 
-        station = get_object_or_404(Station, name=self.kwargs["station_name"])
+        station = StationRegistry().get_or_404(self.kwargs["station_name"])
 
         # Check (or default) our start and end time
 
@@ -284,15 +534,31 @@ class SongPlayList(generics.ListAPIView):
                     raise ValidationError("Invalid start and/or end time supplied.")
 
         return (
-            SongPlay.objects.all()
+            SongPlay.objects.select_related("song", "station")
+            .prefetch_related("song__artists")
             .filter(station=station)
             .filter(date_time__gte=start)
             .filter(date_time__lte=end)
             .order_by("-date_time")
         )
 
+    def list(self, request, *args, **kwargs):
+        """
+        Lists the song plays, skipping DRF's serialisers where we can.
+        """
+
+        # Paged results and field selection go the long way round
+
+        if self.paginator.get_page_size(request) or {"fields", "expand"} & set(
+            request.query_params
+        ):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(song_plays_data(queryset, request))
 
-class EpgCurrent(generics.RetrieveAPIView):
+
+class EpgCurrent(FieldSelectionViewMixin, generics.RetrieveAPIView):
     """
     Obtains the current EPG entry for a station.
     """
@@ -307,7 +573,7 @@ class EpgCurrent(generics.RetrieveAPIView):
         return EpgEntry.objects.all()
 
     def get_object(self):
-        station = get_object_or_404(Station, name=self.kwargs["station_name"])
+        station = StationRegistry().get_or_404(self.kwargs["station_name"])
         now = datetime.today()
         return (
             self.get_queryset()
@@ -330,22 +596,14 @@ class EpgDay(APIView):
 
         # Read in the station and day from the user
 
-        station = get_object_or_404(Station, name=self.kwargs["station_name"])
+        station = StationRegistry().get_or_404(self.kwargs["station_name"])
 
         # Perform the search
 
-        epg = {}
-
-        for day in range(0, 7):
-            epg[day] = EpgEntrySerializer(
-                EpgEntry.objects.filter(station=station, day=day).order_by("start"),
-                many=True,
-            ).data
+        return Response(epg_days_data(station.id))
 
-        return Response(epg)
 
-
-class PresenterList(generics.ListAPIView):
+class PresenterList(FieldSelectionViewMixin, generics.ListAPIView):
     """Lists the presenters, filtered by station."""
 
     serializer_class = PresenterSerializer
@@ -353,10 +611,28 @@ class PresenterList(generics.ListAPIView):
     def get_queryset(self):
         """Returns the list of presenters associated with a station."""
 
-        station = get_object_or_404(Station, name=self.kwargs["station_name"])
+        station = StationRegistry().get_or_404(self.kwargs["station_name"])
         return Presenter.objects.filter(station=station).order_by("name")
 
 
+class NowPlayingDashboard(APIView):
+    """
+    Provides the now playing for every station (or those named in
+    ?stations=) in one go.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        """
+        Now playing for several stations.
+        """
+
+        station_ids = StationRegistry().ids(request.GET.get("stations"))
+        return JsonResponse(now_playing_data(station_ids, request), safe=False)
+
+
 class NowPlayingPlain(APIView):
     """
     Provides a plain text now playing view for a given station.
@@ -370,15 +646,66 @@ class NowPlayingPlain(APIView):
         Plain text view of the now playing song for a station.
         """
 
-        station = get_object_or_404(Station, name=station_name)
+        station = StationRegistry().get_or_404(station_name)
 
-        songplay = (
-            SongPlay.objects.filter(station=station).order_by("-date_time").first()
-        )
+        current = current_play(station.id)
 
-        if songplay:
-            return HttpResponse(
-                f"{songplay.song.display_artist} - {songplay.song.title}"
-            )
+        if current:
+            response = HttpResponse(current[1])
+            response["X-Song-Play-ID"] = current[0]
+            return response
         else:
             raise Http404
+
+
+async def now_playing_poll(request, station_name):
+    """
+    Long polls the plain text now playing for a station.
+
+    Listeners pass the ID of the song play they have (from X-Song-Play-ID)
+    and we hold on to the request until a new song's played. A 304 is
+    returned if nothing changes within NOW_PLAYING_POLL_TIMEOUT seconds.
+    """
+
+    station = await sync_to_async(StationRegistry().get_or_404)(station_name)
+
+    try:
+        since = int(request.GET["since"])
+    except (KeyError, ValueError):
+        since = None
+
+    play = await wait_for_play(station.id, since, settings.NOW_PLAYING_POLL_TIMEOUT)
+    if not play:
+        return HttpResponseNotModified()
+
+    (play_id, text) = play
+    response = HttpResponse(text)
+    response["X-Song-Play-ID"] = play_id
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+async def now_playing_stream(request, station_name):
+    """
+    Streams the now playing for a station as server-sent events.
+    """
+
+    station = await sync_to_async(StationRegistry().get_or_404)(station_name)
+
+    # Listeners reconnecting tell us the last play they had
+
+    last_event_id = request.headers.get("Last-Event-ID") or request.GET.get(
+        "last_event_id"
+    )
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    response = StreamingHttpResponse(
+        now_playing_events(station.id, last_event_id),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response